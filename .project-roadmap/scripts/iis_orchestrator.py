@@ -37,15 +37,25 @@ if sys.platform == "win32":
 
 import argparse
 import concurrent.futures
+import contextlib
 import datetime
+import functools
+import gzip
 import json
 import logging
+import math
 import os
+import queue
+import random
 import re
 import shutil
+import socket
+import sqlite3
 import subprocess
+import tempfile
 import threading
 import time
+import zlib
 from pathlib import Path
 
 # ── CONFIG ──────────────────────────────────────────────────────────────────
@@ -59,9 +69,44 @@ META_PATH = ISSUES_DB_ROOT / "_meta.json"
 ROADMAP_PATH = ISSUES_DB_ROOT / "_roadmap.json"
 REPORTS_DIR = ISSUES_DB_ROOT / "reports"
 STATUS_FILE = SCRIPTS_DIR / "orchestrator-status.json"
+STATUS_HISTORY_FILE = SCRIPTS_DIR / "orchestrator-status-history.jsonl"
+STATUS_WRITE_DEBOUNCE_SECS = 2.0  # coalesce status writes within this window
+STATUS_RING_SIZE = 50             # commits/errors/files kept in the status file
+EVENTS_FILE = SCRIPTS_DIR / "orchestrator-events.jsonl"
+EVENTS_ENABLED = True
+EVENTS_MAX_BYTES = 20 * 1024 * 1024  # rotate the event log past this size
+EVENTS_BACKUPS = 3                # keep orchestrator-events.jsonl.1 .. .3
+EVENTS_QUEUE_MAX = 10000          # events beyond this are dropped, never block
+METRICS_TEXTFILE = SCRIPTS_DIR / "orchestrator.prom"
+METRICS_TEXTFILE_INTERVAL = 15    # seconds between textfile rewrites
+METRICS_DURATION_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+TRACES_DIR = SCRIPTS_DIR / "traces"
+TRACES_KEEP = 20                  # newest trace files kept in TRACES_DIR
 LOG_FILE = SCRIPTS_DIR / "orchestrator.log"
 CHAIN_CONTEXT_DIR = SCRIPTS_DIR / "chain-context"
 TIMEOUT_HISTORY_FILE = CHAIN_CONTEXT_DIR / "_timeout_history.json"
+COMMIT_INDEX_FILE = SCRIPTS_DIR / "_commit_index.json"
+TOKEN_LEDGER_FILE = SCRIPTS_DIR / "_token_ledger.jsonl"
+CODE_INDEX_FILE = SCRIPTS_DIR / "_code_index.json"
+DUP_INDEX_FILE = SCRIPTS_DIR / "_dup_index.json"
+ISSUE_SEARCH_INDEX_FILE = SCRIPTS_DIR / "_issue_search_index.json"
+OUTBOX_FILE = SCRIPTS_DIR / "_outbox.json"
+HEARTBEAT_FILE = SCRIPTS_DIR / "orchestrator-heartbeat.json"
+WORK_QUEUE_DB = Path(os.environ.get("IIS_WORK_QUEUE_DB") or SCRIPTS_DIR / "_work_queue.db")
+WORK_QUEUE_LEASE_SECS = 15 * 60       # expiry if the holder stops heartbeating
+WORK_QUEUE_HEARTBEAT_SECS = 60
+WORK_QUEUE_MAX_ATTEMPTS = 4           # failures before an item is parked as "failed"
+WORK_QUEUE_RETRY_BASE_SECS = 3600     # backoff: 1h, 2h, 4h ... per failed attempt
+WORK_QUEUE_RETRY_MAX_SECS = 7 * 86400
+CODE_INDEX_DIRS = ("mRemoteNG", "mRemoteNGTests", "ObjectListView")
+CODE_INDEX_TOP_K = 8              # files suggested to implementation agents
+REPO_MAP_DIR = SCRIPTS_DIR / "repo-map"
+REPO_MAP_MAX_CHARS = 6000         # cap on the map prepended to agent prompts
+REPO_MAP_KEEP = 5                 # newest per-commit maps kept on disk
+CHAIN_ARCHIVE_DIR = CHAIN_CONTEXT_DIR / "archive"
+CHAIN_ARCHIVE_AFTER_DAYS = 2      # loose chain-context files older than this get archived
+CHAIN_ARCHIVE_RETENTION_DAYS = 180  # drop archive segments older than this
+CHAIN_ARCHIVE_MAX_BYTES = 200 * 1024 * 1024  # and keep total archive under this
 TIMEOUT_ESCALATION_FACTOR = 1.5   # multiply timeout after each timeout failure
 TIMEOUT_MAX_MULTIPLIER = 4.0      # cap — don't let timeouts grow past 4x estimated
 TIMEOUT_MIN = 60                  # absolute minimum (seconds)
@@ -158,6 +203,10 @@ AGENT_CONFIG = {
 }
 AGENT_CHAIN = ["codex", "gemini", "claude"]  # fallback order: primary → secondary → tertiary
 AGENT_FALLBACK_ENABLED = True           # if primary fails, try the next agent in chain
+# Token budget for the previous-attempts block in fallback prompts (see
+# ChainContext.format_for_prompt) — keeps prompt size flat as chains grow.
+CHAIN_CONTEXT_TOKEN_BUDGET = {"codex": 6000, "gemini": 12000, "claude": 8000}
+CHAIN_CONTEXT_TOKEN_BUDGET_DEFAULT = 6000
 
 # ── DUAL-MODEL STRATEGY (all agents) ─────────────────────────────────────
 # Each agent uses a fast/cheap model for triage and a powerful model for implementation.
@@ -213,15 +262,12 @@ CLAUDE_MODEL_BY_TASK = {
     "analysis":             CLAUDE_MODEL_OPUS,   # deep analysis fallback
 }
 _session_agents_used = set()            # tracks which agents contributed (for co-author)
-_last_dispatch_timed_out = False        # set True by sub-agents on TimeoutExpired
-_last_dispatch_partial_output = ""      # partial stdout captured before timeout
 _committed_issues_cache = set()         # issue numbers already committed (dedup guard)
 
 # ── TOKEN USAGE TRACKING ─────────────────────────────────────────────────
 # Tracks token consumption per issue and per session for cost analysis
 _token_tracker = {
-    "current_issue": None,
-    "by_issue": {},       # issue_num -> {"input_tokens":N, "output_tokens":N, "cost_usd":F, "ops":[]}
+    "by_issue": {},       # issue_num -> {"input_tokens":N, "output_tokens":N, "cost_usd":F, "ops":N}
     "session_total": {"input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0},
 }
 
@@ -244,16 +290,22 @@ def _track_tokens(issue_num, operation, agent, model, usage_dict):
     key = str(issue_num) if issue_num else "_no_issue"
     if key not in _token_tracker["by_issue"]:
         _token_tracker["by_issue"][key] = {
-            "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "ops": []
+            "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "ops": 0
         }
     entry = _token_tracker["by_issue"][key]
     entry["input_tokens"] += inp
     entry["output_tokens"] += out
     entry["cost_usd"] += cost
-    entry["ops"].append({
-        "type": operation, "agent": agent, "model": model or "",
-        "input_tokens": inp, "output_tokens": out, "cost_usd": round(cost, 6),
-    })
+    entry["ops"] += 1   # per-op detail goes to the ledger, not memory
+    # Attribute to the dispatch running on this thread (see _agent_dispatch)
+    acc = getattr(_dispatch_local, "usage", None)
+    if acc is not None:
+        acc["input_tokens"] += inp
+        acc["output_tokens"] += out
+        acc["cost_usd"] += cost
+    _metric_inc("iis_tokens_total", inp, agent=agent, model=model or "", direction="input")
+    _metric_inc("iis_tokens_total", out, agent=agent, model=model or "", direction="output")
+    _metric_inc("iis_cost_usd_total", cost, agent=agent)
 
 
 def _get_issue_tokens(issue_num):
@@ -268,11 +320,120 @@ def _get_session_tokens():
 
 
 def _set_token_context(issue_num=None, operation=None):
-    """Set current issue/operation context for automatic token tracking in _agent_dispatch."""
+    """Set this thread's issue/operation context for token tracking in _agent_dispatch."""
     if issue_num is not None:
-        _token_tracker["current_issue"] = issue_num
+        _dispatch_local.issue = issue_num
     if operation is not None:
-        _token_tracker["current_operation"] = operation
+        _dispatch_local.operation = operation
+
+
+# ── TOKEN LEDGER ──────────────────────────────────────────────────────────
+# One JSON line per agent dispatch in TOKEN_LEDGER_FILE (append-only, never
+# loaded whole): ts, agent, model, task, issue, tokens, cost, duration,
+# outcome.  Codex/Gemini report tokens but not cost, so their cost is
+# estimated from MODEL_PRICING_USD_PER_MTOK (list prices — keep current).
+MODEL_PRICING_USD_PER_MTOK = {          # model -> (input, output) per 1M tokens
+    "gpt-5.3-codex": (1.25, 10.0),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gemini-3-pro-preview": (2.00, 12.0),
+    "gemini-2.5-flash": (0.30, 2.50),
+}
+
+
+class _DispatchState(threading.local):
+    """Per-thread agent dispatch state, so stages can dispatch concurrently."""
+    issue = None                # token/budget attribution (_set_token_context)
+    operation = "dispatch"
+    usage = None                # token accumulator for the current dispatch
+    timed_out = False           # set True by sub-agents on TimeoutExpired
+    partial_output = ""         # partial stdout captured before timeout
+    model = ""                  # model actually selected by the last dispatch
+    claude_usage = {}           # parsed from claude --output-format json
+    codex_usage = {}            # parsed from `codex exec --json`
+    cwd = None                  # agent working dir (a triage worktree); None = REPO_ROOT
+
+
+_dispatch_local = _DispatchState()
+_ledger_lock = threading.Lock()
+
+
+def _estimate_cost(model, input_tokens, output_tokens):
+    price = MODEL_PRICING_USD_PER_MTOK.get(model or "")
+    if not price:
+        return 0.0
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+def _ledger_append(record):
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    try:
+        with _ledger_lock, open(TOKEN_LEDGER_FILE, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        log.warning("    [LEDGER] Could not append: %s", e)
+
+
+def iter_ledger(since=None):
+    """Stream ledger records (optionally only those with ts >= since)."""
+    if not TOKEN_LEDGER_FILE.exists():
+        return
+    with open(TOKEN_LEDGER_FILE, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if since and rec.get("ts", "") < since:
+                continue
+            yield rec
+
+
+def aggregate_ledger(key_fn, since=None):
+    """{key: {"dispatches", "input_tokens", "output_tokens", "cost_usd",
+    "duration_s"}} over the ledger, in one streaming pass."""
+    out = {}
+    for rec in iter_ledger(since):
+        agg = out.setdefault(key_fn(rec), {"dispatches": 0, "input_tokens": 0,
+                                           "output_tokens": 0, "cost_usd": 0.0,
+                                           "duration_s": 0.0})
+        agg["dispatches"] += 1
+        agg["input_tokens"] += rec.get("input_tokens", 0)
+        agg["output_tokens"] += rec.get("output_tokens", 0)
+        agg["cost_usd"] += rec.get("cost_usd", 0.0)
+        agg["duration_s"] += rec.get("duration_s", 0.0)
+    return out
+
+
+_COST_GROUPINGS = {
+    "issue": lambda r: str(r.get("issue") or "-"),
+    "agent": lambda r: f"{r.get('agent', '?')}/{r.get('model') or '?'}",
+    "day": lambda r: r.get("ts", "")[:10],
+    "outcome": lambda r: r.get("outcome", "?"),
+}
+
+
+def show_cost(group_by=None, since_days=None, top=20):
+    """`cost` subcommand: ledger totals grouped by issue, agent, day, outcome."""
+    since = None
+    if since_days:
+        since = (datetime.datetime.now()
+                 - datetime.timedelta(days=since_days)).isoformat(timespec="seconds")
+    groupings = [group_by] if group_by else list(_COST_GROUPINGS)
+    print()
+    print("=== Token / Cost Ledger ===" + (f"  (last {since_days} days)" if since_days else ""))
+    for name in groupings:
+        rows = aggregate_ledger(_COST_GROUPINGS[name], since)
+        if not rows:
+            print("  Ledger is empty.")
+            break
+        total = sum(r["cost_usd"] for r in rows.values())
+        print(f"\n  By {name}:  (total ${total:.2f})")
+        order = sorted(rows.items(), key=lambda kv: kv[0] if name == "day" else -kv[1]["cost_usd"])
+        for key, r in order[:top]:
+            print(f"    {key:<36} ${r['cost_usd']:>9.4f}  {r['dispatches']:>5} calls  "
+                  f"{r['input_tokens']:>11,} in  {r['output_tokens']:>9,} out  "
+                  f"{r['duration_s'] / 60:>7.1f} min")
+    print()
 
 
 # Resolve full paths to CLI tools (Windows needs .CMD extension for subprocess)
@@ -280,6 +441,60 @@ GEMINI_CMD = shutil.which("gemini") or "gemini"
 CODEX_CMD = shutil.which("codex") or "codex"
 
 
+# ── BUDGET CONTROL ──────────────────────────────────────────────────────────
+# --max-cost / --max-cost-per-issue ceilings, checked before every dispatch
+# against the running totals _track_tokens keeps (two dict lookups, O(1)).
+# Past BUDGET_DOWNGRADE_AT of a ceiling, dispatches use the cheap model of
+# each agent and flux_issues skips BUDGET_SKIP_PRIORITIES; at the ceiling
+# dispatches are refused and the issue/warning loops stop.
+BUDGET_DOWNGRADE_AT = 0.8
+BUDGET_SKIP_PRIORITIES = ("P3-enhancement", "P4-debt")
+BUDGET_CHEAP_MODELS = {
+    "codex": CODEX_MODEL_FAST,
+    "gemini": GEMINI_MODEL_FLASH,
+    "claude": CLAUDE_MODEL_SONNET,
+}
+BUDGET_CHEAP_CODEX_REASONING = "medium"
+_budget = {"max_cost": None, "max_cost_per_issue": None, "state": "ok"}
+
+
+def configure_budget(max_cost=None, max_cost_per_issue=None):
+    _budget.update(max_cost=max_cost, max_cost_per_issue=max_cost_per_issue, state="ok")
+    if max_cost or max_cost_per_issue:
+        log.info("  [BUDGET] max cost $%s total, $%s per issue",
+                 max_cost or "-", max_cost_per_issue or "-")
+
+
+def budget_state(issue_num=None):
+    """"ok", "downgrade" or "exhausted" for the session and (if given) issue."""
+    state = "ok"
+    for limit, spent in (
+        (_budget["max_cost"], _token_tracker["session_total"]["cost_usd"]),
+        (_budget["max_cost_per_issue"] if issue_num else None,
+         (_token_tracker["by_issue"].get(str(issue_num)) or {}).get("cost_usd", 0.0)),
+    ):
+        if not limit:
+            continue
+        if spent >= limit:
+            return "exhausted"
+        if spent >= limit * BUDGET_DOWNGRADE_AT:
+            state = "downgrade"
+    return state
+
+
+def _session_budget_state():
+    """Session-level state; logs/emits once per transition."""
+    state = budget_state()
+    if state != _budget["state"]:
+        _budget["state"] = state
+        spent = _token_tracker["session_total"]["cost_usd"]
+        log.warning("  [BUDGET] %s — $%.2f of $%.2f spent", state.upper(), spent,
+                    _budget["max_cost"] or 0)
+        emit_event("budget", state=state, spent_usd=round(spent, 4),
+                   max_cost=_budget["max_cost"])
+    return state
+
+
 # ── AGENT RATE-LIMIT TRACKING (persisted to disk) ────────────────────────
 _AGENT_RATE_FILE = SCRIPTS_DIR / "_agent_rate_limits.json"
 
@@ -409,6 +624,7 @@ def _save_timeout_history(history):
 
 def _record_duration(agent, task_type, seconds):
     """Record an actual completion time for an agent/task_type pair."""
+    _metric_observe("iis_agent_duration_seconds", seconds, agent=agent, task=task_type)
     h = _load_timeout_history()
     durations = h.setdefault("durations", {})
     agent_d = durations.setdefault(agent, {})
@@ -538,9 +754,550 @@ def setup_logging():
 log = setup_logging()
 
 
+# ── EVENT STREAM ────────────────────────────────────────────────────────────
+# Typed events (phase/dispatch/build/test/commit/push) appended as JSON lines
+# to EVENTS_FILE by a background writer thread.  emit_event() only enqueues,
+# so callers never wait on disk.  The file rotates at EVENTS_MAX_BYTES to
+# .1 .. .N; consumers tail it by byte offset (see orchestrator_supervisor).
+# Line schema: {"ts", "seq", "pid", "type", ...type-specific fields}
+_event_queue = queue.Queue(maxsize=EVENTS_QUEUE_MAX)
+_event_thread = None
+_event_lock = threading.Lock()
+_event_seq = 0
+_events_dropped = 0
+
+
+def emit_event(event_type, **fields):
+    """Queue one event for the JSONL stream.  Never blocks the caller."""
+    global _event_seq, _events_dropped
+    if not EVENTS_ENABLED:
+        return
+    with _event_lock:
+        _event_seq += 1
+        evt = {"ts": _now_iso(), "seq": _event_seq, "pid": os.getpid(),
+               "type": event_type, **fields}
+        if _event_thread is None:
+            _start_event_writer()
+    try:
+        _event_queue.put_nowait(evt)
+    except queue.Full:
+        _events_dropped += 1
+
+
+def _start_event_writer():
+    global _event_thread
+    _event_thread = threading.Thread(target=_event_writer_loop,
+                                     name="event-writer", daemon=True)
+    _event_thread.start()
+
+
+def _event_writer_loop():
+    while True:
+        batch = [_event_queue.get()]
+        while len(batch) < 500:
+            try:
+                batch.append(_event_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write_event_lines([json.dumps(e, ensure_ascii=False, default=str)
+                                for e in batch])
+        finally:
+            for _ in batch:
+                _event_queue.task_done()
+
+
+def _write_event_lines(lines):
+    try:
+        if EVENTS_FILE.exists() and EVENTS_FILE.stat().st_size >= EVENTS_MAX_BYTES:
+            _rotate_events()
+        with open(EVENTS_FILE, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    except OSError:
+        pass  # the event log is best-effort — never break the run over it
+
+
+def _rotate_events():
+    for i in range(EVENTS_BACKUPS - 1, 0, -1):
+        src = EVENTS_FILE.with_name(f"{EVENTS_FILE.name}.{i}")
+        if src.exists():
+            os.replace(src, EVENTS_FILE.with_name(f"{EVENTS_FILE.name}.{i + 1}"))
+    os.replace(EVENTS_FILE, EVENTS_FILE.with_name(f"{EVENTS_FILE.name}.1"))
+
+
+def flush_events(timeout=5.0):
+    """Wait (bounded) until queued events are on disk."""
+    deadline = time.monotonic() + timeout
+    while _event_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+# ── METRICS ─────────────────────────────────────────────────────────────────
+# Optional Prometheus-format counters/histograms (off by default).  Enabled by
+# --metrics-port (HTTP on 127.0.0.1 only) and/or --metrics-textfile (periodic
+# atomic rewrite of METRICS_TEXTFILE, for node_exporter's textfile collector).
+# While disabled, _metric_inc/_metric_observe return on a single None check.
+_metrics = None                 # {(name, labels): value | histogram dict}
+_metrics_lock = threading.Lock()
+_metrics_started = None
+_metrics_server = None
+_metrics_stop = threading.Event()
+
+_METRIC_HELP = {
+    "iis_tokens_total": ("counter", "Agent tokens consumed"),
+    "iis_cost_usd_total": ("counter", "Agent cost in USD"),
+    "iis_agent_duration_seconds": ("histogram", "Successful agent run duration"),
+    "iis_build_duration_seconds": ("histogram", "build.ps1 duration"),
+    "iis_builds_total": ("counter", "Builds by result"),
+    "iis_test_duration_seconds": ("histogram", "run-tests.ps1 duration"),
+    "iis_test_runs_total": ("counter", "Test runs by result"),
+    "iis_commits_total": ("counter", "Commits made by the orchestrator"),
+    "iis_issues_fixed_total": ("counter", "Issue fixes committed"),
+}
+
+
+def _metric_inc(name, value=1, **labels):
+    if _metrics is None:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _metrics[key] = _metrics.get(key, 0) + value
+
+
+def _metric_observe(name, value, **labels):
+    if _metrics is None:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        h = _metrics.get(key)
+        if h is None:
+            h = _metrics[key] = {"buckets": [0] * len(METRICS_DURATION_BUCKETS),
+                                 "sum": 0.0, "count": 0}
+        for i, bound in enumerate(METRICS_DURATION_BUCKETS):
+            if value <= bound:
+                h["buckets"][i] += 1
+        h["sum"] += value
+        h["count"] += 1
+
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in items)
+    return "{" + body + "}"
+
+
+def render_metrics():
+    """Current metrics in Prometheus text exposition format."""
+    with _metrics_lock:
+        snapshot = {k: (dict(v, buckets=list(v["buckets"])) if isinstance(v, dict) else v)
+                    for k, v in (_metrics or {}).items()}
+    lines = []
+    for name in sorted({k[0] for k in snapshot}):
+        kind, help_text = _METRIC_HELP.get(name, ("counter", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (n, labels), v in sorted(snapshot.items()):
+            if n != name:
+                continue
+            if kind == "histogram":
+                for bound, count in zip(METRICS_DURATION_BUCKETS, v["buckets"]):
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {v['count']}")
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {round(v['sum'], 3)}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {v['count']}")
+            else:
+                lines.append(f"{name}{_fmt_labels(labels)} {round(v, 6)}")
+    # Derived gauges: uptime and cost per committed fix
+    if _metrics_started is not None:
+        lines.append("# TYPE iis_uptime_seconds gauge")
+        lines.append(f"iis_uptime_seconds {round(time.time() - _metrics_started, 1)}")
+    fixed = sum(v for (n, _), v in snapshot.items() if n == "iis_issues_fixed_total")
+    cost = sum(v for (n, _), v in snapshot.items() if n == "iis_cost_usd_total")
+    lines.append("# TYPE iis_cost_per_fix_usd gauge")
+    lines.append(f"iis_cost_per_fix_usd {round(cost / fixed, 6) if fixed else 0}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_metrics_textfile():
+    try:
+        tmp = METRICS_TEXTFILE.with_suffix(".prom.tmp")
+        tmp.write_text(render_metrics(), encoding="utf-8")
+        os.replace(tmp, METRICS_TEXTFILE)
+    except OSError as e:
+        log.warning("    [METRICS] Could not write %s: %s", METRICS_TEXTFILE.name, e)
+
+
+def _metrics_textfile_loop():
+    while not _metrics_stop.wait(METRICS_TEXTFILE_INTERVAL):
+        _write_metrics_textfile()
+
+
+def start_metrics(port=None, textfile=False):
+    """Enable metric collection and start the requested exporters."""
+    global _metrics, _metrics_started, _metrics_server
+    import http.server
+
+    _metrics = {}
+    _metrics_started = time.time()
+    _metrics_stop.clear()
+    if port is not None:        # 0 = any free port
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = render_metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        _metrics_server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        threading.Thread(target=_metrics_server.serve_forever, name="metrics-http",
+                         daemon=True).start()
+        log.info("  [METRICS] Serving http://127.0.0.1:%d/metrics",
+                 _metrics_server.server_address[1])
+    if textfile:
+        threading.Thread(target=_metrics_textfile_loop, name="metrics-textfile",
+                         daemon=True).start()
+        log.info("  [METRICS] Writing %s every %ds", METRICS_TEXTFILE, METRICS_TEXTFILE_INTERVAL)
+
+
+def stop_metrics(textfile=False):
+    """Stop exporters (final textfile write if enabled)."""
+    global _metrics_server
+    _metrics_stop.set()
+    if textfile and _metrics is not None:
+        _write_metrics_textfile()
+    if _metrics_server is not None:
+        _metrics_server.shutdown()
+        _metrics_server.server_close()
+        _metrics_server = None
+
+
+# ── TRACING ─────────────────────────────────────────────────────────────────
+# Nested timing spans (flux → issue → chain step → dispatch/build/test/commit)
+# written as Chrome trace "complete" events to TRACES_DIR/trace_<ts>.json,
+# viewable in chrome://tracing or ui.perfetto.dev.  Each span is appended when
+# it closes; the file is a JSON array whose closing bracket is optional in
+# that format, so a crashed run still leaves a loadable trace.  Spans are
+# no-ops until start_trace() is called.
+_trace_file = None
+_trace_path = None
+_trace_lock = threading.Lock()
+_trace_t0 = 0.0
+_trace_local = threading.local()
+
+
+def start_trace():
+    """Open a new trace file for this run; returns its path."""
+    global _trace_file, _trace_path, _trace_t0
+    TRACES_DIR.mkdir(parents=True, exist_ok=True)
+    old = sorted(TRACES_DIR.glob("trace_*.json"))
+    for stale in old[:max(0, len(old) - TRACES_KEEP + 1)]:
+        stale.unlink(missing_ok=True)
+    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    _trace_path = TRACES_DIR / f"trace_{ts}.json"
+    _trace_t0 = time.perf_counter()
+    _trace_file = open(_trace_path, "w", encoding="utf-8")
+    _trace_file.write("[\n")
+    _trace_file.flush()
+    return _trace_path
+
+
+def stop_trace():
+    """Close open spans on this thread and finish the trace file."""
+    global _trace_file
+    _span_close(0)
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.write("{}]\n")
+            _trace_file.close()
+            _trace_file = None
+
+
+def _span_stack():
+    stack = getattr(_trace_local, "stack", None)
+    if stack is None:
+        stack = _trace_local.stack = []
+    return stack
+
+
+def _span_open(name, cat, args):
+    """Push a span; returns its stack depth (for _span_close)."""
+    stack = _span_stack()
+    stack.append((name, cat, args, time.perf_counter()))
+    return len(stack) - 1
+
+
+def _span_close(depth):
+    """Close every span at or above `depth` on this thread's stack."""
+    stack = _span_stack()
+    while len(stack) > depth:
+        name, cat, args, t_start = stack.pop()
+        if _trace_file is None:
+            continue
+        now = time.perf_counter()
+        evt = {"name": name, "cat": cat, "ph": "X",
+               "ts": round((t_start - _trace_t0) * 1e6),
+               "dur": round((now - t_start) * 1e6),
+               "pid": os.getpid(), "tid": threading.get_ident()}
+        if args:
+            evt["args"] = args
+        line = json.dumps(evt, ensure_ascii=False, default=str) + ",\n"
+        with _trace_lock:
+            if _trace_file is not None:
+                _trace_file.write(line)
+                _trace_file.flush()
+
+
+@contextlib.contextmanager
+def span(name, cat="fn", **args):
+    """Time a block as a nested trace span."""
+    if _trace_file is None:
+        yield
+        return
+    depth = _span_open(name, cat, args)
+    try:
+        yield
+    finally:
+        _span_close(depth)
+
+
+def traced(name=None, cat="fn", args_fn=None):
+    """Decorator: run the function inside a span.  Spans the function left
+    open (see trace_step) are closed with it."""
+    def deco(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            if _trace_file is None:
+                return fn(*a, **kw)
+            depth = _span_open(span_name, cat, args_fn(*a, **kw) if args_fn else {})
+            try:
+                return fn(*a, **kw)
+            finally:
+                _span_close(depth)
+        return wrapper
+    return deco
+
+
+def trace_step(name, cat="step", **args):
+    """Start a sequential sibling span (loop iteration): closes the previous
+    open span of the same category, then opens a new one.  The enclosing
+    traced() function closes the last one."""
+    if _trace_file is None:
+        return
+    stack = _span_stack()
+    for depth in range(len(stack) - 1, -1, -1):
+        if stack[depth][1] == cat:
+            _span_close(depth)
+            break
+    _span_open(name, cat, args)
+
+
+def _sleep(seconds, reason="sleep"):
+    """time.sleep that shows up in the trace."""
+    with span(reason, cat="sleep", seconds=seconds):
+        time.sleep(seconds)
+
+
+def load_trace(path):
+    """Parse a trace file (tolerates the missing ']' of an unfinished run)."""
+    text = path.read_text(encoding="utf-8").strip()
+    if not text.endswith("]"):
+        text = text.rstrip(",") + "]"
+    return [e for e in json.loads(text) if e.get("ph") == "X"]
+
+
+def profile_trace(events):
+    """Summarise a trace: totals, self time per span name, and the critical
+    path (longest root span, then repeatedly its longest child)."""
+    nodes = sorted(events, key=lambda e: (e["tid"], e["ts"], -e["dur"]))
+    children = {id(e): [] for e in nodes}
+    roots = []
+    stacks = {}
+    for e in nodes:
+        stack = stacks.setdefault(e["tid"], [])
+        while stack and e["ts"] >= stack[-1]["ts"] + stack[-1]["dur"]:
+            stack.pop()
+        if stack:
+            children[id(stack[-1])].append(e)
+        else:
+            roots.append(e)
+        stack.append(e)
+
+    by_name = {}
+    for e in nodes:
+        child_time = sum(c["dur"] for c in children[id(e)])
+        agg = by_name.setdefault(e["name"], {"count": 0, "total_us": 0, "self_us": 0})
+        agg["count"] += 1
+        agg["total_us"] += e["dur"]
+        agg["self_us"] += max(0, e["dur"] - child_time)
+
+    path = []
+    level = roots
+    while level:
+        top = max(level, key=lambda e: e["dur"])
+        path.append(top)
+        level = children[id(top)]
+
+    wall = 0
+    if nodes:
+        wall = max(e["ts"] + e["dur"] for e in nodes) - min(e["ts"] for e in nodes)
+    return {"wall_us": wall, "by_name": by_name, "critical_path": path}
+
+
+def show_profile(trace_path=None, top=15):
+    """`profile` subcommand: print critical path and top time sinks."""
+    if trace_path is None:
+        traces = sorted(TRACES_DIR.glob("trace_*.json")) if TRACES_DIR.exists() else []
+        if not traces:
+            print("No trace files found.  Run the orchestrator first.")
+            return
+        trace_path = traces[-1]
+    prof = profile_trace(load_trace(Path(trace_path)))
+    wall = prof["wall_us"] / 1e6
+    print()
+    print(f"=== Profile: {Path(trace_path).name} ===")
+    print(f"  Wall time: {datetime.timedelta(seconds=int(wall))}")
+
+    print("\n  Critical path:")
+    for depth, e in enumerate(prof["critical_path"]):
+        detail = ", ".join(f"{k}={v}" for k, v in (e.get("args") or {}).items())
+        print(f"    {'  ' * depth}{e['name']:<28} {e['dur'] / 1e6:>9.1f}s"
+              + (f"  ({detail})" if detail else ""))
+
+    print(f"\n  Top time sinks (self time):")
+    ranked = sorted(prof["by_name"].items(), key=lambda kv: kv[1]["self_us"], reverse=True)
+    for name, agg in ranked[:top]:
+        pct = agg["self_us"] * 100 / prof["wall_us"] if prof["wall_us"] else 0
+        print(f"    {name:<28} {agg['self_us'] / 1e6:>9.1f}s  {pct:5.1f}%  "
+              f"x{agg['count']}  (total {agg['total_us'] / 1e6:.1f}s)")
+    print()
+
+
+# ── HEARTBEAT ───────────────────────────────────────────────────────────────
+# Liveness channel for orchestrator_supervisor: a background thread rewrites
+# HEARTBEAT_FILE every HEARTBEAT_INTERVAL_SECS with the subprocesses in flight
+# (agent CLIs, build, tests) and their deadlines.  The supervisor tells a long
+# but healthy agent call (child still inside its timeout) from a wedged
+# process (beats stop) or a child that outlived its timeout (kill failed)
+# within a minute, instead of waiting for the status file to go stale.
+# Schema: {"pid", "ts", "seq", "interval", "phase", "task",
+#          "children": [{"pid", "cmd", "started", "deadline"}]}  (epoch seconds)
+HEARTBEAT_INTERVAL_SECS = 5
+
+
+class Heartbeat:
+    def __init__(self, path=None, interval=HEARTBEAT_INTERVAL_SECS, status=None):
+        self.path = Path(path or HEARTBEAT_FILE)
+        self.interval = interval
+        self.status = status
+        self.seq = 0
+        self._children = {}             # token -> child entry
+        self._next_token = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @contextlib.contextmanager
+    def child(self, pid, cmd, timeout):
+        """Register a subprocess for the duration of the block."""
+        now = time.time()
+        entry = {"pid": pid, "cmd": os.path.basename(str(cmd[0])) if cmd else "?",
+                 "started": round(now, 1), "deadline": round(now + timeout, 1) if timeout else None}
+        with self._lock:
+            self._next_token += 1
+            token = self._next_token
+            self._children[token] = entry
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                self._children.pop(token, None)
+
+    def snapshot(self):
+        with self._lock:
+            children = list(self._children.values())
+        data = self.status.data if self.status is not None else {}
+        self.seq += 1
+        return {"pid": os.getpid(), "ts": round(time.time(), 1), "seq": self.seq,
+                "interval": self.interval, "phase": data.get("current_phase"),
+                "task": data.get("current_task"), "children": children}
+
+    def beat(self):
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(self.snapshot(), default=str), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.debug("  [HEARTBEAT] %s", e)
+
+    def _loop(self):
+        while True:
+            self.beat()
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="heartbeat", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop beating and remove the file (a clean exit is not a hang)."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.path.unlink(missing_ok=True)
+
+
+_heartbeat = None
+
+
+def start_heartbeat(status=None):
+    global _heartbeat
+    if _heartbeat is None:
+        _heartbeat = Heartbeat(status=status)
+    _heartbeat.start()
+    return _heartbeat
+
+
+def stop_heartbeat():
+    global _heartbeat
+    if _heartbeat is not None:
+        _heartbeat.stop()
+        _heartbeat = None
+
+
+def heartbeat_child(pid, cmd, timeout):
+    """Context manager announcing a subprocess on the heartbeat (no-op when
+    no heartbeat is running, e.g. in triage workers and tests)."""
+    if _heartbeat is None:
+        return contextlib.nullcontext()
+    return _heartbeat.child(pid, cmd, timeout)
+
+
 # ── STATUS TRACKER ──────────────────────────────────────────────────────────
 class Status:
-    """Persistent status file — readable by any tool/agent at any time."""
+    """Persistent status file — readable by any tool/agent at any time.
+
+    Writes are coalesced (at most one per STATUS_WRITE_DEBOUNCE_SECS, the
+    rest flushed by a timer) and atomic (temp file + os.replace), so readers
+    never see partial JSON.  commits/errors/files_processed keep only the
+    last STATUS_RING_SIZE entries; "totals" has the full counts and every
+    entry is appended to STATUS_HISTORY_FILE."""
 
     def __init__(self):
         self.data = {
@@ -558,6 +1315,7 @@ class Status:
                 "skipped_wontfix": 0,
                 "skipped_duplicate": 0,
                 "skipped_needs_info": 0,
+                "pretriaged": 0,          # decided by a pre-triage rule (no agent call)
                 "commented_on_github": 0,
             },
             "warnings": {
@@ -569,27 +1327,91 @@ class Status:
             "commits": [],
             "errors": [],
             "files_processed": [],
+            "totals": {"commits": 0, "errors": 0, "files_processed": 0},
             "last_updated": None,
         }
         self._file_times = []  # track seconds per file for ETA
-
-    def save(self):
+        self._files_seen = set()
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._last_write = 0.0
+        self._timer = None
+
+    def save(self, force=False):
+        """Request a status write (coalesced unless force=True)."""
+        with self._lock:
+            self._dirty = True
+            wait = STATUS_WRITE_DEBOUNCE_SECS - (time.monotonic() - self._last_write)
+            if force or wait <= 0:
+                self._write()
+            elif self._timer is None:
+                self._timer = threading.Timer(wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Write now if anything changed since the last write."""
+        with self._lock:
+            if self._dirty:
+                self._write()
+
+    def _write(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
         self.data["last_updated"] = _now_iso()
         # Include session token totals in status
         self.data["token_usage"] = _get_session_tokens()
-        content = json.dumps(self.data, indent=2, ensure_ascii=False)
+        content = None
+        for attempt in range(3):
+            try:
+                content = json.dumps(self.data, ensure_ascii=False)
+                break
+            except RuntimeError:
+                # A worker thread mutated data mid-dump — try again
+                time.sleep(0.05)
+        if content is None:
+            log.warning("    [STATUS] Could not serialise status")
+            return
+        tmp = STATUS_FILE.with_suffix(".json.tmp")
         for attempt in range(3):
             try:
-                STATUS_FILE.write_text(content, encoding="utf-8")
+                tmp.write_text(content, encoding="utf-8")
+                os.replace(tmp, STATUS_FILE)
+                self._dirty = False
+                self._last_write = time.monotonic()
                 return
             except OSError:
                 time.sleep(0.5)
         log.warning("    [STATUS] Could not write status file (locked)")
 
+    def _record(self, kind, entry):
+        """Append to the ring buffer for `kind` and to the side log."""
+        ring = self.data[kind]
+        ring.append(entry)
+        del ring[:-STATUS_RING_SIZE]
+        self.data["totals"][kind] += 1
+        try:
+            with open(STATUS_HISTORY_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"kind": kind, "at": _now_iso(), "entry": entry},
+                                   ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
     def set_phase(self, phase):
+        self._end_phase()
         self.data["current_phase"] = phase
+        self._phase_t0 = time.monotonic()
+        emit_event("phase_start", phase=phase)
         self.save()
 
+    def _end_phase(self):
+        prev = self.data.get("current_phase")
+        if prev and prev != "done" and getattr(self, "_phase_t0", None) is not None:
+            emit_event("phase_end", phase=prev,
+                       duration_s=round(time.monotonic() - self._phase_t0, 1))
+            self._phase_t0 = None
+
     def set_task(self, **kwargs):
         self.data["current_task"] = {**kwargs, "started_at": _now_iso()}
         self.save()
@@ -599,13 +1421,12 @@ class Status:
         self.save()
 
     def add_commit(self, hash, message, tests_passed):
-        self.data["commits"].append(
-            {"hash": hash, "message": message, "tests_passed": tests_passed}
-        )
+        self._record("commits",
+                     {"hash": hash, "message": message, "tests_passed": tests_passed})
         self.save()
 
     def add_error(self, task, step, error):
-        self.data["errors"].append(
+        self._record("errors",
             {
                 "time": datetime.datetime.now().strftime("%H:%M:%S"),
                 "task": task,
@@ -615,6 +1436,12 @@ class Status:
         )
         self.save()
 
+    def add_file_processed(self, rel):
+        """Record a processed file once per session."""
+        if rel not in self._files_seen:
+            self._files_seen.add(rel)
+            self._record("files_processed", rel)
+
     def record_file_time(self, seconds):
         self._file_times.append(seconds)
 
@@ -626,17 +1453,24 @@ class Status:
         return str(datetime.timedelta(seconds=eta_s))
 
     def finish(self):
+        self._end_phase()
         self.data["running"] = False
         self.data["current_phase"] = "done"
-        self.clear_task()
+        self.data["current_task"] = None
+        self.save(force=True)
 
 
 # ── HELPERS ─────────────────────────────────────────────────────────────────
 STALE_PROCESSES = ["notepad.exe", "testhost.exe", "mstsc.exe"]
 
 
+@traced(cat="housekeeping")
 def kill_stale_processes():
-    """Kill processes that tests/Claude may have left open."""
+    """Kill processes that tests/Claude may have left open.  Skipped on a
+    thread running triage in its own worktree: the taskkill would also hit
+    the implement stage's running tests."""
+    if _dispatch_local.cwd is not None or not _git_owner:
+        return
     for proc in STALE_PROCESSES:
         try:
             subprocess.run(["taskkill", "//F", "//IM", proc],
@@ -649,8 +1483,20 @@ _ORCHESTRATOR_PROTECTED_FILES = {
     ".project-roadmap/scripts/iis_orchestrator.py",
     ".project-roadmap/scripts/orchestrator_supervisor.py",
     ".project-roadmap/scripts/orchestrator-status.json",
+    ".project-roadmap/scripts/orchestrator-status-history.jsonl",
+    ".project-roadmap/scripts/orchestrator-events.jsonl",
     ".project-roadmap/scripts/_agent_rate_limits.json",
     ".project-roadmap/scripts/_comment_rate.json",
+    ".project-roadmap/scripts/_commit_index.json",
+    ".project-roadmap/scripts/_token_ledger.jsonl",
+    ".project-roadmap/scripts/_code_index.json",
+    ".project-roadmap/scripts/_dup_index.json",
+    ".project-roadmap/scripts/_issue_search_index.json",
+    ".project-roadmap/scripts/_outbox.json",
+    ".project-roadmap/scripts/orchestrator-heartbeat.json",
+    ".project-roadmap/scripts/_work_queue.db",
+    ".project-roadmap/scripts/_work_queue.db-wal",
+    ".project-roadmap/scripts/_work_queue.db-shm",
 }
 
 # Infrastructure files that agents MUST NEVER modify.
@@ -673,7 +1519,7 @@ def _restore_triage_contamination(modified):
     """After triage timeout, revert any files the agent modified.
     Triage is read-only — it should only return JSON, never touch files.
     NEVER restores orchestrator infrastructure files or chain-context."""
-    if not modified:
+    if not modified or not _require_git_owner("restore"):
         return
     # Keep chain-context files AND orchestrator files (they are ours)
     restore = [f for f in modified
@@ -686,6 +1532,7 @@ def _restore_triage_contamination(modified):
                 capture_output=True, timeout=10,
                 cwd=str(REPO_ROOT),
             )
+            _invalidate_tree_snapshot()
             log.info("    [CHAIN] Restored %d contaminated files after triage timeout",
                      len(restore))
         except Exception as e:
@@ -736,7 +1583,8 @@ def _run_with_timeout(cmd, timeout, cwd=None, env=None, stdin_path=None):
         )
 
         try:
-            stdout, stderr = proc.communicate(timeout=timeout)
+            with heartbeat_child(proc.pid, cmd, timeout):
+                stdout, stderr = proc.communicate(timeout=timeout)
             return (proc.returncode, stdout or "", stderr or "")
         except subprocess.TimeoutExpired:
             # Kill the ENTIRE process tree, not just the root
@@ -753,6 +1601,8 @@ def _run_with_timeout(cmd, timeout, cwd=None, env=None, stdin_path=None):
     finally:
         if stdin_file:
             stdin_file.close()
+        # Agent CLIs run through here and may have edited the working tree
+        _invalidate_tree_snapshot()
 
 
 def _now_iso():
@@ -761,41 +1611,19 @@ def _now_iso():
 
 def _capture_post_timeout_state():
     """After a timeout, capture what the agent modified in the working tree.
-    Returns (modified_files: list[str], diff_summary: str)."""
-    modified = []
-    diff_summary = ""
+    Returns (modified_files: list[str], diff_summary: str).
+    Served from the memoised tree snapshot (one git status + one git diff)."""
     try:
-        r = subprocess.run(
-            ["git", "diff", "--name-only"],
-            capture_output=True, text=True, timeout=10,
-            cwd=str(REPO_ROOT), encoding="utf-8", errors="replace",
-        )
-        if r.stdout:
-            modified = [f.strip() for f in r.stdout.strip().splitlines() if f.strip()]
+        snap = tree_snapshot()
+        return snap.modified, snap.diff_stat()[:1000]
     except Exception:
-        pass
-    try:
-        r = subprocess.run(
-            ["git", "diff", "--stat"],
-            capture_output=True, text=True, timeout=10,
-            cwd=str(REPO_ROOT), encoding="utf-8", errors="replace",
-        )
-        if r.stdout:
-            diff_summary = r.stdout.strip()[:1000]
-    except Exception:
-        pass
-    return modified, diff_summary
+        return [], ""
 
 
 def _capture_full_diff():
     """Capture full git diff output (code changes). Truncated to 50KB."""
     try:
-        r = subprocess.run(
-            ["git", "diff"],
-            capture_output=True, text=True, timeout=30,
-            cwd=str(REPO_ROOT), encoding="utf-8", errors="replace",
-        )
-        return (r.stdout or "").strip()[:50000]
+        return tree_snapshot().diff()[:50000]
     except Exception:
         return ""
 
@@ -822,6 +1650,28 @@ def _parse_failed_tests(test_output):
     return failed
 
 
+# ── Prompt compaction helpers (ChainContext.format_for_prompt) ──
+_CHARS_PER_TOKEN = 4        # rough average for English + C# source
+
+
+def _estimate_tokens(text):
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _split_diff_by_file(diff_text):
+    """{path: diff block} for a unified `git diff` (one block per file)."""
+    blocks = {}
+    for block in re.split(r"(?m)^(?=diff --git )", diff_text or ""):
+        m = re.match(r"diff --git a/(\S+) b/(\S+)", block)
+        if m:
+            blocks[m.group(2)] = block.rstrip("\n")
+    return blocks
+
+
+def _clip(text, limit, marker="... [truncated]"):
+    return text if len(text) <= limit else text[:limit] + "\n" + marker
+
+
 class ChainContext:
     """Accumulates attempts from each agent in a chain run for JSON handoff."""
 
@@ -832,11 +1682,13 @@ class ChainContext:
         self.timeout_count = 0      # how many agents timed out in this run
         self.all_timed_out = False   # True if every agent timed out
         self.started_at = _now_iso()
+        self.progress = {}           # resume state; non-empty = persisted per attempt
 
     def add_attempt(self, agent, task, success, result=None, raw_output=None,
                     errors=None, files_modified=None, build_result=None,
                     test_result=None, timed_out=False, diff_summary=None,
-                    diff_output=None, test_output=None, failed_tests=None):
+                    diff_output=None, test_output=None, failed_tests=None,
+                    checkpoint=None):
         attempt = {
             "agent": agent,
             "task": task,
@@ -849,6 +1701,7 @@ class ChainContext:
             "test_result": test_result,
             "timed_out": timed_out,
             "diff_summary": diff_summary,
+            "checkpoint": checkpoint,   # git tree of the working tree after this attempt
             "timestamp": _now_iso(),
         }
         # On failure: save full context for next agent / future review
@@ -862,6 +1715,15 @@ class ChainContext:
         self.attempts.append(attempt)
         if timed_out:
             self.timeout_count += 1
+        if self.progress:
+            self.save_progress(step="attempted")
+
+    def best_checkpoint(self):
+        """Checkpoint of the most recent attempt that at least built, else None."""
+        for a in reversed(self.attempts):
+            if a.get("checkpoint") and a.get("build_result") == "OK":
+                return a["checkpoint"]
+        return None
 
     def to_dict(self):
         self.all_timed_out = (
@@ -890,12 +1752,112 @@ class ChainContext:
             encoding="utf-8",
         )
         log.info("    [CHAIN] Context saved to %s", fname)
+        _index_chain_context(path.stem, self.to_dict(), file=fname)
+        self.clear_progress()
         return path
 
-    def format_for_prompt(self):
-        """Format accumulated attempts as context for the next agent in the chain."""
+    # ── Crash-resume support ──
+    # While a chain runs, its context is rewritten to chain-context/_active/
+    # <type>_<id>.json after every step, so a restarted orchestrator can pick
+    # it up where the dead one stopped.  save() (chain finished) removes it.
+    @staticmethod
+    def _progress_path(task_type, task_id):
+        return CHAIN_CONTEXT_DIR / "_active" / f"{task_type}_{task_id}.json"
+
+    def save_progress(self, **state):
+        self.progress.update(state)
+        path = self._progress_path(self.task_type, self.task_id)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            data = self.to_dict()
+            data["progress"] = self.progress
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception as e:
+            log.warning("    [CHAIN] Could not persist progress: %s", e)
+
+    def clear_progress(self):
+        try:
+            self._progress_path(self.task_type, self.task_id).unlink()
+        except OSError:
+            pass
+
+    @classmethod
+    def load_progress(cls, task_type, task_id):
+        """Rebuild an unfinished chain from its progress file, or None."""
+        path = cls._progress_path(task_type, task_id)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        ctx = cls(task_type, task_id)
+        ctx.started_at = data.get("started_at", ctx.started_at)
+        ctx.attempts = data.get("attempts", [])
+        ctx.timeout_count = data.get("timeout_count", 0)
+        ctx.progress = data.get("progress", {})
+        return ctx
+
+    @classmethod
+    def unfinished(cls, task_type):
+        """Task ids of chains of this type that never reached save()."""
+        active = CHAIN_CONTEXT_DIR / "_active"
+        if not active.exists():
+            return []
+        prefix = f"{task_type}_"
+        return sorted(p.stem[len(prefix):] for p in active.glob(f"{prefix}*.json"))
+
+    # Detail levels tried in order until the block fits the token budget:
+    # (per-file diff chars, raw output chars, failed tests listed, error chars)
+    _PROMPT_DETAIL = ((3000, 1000, 10, 200), (1500, 400, 5, 120),
+                      (500, 0, 3, 0), (0, 0, 0, 0))
+
+    def format_for_prompt(self, agent=None, max_tokens=None, live_files=None):
+        """Format accumulated attempts as context for the next agent in the chain.
+
+        Compacted to fit max_tokens (default: CHAIN_CONTEXT_TOKEN_BUDGET for
+        the agent): repeated errors/failed tests are referenced instead of
+        repeated, and only the newest diff of each file still modified in the
+        working tree (live_files, default from tree_snapshot()) is kept."""
         if not self.attempts:
             return ""
+        if max_tokens is None:
+            max_tokens = CHAIN_CONTEXT_TOKEN_BUDGET.get(agent, CHAIN_CONTEXT_TOKEN_BUDGET_DEFAULT)
+        if live_files is None and any(a.get("diff_output") for a in self.attempts):
+            try:
+                live_files = tree_snapshot().modified
+            except Exception:
+                live_files = None       # unknown: keep every file's diff
+        text = ""
+        for detail in self._PROMPT_DETAIL:
+            text = self._render_attempts(detail, live_files)
+            if _estimate_tokens(text) <= max_tokens:
+                return text
+        # Still too big: keep the newest attempts, starting at an attempt
+        # boundary, and drop from the front.
+        head, end = "=== PREVIOUS AGENT ATTEMPTS ===", "\n=== END PREVIOUS ATTEMPTS ==="
+        marker = "\n... [older context dropped]"
+        body = text[len(head):len(text) - len(end)]
+        room = max_tokens * _CHARS_PER_TOKEN - len(head) - len(marker) - len(end)
+        kept = body[-room:] if room > 0 else ""
+        cut = kept.find("\n--- Attempt ")
+        if cut > 0:
+            kept = kept[cut:]
+        return head + marker + kept + end
+
+    def _render_attempts(self, detail, live_files):
+        diff_chars, raw_chars, max_tests, err_chars = detail
+        live = set(live_files) if live_files is not None else None
+
+        # Newest diff block per live file -> the attempt that owns it
+        newest_diff = {}
+        for i, a in enumerate(self.attempts):
+            for path, block in _split_diff_by_file(a.get("diff_output")).items():
+                if live is None or path in live:
+                    newest_diff[path] = (i, block)
+
+        seen_errors = {}            # errors text -> attempt number
+        seen_tests = {}             # (test, error) -> attempt number
         lines = ["=== PREVIOUS AGENT ATTEMPTS ==="]
         for i, a in enumerate(self.attempts, 1):
             status = "TIMEOUT" if a.get("timed_out") else ("SUCCESS" if a["success"] else "FAILED")
@@ -905,41 +1867,296 @@ class ChainContext:
                 lines.append("NOTE: This agent TIMED OUT. It may have done partial work.")
                 lines.append("Check the working tree — some files may already be modified.")
             if a.get("errors"):
-                lines.append(f"Errors: {a['errors']}")
+                err = str(a["errors"])
+                if err in seen_errors:
+                    lines.append(f"Errors: same as attempt {seen_errors[err]}")
+                else:
+                    seen_errors[err] = i
+                    lines.append(f"Errors: {err}")
             if a.get("build_result"):
                 lines.append(f"Build: {a['build_result']}")
             if a.get("test_result"):
                 lines.append(f"Tests: {a['test_result']}")
             if a.get("failed_tests"):
-                lines.append("Failed tests:")
-                for ft in a["failed_tests"][:10]:
+                new, repeated = [], {}
+                for ft in a["failed_tests"]:
+                    key = (ft["name"], ft.get("error", ""))
+                    if key in seen_tests:
+                        repeated[seen_tests[key]] = repeated.get(seen_tests[key], 0) + 1
+                    else:
+                        seen_tests[key] = i
+                        new.append(ft)
+                lines.append(f"Failed tests ({len(a['failed_tests'])}):")
+                for ft in new[:max_tests]:
                     lines.append(f"  - {ft['name']}")
-                    if ft.get("error"):
-                        lines.append(f"    Error: {ft['error'][:200]}")
+                    if ft.get("error") and err_chars:
+                        lines.append(f"    Error: {ft['error'][:err_chars]}")
+                if len(new) > max_tests:
+                    lines.append(f"  ... and {len(new) - max_tests} more")
+                for prev, n in sorted(repeated.items()):
+                    lines.append(f"  ({n} same as attempt {prev})")
             if a.get("files_modified"):
                 lines.append(f"Files modified: {', '.join(a['files_modified'])}")
             if a.get("diff_summary"):
                 lines.append(f"Diff summary:\n{a['diff_summary']}")
             if a.get("diff_output"):
-                # Include first 3000 chars of actual diff for next agent
-                lines.append(f"Code changes (truncated):\n{a['diff_output'][:3000]}")
-            if a.get("raw_output"):
-                lines.append(f"Output (truncated):\n{a['raw_output'][:1000]}")
+                mine = [(p, b) for p, (j, b) in sorted(newest_diff.items()) if j == i - 1]
+                if mine and diff_chars:
+                    lines.append("Code changes (files still modified):")
+                    for _, block in mine:
+                        lines.append(_clip(block, diff_chars))
+                elif not mine:
+                    lines.append("Code changes: reverted or superseded by a later attempt")
+            if a.get("raw_output") and raw_chars:
+                lines.append(f"Output (truncated):\n{a['raw_output'][:raw_chars]}")
         lines.append("\n=== END PREVIOUS ATTEMPTS ===")
         return "\n".join(lines)
 
 
+# ── CHAIN-CONTEXT ARCHIVE ───────────────────────────────────────────────────
+# Finished chain contexts are indexed by (issue, task_type, agent, outcome) in
+# CHAIN_ARCHIVE_DIR/_index.json.  Loose files older than CHAIN_ARCHIVE_AFTER_DAYS
+# are rolled into one gzip JSONL segment per day (YYYYMMDD.jsonl.gz); every
+# record is its own gzip member, so the index keeps (offset, length) and a
+# single record is read back with one seek + decompress.
+# Index schema: {"records": {"<id>": {"issue", "task_type", "agents", "outcome",
+#                "started_at", "file" | ("seg", "off", "len")}}}
+# ChainContext.save() only appends its entry to _index.journal.jsonl; the
+# journal is replayed on load and folded into _index.json by compaction.
+_chain_index = None
+_chain_index_lock = threading.Lock()
+
+
+def _chain_index_path():
+    return CHAIN_ARCHIVE_DIR / "_index.json"
+
+
+def _chain_journal_path():
+    return CHAIN_ARCHIVE_DIR / "_index.journal.jsonl"
+
+
+def _replay_chain_journal(idx):
+    """Apply journal lines (other processes may have appended) to idx."""
+    try:
+        with open(_chain_journal_path(), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    idx["records"][rec.pop("id")] = rec
+                except (ValueError, KeyError, AttributeError):
+                    continue        # torn last line after a crash
+    except OSError:
+        pass
+
+
+def _load_chain_index():
+    global _chain_index
+    if _chain_index is None:
+        try:
+            _chain_index = json.loads(_chain_index_path().read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            _chain_index = {"records": {}}
+        _replay_chain_journal(_chain_index)
+    return _chain_index
+
+
+def _save_chain_index():
+    """Write the in-memory index and retire the journal it now contains.
+    Never replays the journal: its lines may predate entries the caller has
+    just rewritten (e.g. a loose file moved into a segment)."""
+    path = _chain_index_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(_chain_index, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, path)
+    _chain_journal_path().unlink(missing_ok=True)
+
+
+def _chain_outcome(data):
+    if data.get("final_success"):
+        return "success"
+    if data.get("all_timed_out"):
+        return "timeout"
+    return "failed"
+
+
+def _chain_index_entry(data):
+    agents = []
+    for a in data.get("attempts", []):
+        if a.get("agent") and a["agent"] not in agents:
+            agents.append(a["agent"])
+    return {
+        "issue": str(data.get("task_id", "")),
+        "task_type": data.get("task_type", ""),
+        "agents": agents,
+        "outcome": _chain_outcome(data),
+        "started_at": data.get("started_at"),
+        "duration_s": _chain_duration(data),
+    }
+
+
+def _chain_duration(data):
+    """Wall-clock seconds of a chain run (agents + build + tests), or None."""
+    try:
+        start = datetime.datetime.fromisoformat(data["started_at"])
+        end = datetime.datetime.fromisoformat(data["finished_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return round((end - start).total_seconds(), 1)
+
+
+def _index_chain_context(record_id, data, **location):
+    """Add/replace one chain context in the index (location: file= or seg/off/len).
+    Appends one journal line; the full index is only rewritten by compaction."""
+    try:
+        with _chain_index_lock:
+            idx = _load_chain_index()
+            entry = _chain_index_entry(data)
+            entry.update(location)
+            idx["records"][record_id] = entry
+            CHAIN_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+            with open(_chain_journal_path(), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"id": record_id, **entry}, separators=(",", ":")) + "\n")
+    except Exception as e:
+        log.warning("    [ARCHIVE] Could not index %s: %s", record_id, e)
+
+
+def compact_chain_contexts(now=None):
+    """Roll old loose chain-context files into daily gzip segments, index
+    any unindexed ones, and apply retention.  Loose files are deleted only
+    after the index pointing at their archived copy is saved (a crash in
+    between leaves an orphan blob, never a lost record).  Returns number
+    archived."""
+    if not CHAIN_CONTEXT_DIR.exists():
+        return 0
+    now = now or datetime.datetime.now()
+    cutoff = (now - datetime.timedelta(days=CHAIN_ARCHIVE_AFTER_DAYS)).strftime("%Y%m%d")
+    archived = 0
+    archived_paths = []
+    with _chain_index_lock:
+        idx = _load_chain_index()
+        # Pick up lines other processes appended since we loaded — before any
+        # entry is rewritten below, so an old "file" line can't win.
+        _replay_chain_journal(idx)
+        records = idx["records"]
+        CHAIN_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+        for path in sorted(CHAIN_CONTEXT_DIR.glob("[0-9]*_*.json")):
+            day = path.name[:8]
+            if day >= cutoff and path.stem in records:
+                continue
+            try:
+                raw = path.read_text(encoding="utf-8")
+                data = json.loads(raw)
+            except (OSError, ValueError):
+                continue
+            entry = _chain_index_entry(data)
+            if day >= cutoff:
+                entry["file"] = path.name          # recent — index only
+            else:
+                seg = CHAIN_ARCHIVE_DIR / f"{day}.jsonl.gz"
+                line = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+                blob = gzip.compress((line + "\n").encode("utf-8"))
+                with open(seg, "ab") as f:
+                    off = f.tell()
+                    f.write(blob)
+                entry.update(seg=day, off=off, len=len(blob))
+                archived_paths.append(path)
+            records[path.stem] = entry
+        dropped = _apply_chain_retention(idx, now)
+        _save_chain_index()
+        for path in archived_paths:
+            path.unlink(missing_ok=True)
+            archived += 1
+    if archived or dropped:
+        log.info("  [ARCHIVE] %d chain contexts archived, %d segments dropped",
+                 archived, dropped)
+    return archived
+
+
+def _apply_chain_retention(idx, now):
+    """Delete segments past CHAIN_ARCHIVE_RETENTION_DAYS or beyond
+    CHAIN_ARCHIVE_MAX_BYTES (oldest first).  Caller holds the lock."""
+    oldest_kept = (now - datetime.timedelta(days=CHAIN_ARCHIVE_RETENTION_DAYS)).strftime("%Y%m%d")
+    segments = sorted(CHAIN_ARCHIVE_DIR.glob("*.jsonl.gz"))
+    total = sum(p.stat().st_size for p in segments)
+    drop = set()
+    for seg in segments:
+        day = seg.name[:8]
+        if day < oldest_kept or total > CHAIN_ARCHIVE_MAX_BYTES:
+            total -= seg.stat().st_size
+            seg.unlink()
+            drop.add(day)
+    if drop:
+        idx["records"] = {k: v for k, v in idx["records"].items()
+                          if v.get("seg") not in drop}
+    return len(drop)
+
+
+def _read_chain_record(entry):
+    if "seg" in entry:
+        with open(CHAIN_ARCHIVE_DIR / f"{entry['seg']}.jsonl.gz", "rb") as f:
+            f.seek(entry["off"])
+            return json.loads(gzip.decompress(f.read(entry["len"])).decode("utf-8"))
+    return json.loads((CHAIN_CONTEXT_DIR / entry["file"]).read_text(encoding="utf-8"))
+
+
+def query_chain_history(issue=None, task_type=None, agent=None, outcome=None,
+                        limit=None, load=True):
+    """Chain contexts matching all given filters, newest first.
+    With load=False only index entries are returned (no file I/O)."""
+    with _chain_index_lock:
+        records = list(_load_chain_index()["records"].items())
+    matches = []
+    for rid, e in records:
+        if issue is not None and e["issue"] != str(issue):
+            continue
+        if task_type and e["task_type"] != task_type:
+            continue
+        if agent and agent not in e["agents"]:
+            continue
+        if outcome and e["outcome"] != outcome:
+            continue
+        matches.append((rid, e))
+    matches.sort(key=lambda m: m[0], reverse=True)
+    if limit:
+        matches = matches[:limit]
+    if not load:
+        return [dict(e, id=rid) for rid, e in matches]
+    out = []
+    for rid, e in matches:
+        try:
+            out.append(_read_chain_record(e))
+        except (OSError, ValueError, KeyError):
+            continue
+    return out
+
+
+def chain_history_stats():
+    """{task_type: {outcome: count}} across the whole index."""
+    stats = {}
+    with _chain_index_lock:
+        for e in _load_chain_index()["records"].values():
+            by = stats.setdefault(e["task_type"], {})
+            by[e["outcome"]] = by.get(e["outcome"], 0) + 1
+    return stats
+
+
 def _run(cmd, timeout=60, cwd=None, capture=True):
-    """Run a command and return CompletedProcess."""
-    return subprocess.run(
-        cmd,
-        capture_output=capture,
-        text=True,
-        timeout=timeout,
-        cwd=cwd or str(REPO_ROOT),
-        encoding="utf-8",
-        errors="replace",
-    )
+    """Run a command and return CompletedProcess.
+    Anything other than a read-only git query may touch the working tree,
+    so it invalidates the memoised tree snapshot."""
+    if not (len(cmd) > 1 and cmd[0] == "git" and cmd[1] in _GIT_READONLY_SUBCOMMANDS):
+        _invalidate_tree_snapshot()
+    with heartbeat_child(None, cmd, timeout):
+        return subprocess.run(
+            cmd,
+            capture_output=capture,
+            text=True,
+            timeout=timeout,
+            cwd=cwd or str(REPO_ROOT),
+            encoding="utf-8",
+            errors="replace",
+        )
 
 
 def _extract_json(text):
@@ -1005,10 +2222,12 @@ def _extract_json(text):
 
 
 # ── CORE: BUILD & TEST ─────────────────────────────────────────────────────
+@traced("build", cat="build")
 def run_build(capture_output=False):
     """Run build.ps1.  Returns (ok: bool, output: str|None)."""
     log.info("    [BUILD] Running build.ps1 ...")
     kill_stale_processes()
+    t0 = time.monotonic()
     try:
         r = _run(BUILD_CMD, timeout=BUILD_TIMEOUT)
         full = (r.stdout or "") + "\n" + (r.stderr or "")
@@ -1017,18 +2236,29 @@ def run_build(capture_output=False):
             log.error("    [BUILD] FAILED (exit %d)", r.returncode)
         else:
             log.info("    [BUILD] OK")
+        elapsed = time.monotonic() - t0
+        emit_event("build", ok=ok, exit_code=r.returncode, duration_s=round(elapsed, 1))
+        _metric_observe("iis_build_duration_seconds", elapsed)
+        _metric_inc("iis_builds_total", result="ok" if ok else "fail")
         kill_stale_processes()
         return (ok, full) if capture_output else (ok, None)
     except subprocess.TimeoutExpired:
         log.error("    [BUILD] TIMEOUT (%ds)", BUILD_TIMEOUT)
+        emit_event("build", ok=False, timed_out=True,
+                   duration_s=round(time.monotonic() - t0, 1))
+        _metric_inc("iis_builds_total", result="timeout")
         kill_stale_processes()
         return (False, None)
     except Exception as e:
         log.error("    [BUILD] ERROR: %s", e)
+        emit_event("build", ok=False, error=str(e)[:200],
+                   duration_s=round(time.monotonic() - t0, 1))
+        _metric_inc("iis_builds_total", result="error")
         kill_stale_processes()
         return (False, None)
 
 
+@traced("test", cat="test")
 def run_tests(return_details=False):
     """Run non-UI tests via run-tests.ps1 (5 parallel groups + isolated fallback).
     Returns True/False if return_details=False.
@@ -1041,11 +2271,18 @@ def run_tests(return_details=False):
     kill_stale_processes()
 
     def _result(ok, out="", failed_list=None, phantom=False):
+        elapsed = time.time() - t_start
+        emit_event("test_end", ok=ok, phantom=phantom,
+                   failed=len(failed_list or []), duration_s=round(elapsed, 1))
+        _metric_observe("iis_test_duration_seconds", elapsed)
+        _metric_inc("iis_test_runs_total",
+                    result="phantom" if phantom else ("ok" if ok else "fail"))
         if return_details:
             return ok, out, failed_list or [], phantom
         return ok
 
     t_start = time.time()
+    emit_event("test_start")
     try:
         r = _run(TEST_CMD, timeout=TEST_TIMEOUT)
         elapsed = time.time() - t_start
@@ -1136,10 +2373,233 @@ def run_tests(return_details=False):
         return _result(False, str(e))
 
 
+# ── CORE: WORKING-TREE SNAPSHOT ─────────────────────────────────────────────
+# One `git status --porcelain=v2 -z` per working-tree generation replaces the
+# separate git status / git diff --name-only / git diff --stat calls that used
+# to run back to back.  The generation is bumped by anything that may touch
+# the tree (agent subprocesses, builds, mutating git commands), so a snapshot
+# is reused only while the tree is known to be unchanged.
+_GIT_READONLY_SUBCOMMANDS = {"status", "diff", "log", "rev-parse", "merge-base",
+                             "show", "ls-files", "cat-file", "rev-list",
+                             "for-each-ref"}
+_tree_generation = 0
+_tree_snapshot_cache = None             # (generation, TreeSnapshot)
+
+
+def _invalidate_tree_snapshot():
+    """Mark the working tree as possibly changed (next snapshot re-scans)."""
+    global _tree_generation
+    _tree_generation += 1
+
+
+class TreeSnapshot:
+    """Parsed `git status --porcelain=v2 -z` output plus an on-demand diff."""
+
+    def __init__(self, status_output):
+        self.staged = []        # tracked files with index changes (X != '.')
+        self.unstaged = []      # tracked files with worktree changes (Y != '.')
+        self.untracked = []
+        self.renamed = {}       # new path -> original path
+        self.unmerged = []
+        self._diff = None
+        self._parse(status_output or "")
+
+    def _parse(self, out):
+        fields = out.split("\0")
+        i = 0
+        while i < len(fields):
+            entry = fields[i]
+            i += 1
+            if not entry:
+                continue
+            kind = entry[0]
+            if kind == "?":
+                self.untracked.append(entry[2:])
+            elif kind == "1":
+                parts = entry.split(" ", 8)
+                self._add_tracked(parts[1], parts[8])
+            elif kind == "2":
+                parts = entry.split(" ", 9)
+                self._add_tracked(parts[1], parts[9])
+                if i < len(fields):
+                    self.renamed[parts[9]] = fields[i]
+                    i += 1
+            elif kind == "u":
+                parts = entry.split(" ", 10)
+                self.unmerged.append(parts[10])
+            # "!" (ignored) and "#" (headers) are not interesting
+
+    def _add_tracked(self, xy, path):
+        if xy[0] != ".":
+            self.staged.append(path)
+        if xy[1] != ".":
+            self.unstaged.append(path)
+
+    @property
+    def modified(self):
+        """Tracked files changed vs HEAD (staged or not), sorted."""
+        return sorted(set(self.staged) | set(self.unstaged) | set(self.unmerged))
+
+    @property
+    def has_changes(self):
+        return bool(self.staged or self.unstaged or self.untracked or self.unmerged)
+
+    def diff(self):
+        """Full `git diff HEAD` text (tracked changes), fetched once per snapshot."""
+        if self._diff is None:
+            r = _run(["git", "diff", "HEAD"], timeout=30)
+            self._diff = (r.stdout or "").strip()
+        return self._diff
+
+    def diff_stat(self):
+        """`git diff --stat`-style summary computed from diff() (no extra process)."""
+        stats = {}
+        current = None
+        in_hunk = False         # headers (---/+++) only come before the first @@
+        for line in self.diff().splitlines():
+            if line.startswith("diff --git "):
+                m = re.match(r"diff --git a/(.+?) b/(.+)$", line)
+                current = m.group(2) if m else line[11:]
+                stats.setdefault(current, [0, 0])
+                in_hunk = False
+            elif line.startswith("@@"):
+                in_hunk = current is not None
+            elif not in_hunk:
+                continue
+            elif line.startswith("+"):
+                stats[current][0] += 1
+            elif line.startswith("-"):
+                stats[current][1] += 1
+        if not stats:
+            return ""
+        width = max(len(p) for p in stats)
+        lines = []
+        for path, (ins, dels) in stats.items():
+            total = ins + dels
+            scale = min(1.0, 40 / total) if total else 1.0
+            bar = "+" * round(ins * scale) + "-" * round(dels * scale)
+            lines.append(f" {path:<{width}} | {total:>4} {bar}")
+        ins_total = sum(v[0] for v in stats.values())
+        del_total = sum(v[1] for v in stats.values())
+        lines.append(f" {len(stats)} files changed, {ins_total} insertions(+), "
+                     f"{del_total} deletions(-)")
+        return "\n".join(lines)
+
+
+def tree_snapshot(refresh=False):
+    """Return the working-tree snapshot for the current generation."""
+    global _tree_snapshot_cache
+    if (not refresh and _tree_snapshot_cache
+            and _tree_snapshot_cache[0] == _tree_generation):
+        return _tree_snapshot_cache[1]
+    r = _run(["git", "status", "--porcelain=v2", "-z", "--untracked-files=all"],
+             timeout=30)
+    if r.returncode != 0:
+        raise RuntimeError(f"git status failed: {(r.stderr or '')[:200]}")
+    snap = TreeSnapshot(r.stdout)
+    _tree_snapshot_cache = (_tree_generation, snap)
+    return snap
+
+
+# ── CORE: TRIAGE WORKTREE ───────────────────────────────────────────────────
+# Triage agents run in a detached `git worktree` at REPO_ROOT's HEAD, never
+# in REPO_ROOT itself: the implement stage may be editing, building, testing
+# and committing there at the same moment (pipeline overlap, triage workers
+# on the same host).  Whatever a triage agent writes into its worktree is
+# discarded by the next sync.  If no worktree can be made, in-process triage
+# falls back to holding _tree_lock (no overlap with implement).
+_tree_lock = threading.RLock()          # held while REPO_ROOT is edited/built/committed
+_triage_pool = []                       # idle triage worktree paths
+_triage_pool_lock = threading.Lock()
+_triage_trees_made = 0
+
+
+def _agent_cwd():
+    """Working directory for agent CLIs on this thread."""
+    return _dispatch_local.cwd or REPO_ROOT
+
+
+def _sync_triage_tree(path):
+    """Create `path` as a detached worktree at REPO_ROOT's HEAD, or reset an
+    existing one to it (tracked changes and untracked files dropped)."""
+    try:
+        head = _run(["git", "rev-parse", "HEAD"], timeout=30)
+        if head.returncode != 0:
+            return False
+        sha = head.stdout.strip()
+        if (path / ".git").exists():
+            r = _run(["git", "checkout", "-q", "--force", "--detach", sha],
+                     timeout=300, cwd=str(path))
+            if r.returncode == 0:
+                r = _run(["git", "clean", "-fdq"], timeout=120, cwd=str(path))
+        else:
+            _run(["git", "worktree", "prune"], timeout=30)
+            r = _run(["git", "worktree", "add", "-q", "--force", "--detach", str(path), sha],
+                     timeout=600)
+    except (OSError, subprocess.SubprocessError) as e:
+        log.warning("    [TRIAGE] Worktree %s unavailable: %s", path.name, e)
+        return False
+    if r.returncode != 0:
+        log.warning("    [TRIAGE] Worktree %s unavailable: %s", path.name,
+                    (r.stderr or "").strip()[:200])
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def triage_tree():
+    """A clean triage worktree for the duration of the block (one per
+    concurrent triage), or None when worktrees are unavailable."""
+    global _triage_trees_made
+    with _triage_pool_lock:
+        if _triage_pool:
+            path = _triage_pool.pop()
+        else:
+            _triage_trees_made += 1
+            # Workers on the owner's host must not share the owner's trees
+            role = "triage" if _git_owner else f"worker{os.getpid()}"
+            path = REPO_ROOT.parent / f"{REPO_ROOT.name}-{role}-{_triage_trees_made}"
+    ok = _sync_triage_tree(path)
+    try:
+        yield path if ok else None
+    finally:
+        with _triage_pool_lock:
+            _triage_pool.append(path)
+
+
+def remove_triage_trees():
+    """Delete this process's triage worktrees (workers, at exit)."""
+    with _triage_pool_lock:
+        paths, _triage_pool[:] = list(_triage_pool), []
+    for path in paths:
+        _run(["git", "worktree", "remove", "--force", str(path)], timeout=120)
+
+
+def _triage_contamination(tree):
+    """Files a triage agent modified.  In a worktree: report, then reset it
+    so the next agent starts clean.  In REPO_ROOT: revert them."""
+    if tree is None:
+        modified, _ = _capture_post_timeout_state()
+        _restore_triage_contamination(modified)
+        return modified
+    r = _run(["git", "status", "--porcelain", "--untracked-files=all"], timeout=30,
+             cwd=str(tree))
+    modified = [line[3:] for line in r.stdout.splitlines()] if r.returncode == 0 else []
+    if modified:
+        _sync_triage_tree(tree)
+    return modified
+
+
 # ── CORE: GIT ───────────────────────────────────────────────────────────────
+def _require_git_owner(op):
+    """Only the process holding orchestrator.lock may write to the git tree."""
+    if not _git_owner:
+        log.error("    [GIT] %s refused — this process is a triage worker, not the git owner", op)
+    return _git_owner
+
+
 def git_has_changes():
-    r = _run(["git", "status", "--porcelain"])
-    return bool((r.stdout or "").strip())
+    return tree_snapshot().has_changes
 
 
 def _guard_forbidden_files():
@@ -1147,12 +2607,7 @@ def _guard_forbidden_files():
     Returns list of files that were restored (for logging)."""
     restored = []
     try:
-        r = _run(["git", "diff", "--name-only", "HEAD"], timeout=10)
-        staged = (r.stdout or "").strip().splitlines()
-        # Also check unstaged
-        r2 = _run(["git", "diff", "--name-only"], timeout=10)
-        unstaged = (r2.stdout or "").strip().splitlines()
-        all_modified = set(staged + unstaged)
+        all_modified = tree_snapshot().modified
         for f in all_modified:
             if f in _AGENT_FORBIDDEN_FILES:
                 try:
@@ -1166,8 +2621,14 @@ def _guard_forbidden_files():
     return restored
 
 
+@traced("commit", cat="git")
 def git_commit(message):
     """Stage all + commit.  Returns commit hash or None."""
+    if not _require_git_owner("commit"):
+        return None
+    # Orchestrator-side writes (issue JSON, chain context) don't bump the tree
+    # generation — start from a fresh scan.
+    _invalidate_tree_snapshot()
     if not git_has_changes():
         return None
     # ── GUARD: restore any forbidden files agents may have modified ──
@@ -1210,29 +2671,65 @@ def git_commit(message):
         _run(["git", "commit", "-m", full_msg])
         r = _run(["git", "rev-parse", "HEAD"])
         commit_hash = (r.stdout or "").strip()
-        # Update dedup cache after successful commit
+        # Update dedup cache + persistent index after successful commit
         if issue_match:
             _committed_issues_cache.add(int(issue_match.group(1)))
+        if commit_hash:
+            _record_commit_in_index(commit_hash, full_msg)
+            emit_event("commit", hash=commit_hash, message=message,
+                       issue=int(issue_match.group(1)) if issue_match else None)
+            _metric_inc("iis_commits_total", kind="issue" if issue_match else "other")
+            if issue_match and message.startswith("fix("):
+                _metric_inc("iis_issues_fixed_total")
         return commit_hash
     except Exception as e:
         log.error("    [GIT] commit failed: %s", e)
         return None
 
 
+@traced("push", cat="git")
 def git_push():
+    """Push now (called by the outbox — queue pushes with get_outbox().push()).
+    Returns True on success."""
+    if not _require_git_owner("push"):
+        return False
+    t0 = time.monotonic()
     try:
-        _run(["git", "push"], timeout=60)
-        log.info("    [GIT] Pushed to origin")
+        r = _run(["git", "push"], timeout=60)
     except Exception as e:
         log.warning("    [GIT] Push failed: %s", e)
+        emit_event("push", ok=False, error=str(e)[:200])
+        return False
+    ok = r.returncode == 0
+    if ok:
+        log.info("    [GIT] Pushed to origin")
+    else:
+        log.warning("    [GIT] Push failed: %s", (r.stderr or "").strip()[:200])
+    emit_event("push", ok=ok, duration_s=round(time.monotonic() - t0, 1))
+    return ok
+
+
+_SOURCE_PATHSPECS = ("mRemoteNG/", "mRemoteNGTests/", "mRemoteNGSpecs/")
+
+
+def _tracked_source_paths():
+    """_SOURCE_PATHSPECS with at least one tracked file (`git checkout`
+    fails outright on a pathspec that matches nothing in the index)."""
+    r = _run(["git", "ls-files", "-z", "--", *_SOURCE_PATHSPECS], timeout=30)
+    tracked = {f.split("/", 1)[0] + "/" for f in (r.stdout or "").split("\0") if f}
+    return [p for p in _SOURCE_PATHSPECS if p in tracked]
 
 
 def git_restore():
     """Revert all uncommitted changes in source dirs + forbidden infra files."""
+    if not _require_git_owner("restore"):
+        return
     try:
         # Restore source code directories
-        _run(["git", "checkout", "--", "mRemoteNG/", "mRemoteNGTests/", "mRemoteNGSpecs/"])
-        _run(["git", "clean", "-fd", "--", "mRemoteNG/", "mRemoteNGTests/", "mRemoteNGSpecs/"])
+        tracked = _tracked_source_paths()
+        if tracked:
+            _run(["git", "checkout", "--", *tracked])
+        _run(["git", "clean", "-fd", "--", *_SOURCE_PATHSPECS])
         # Always restore forbidden infrastructure files (agents must never change these)
         for f in _AGENT_FORBIDDEN_FILES:
             try:
@@ -1244,42 +2741,622 @@ def git_restore():
         log.warning("    [GIT] Restore failed: %s", e)
 
 
-# ── DUPLICATE COMMIT PREVENTION ──────────────────────────────────────────
+# ── CORE: CHECKPOINTS ───────────────────────────────────────────────────────
+# Each chain attempt's working tree is captured as a git tree object, written
+# with `git write-tree` against a temporary copy of the index so the real
+# index and working tree are never touched.  Only the source dirs git_restore
+# reverts (_SOURCE_PATHSPECS) are captured and restored: orchestrator state
+# (timeout history, issue DB, chain-context, ...) is never rewound.  Trees are
+# pinned under refs/iis-checkpoints/<key>/<n> so `git gc` keeps them until
+# the chain ends.
+CHECKPOINT_REF_PREFIX = "refs/iis-checkpoints"
+
+
+def _git_with_index(args, index_path, timeout=60):
+    """Run git with GIT_INDEX_FILE pointing at a private index."""
+    env = dict(os.environ, GIT_INDEX_FILE=str(index_path))
+    return subprocess.run(["git"] + args, capture_output=True, text=True,
+                          timeout=timeout, cwd=str(REPO_ROOT), env=env,
+                          encoding="utf-8", errors="replace")
+
+
+def _present_source_paths():
+    """_SOURCE_PATHSPECS that exist on disk or in the index (`git add`
+    rejects a pathspec that matches nothing)."""
+    tracked = _tracked_source_paths()
+    return [p for p in _SOURCE_PATHSPECS if p in tracked or (REPO_ROOT / p).is_dir()]
+
+
+@traced("checkpoint", cat="git")
+def checkpoint_tree(key=None, seq=None):
+    """Snapshot the source dirs (tracked + untracked, minus ignored) as a tree;
+    everything else is taken from the index.  Returns the tree hash, or None
+    on failure.  With key/seq the tree is
+    pinned as refs/iis-checkpoints/<key>/<seq>."""
+    fd, tmp_index = tempfile.mkstemp(prefix="iis-checkpoint-", suffix=".index")
+    os.close(fd)
+    try:
+        # Seed from the real index so `git add` can reuse its stat cache
+        r = _run(["git", "rev-parse", "--git-path", "index"], timeout=10)
+        real_index = Path((r.stdout or "").strip())
+        if not real_index.is_absolute():
+            real_index = REPO_ROOT / real_index
+        if real_index.exists():
+            shutil.copyfile(real_index, tmp_index)
+        else:
+            os.unlink(tmp_index)
+        paths = _present_source_paths()
+        r = _git_with_index(["add", "-A", "--", *paths], tmp_index, timeout=120) if paths else None
+        if r is not None and r.returncode != 0:
+            log.warning("    [CHECKPOINT] git add failed: %s", (r.stderr or "")[:200])
+            return None
+        r = _git_with_index(["write-tree"], tmp_index)
+        tree = (r.stdout or "").strip()
+        if r.returncode != 0 or not tree:
+            log.warning("    [CHECKPOINT] write-tree failed: %s", (r.stderr or "")[:200])
+            return None
+    except Exception as e:
+        log.warning("    [CHECKPOINT] Capture failed: %s", e)
+        return None
+    finally:
+        try:
+            os.unlink(tmp_index)
+        except OSError:
+            pass
+    if key is not None and seq is not None:
+        _run(["git", "update-ref", f"{CHECKPOINT_REF_PREFIX}/{key}/{seq}", tree],
+             timeout=10)
+    return tree
+
 
-def _warm_committed_issues_cache(lookback=200):
-    """Pre-populate cache with all issue numbers from recent commits."""
+def restore_checkpoint(tree):
+    """Make the source dirs match a checkpoint (index is left at HEAD);
+    files outside _SOURCE_PATHSPECS are not touched.  Returns True on success."""
+    if not tree:
+        return False
     try:
-        r = _run(["git", "log", f"--max-count={lookback}", "--oneline"])
+        git_restore()
+        # Files the checkpoint deleted (git_restore just brought them back)
+        for f in checkpoint_files(tree, diff_filter="D"):
+            (REPO_ROOT / f).unlink(missing_ok=True)
+        r = _run(["git", "ls-tree", "--name-only", tree, "--", *_SOURCE_PATHSPECS], timeout=30)
+        present = [p for p in (r.stdout or "").splitlines() if p]
+        if present:
+            r = _run(["git", "checkout", tree, "--", *present], timeout=120)
+            if r.returncode != 0:
+                log.warning("    [CHECKPOINT] checkout %s failed: %s",
+                            tree[:10], (r.stderr or "")[:200])
+                return False
+            # Unstage: checkpoint contents stay in the working tree only
+            _run(["git", "reset", "-q", "--", *present], timeout=30)
+        log.info("    [CHECKPOINT] Restored working tree to %s", tree[:10])
+        return True
+    except Exception as e:
+        log.warning("    [CHECKPOINT] Restore failed: %s", e)
+        return False
+
+
+def checkpoint_files(tree, diff_filter=None):
+    """Source files that differ between HEAD and a checkpoint."""
+    cmd = ["git", "diff", "--name-only", "HEAD", tree]
+    if diff_filter:
+        cmd.append(f"--diff-filter={diff_filter}")
+    r = _run(cmd + ["--", *_SOURCE_PATHSPECS], timeout=30)
+    return [f for f in (r.stdout or "").splitlines() if f]
+
+
+def drop_checkpoints(key):
+    """Unpin all checkpoint refs for a chain (objects are left to git gc)."""
+    r = _run(["git", "for-each-ref", "--format=%(refname)",
+              f"{CHECKPOINT_REF_PREFIX}/{key}/"], timeout=10)
+    for ref in (r.stdout or "").split():
+        _run(["git", "update-ref", "-d", ref], timeout=10)
+
+
+# ── CODE INDEX ──────────────────────────────────────────────────────────────
+# BM25 index of CODE_INDEX_DIRS: types, members, UI strings (.resx values,
+# string literals) and settings keys -> file.  Entries are keyed by git blob
+# id, so an update re-extracts only files whose blob changed since the last
+# run.  Used to validate/augment triage's estimated_files and to give
+# implementation agents a head start (paths + signatures) in impl_prompt.
+# File schema: {"files": {path: {"blob", "len", "tf": {term: n}, "sigs": [...]}}}
+_CODE_INDEX_EXTS = (".cs", ".resx", ".settings")
+_CODE_INDEX_MAX_SIGS = 12
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+_CS_TYPE_RE = re.compile(
+    r"^\s*(?:(?:public|internal|protected|private|static|sealed|abstract|partial)\s+)*"
+    r"(class|interface|enum|struct|record)\s+(\w+)", re.M)
+_CS_MEMBER_RE = re.compile(
+    r"^\s*(?:(?:public|internal|protected|private|static|virtual|override|async|"
+    r"abstract|sealed|new|extern|unsafe)\s+)+[\w<>\[\],.? ]+?\s+(\w+)\s*(?:\(|\{|=>)", re.M)
+_CS_STRING_RE = re.compile(r'"([^"\\\n]{4,80})"')
+_RESX_DATA_RE = re.compile(r'<data name="([^"]+)"[^>]*>\s*<value>([^<]{0,200})</value>')
+_SETTINGS_RE = re.compile(r'<Setting Name="([^"]+)"')
+_TERM_RE = re.compile(r"[A-Za-z][A-Za-z0-9]*")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_STOP_TERMS = frozenset("""a an and are as at be by for from has have if in is it its
+not of on or that the this to was were will with when what which can cannot does
+do i my we you get set value public private internal protected static void return
+new var string int bool true false null using namespace class""".split())
+
+_code_index = None                       # last CodeIndex (its .files double as the cache)
+_code_index_lock = threading.Lock()
+
+
+def _bm25_scores(terms, postings, docs, avg_len, allowed=None):
+    """{doc: BM25 score}.  postings: term -> [(doc, tf)]; docs: doc -> {"len"}.
+    allowed (optional set) restricts scoring to those docs."""
+    n_docs = len(docs)
+    scores = {}
+    for term in set(terms):
+        posting = postings.get(term)
+        if not posting:
+            continue
+        idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+        for doc, tf in posting:
+            if allowed is not None and doc not in allowed:
+                continue
+            norm = 1 - _BM25_B + _BM25_B * docs[doc]["len"] / (avg_len or 1)
+            scores[doc] = scores.get(doc, 0.0) + idf * tf * (_BM25_K1 + 1) / (
+                tf + _BM25_K1 * norm)
+    return scores
+
+
+def _index_terms(text):
+    """Lower-case search terms: whole identifiers plus their camelCase parts."""
+    terms = []
+    for word in _TERM_RE.findall(text):
+        low = word.lower()
+        if low not in _STOP_TERMS and len(low) > 1:
+            terms.append(low)
+        parts = _CAMEL_RE.findall(word)
+        if len(parts) > 1:
+            terms.extend(p.lower() for p in parts
+                         if len(p) > 2 and p.lower() not in _STOP_TERMS)
+    return terms
+
+
+def _extract_symbols(path, text):
+    """(terms, signatures) for one source file."""
+    sigs, terms = [], _index_terms(Path(path).stem)
+    if path.endswith(".cs"):
+        for kind, name in _CS_TYPE_RE.findall(text):
+            sigs.append(f"{kind} {name}")
+            terms += _index_terms(name) * 3        # type names weigh more
+        for m in _CS_MEMBER_RE.finditer(text):
+            terms += _index_terms(m.group(1))
+            if len(sigs) < _CODE_INDEX_MAX_SIGS:
+                sigs.append(" ".join(m.group(0).split()).rstrip("({=> "))
+        for literal in _CS_STRING_RE.findall(text):
+            if " " in literal:                     # UI text, not keys/paths
+                terms += _index_terms(literal)
+    elif path.endswith(".resx"):
+        for name, value in _RESX_DATA_RE.findall(text):
+            terms += _index_terms(name) + _index_terms(value)
+    elif path.endswith(".settings"):
+        for name in _SETTINGS_RE.findall(text):
+            terms += _index_terms(name)
+            sigs.append(f"setting {name}")
+    return terms, sigs[:_CODE_INDEX_MAX_SIGS]
+
+
+def _read_blobs(shas):
+    """{sha: text} via one `git cat-file --batch` process."""
+    if not shas:
+        return {}
+    r = subprocess.run(["git", "cat-file", "--batch"], input="\n".join(shas).encode() + b"\n",
+                       capture_output=True, cwd=str(REPO_ROOT), timeout=300)
+    out, pos, blobs = r.stdout, 0, {}
+    while pos < len(out):
+        nl = out.index(b"\n", pos)
+        header = out[pos:nl].split()
+        pos = nl + 1
+        if len(header) < 3:                         # "<sha> missing"
+            continue
+        size = int(header[2])
+        blobs[header[0].decode()] = out[pos:pos + size].decode("utf-8", errors="replace")
+        pos += size + 1
+    return blobs
+
+
+class CodeIndex:
+    """In-memory BM25 view over the persisted per-file term counts."""
+
+    def __init__(self, files):
+        self.files = files
+        self.postings = {}
+        for path, entry in files.items():
+            for term, n in entry["tf"].items():
+                self.postings.setdefault(term, []).append((path, n))
+        self.avg_len = (sum(e["len"] for e in files.values()) / len(files)) if files else 0
+
+    def search(self, text, k=CODE_INDEX_TOP_K):
+        """Top-k (path, score) for free text (issue title/body)."""
+        scores = _bm25_scores(_index_terms(text), self.postings, self.files, self.avg_len)
+        return sorted(scores.items(), key=lambda kv: -kv[1])[:k]
+
+    def resolve(self, name):
+        """Map a (possibly partial or mis-rooted) path to indexed paths."""
+        name = name.replace("\\", "/").strip().lstrip("./")
+        if name in self.files:
+            return [name]
+        base = name.rsplit("/", 1)[-1].lower()
+        hits = [p for p in self.files if p.lower().endswith("/" + base) or p.lower() == base]
+        tail = [p for p in hits if p.endswith(name)]
+        return tail or hits
+
+    def signatures(self, path):
+        return self.files.get(path, {}).get("sigs", [])
+
+
+def update_code_index():
+    """Bring CODE_INDEX_FILE in line with the git index; returns CodeIndex.
+    Only files whose blob id changed are read and re-extracted."""
+    global _code_index
+    with _code_index_lock:
+        if _code_index is not None:
+            stored = _code_index.files
+        else:
+            try:
+                stored = json.loads(CODE_INDEX_FILE.read_text(encoding="utf-8")).get("files", {})
+            except (OSError, ValueError):
+                stored = {}
+        r = _run(["git", "ls-files", "-s", "--", *CODE_INDEX_DIRS], timeout=60)
+        if r.returncode != 0:
+            raise RuntimeError(f"git ls-files failed: {(r.stderr or '')[:200]}")
+        current = {}
         for line in (r.stdout or "").splitlines():
-            for m in re.finditer(r"#(\d+)", line):
-                _committed_issues_cache.add(int(m.group(1)))
-        log.info("  [DEDUP] Cached %d issue numbers from last %d commits",
-                 len(_committed_issues_cache), lookback)
+            meta, _, path = line.partition("\t")
+            if path.endswith(_CODE_INDEX_EXTS):
+                current[path] = meta.split()[1]
+        changed = {p: sha for p, sha in current.items()
+                   if stored.get(p, {}).get("blob") != sha}
+        if not changed and len(current) == len(stored):
+            files = stored                          # unchanged since last update
+        else:
+            files = {p: e for p, e in stored.items() if p in current and p not in changed}
+        blobs = _read_blobs(sorted(set(changed.values())))
+        for path, sha in changed.items():
+            terms, sigs = _extract_symbols(path, blobs.get(sha, ""))
+            tf = {}
+            for t in terms:
+                tf[t] = tf.get(t, 0) + 1
+            files[path] = {"blob": sha, "len": len(terms), "tf": tf, "sigs": sigs}
+        if files is not stored:
+            tmp = CODE_INDEX_FILE.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"files": files}, separators=(",", ":")),
+                           encoding="utf-8")
+            os.replace(tmp, CODE_INDEX_FILE)
+            log.info("  [INDEX] Code index: %d files (%d re-indexed)", len(files), len(changed))
+        if _code_index is None or files is not stored:
+            _code_index = CodeIndex(files)
+        return _code_index
+
+
+def relevant_files(issue, triage, k=CODE_INDEX_TOP_K):
+    """Validated estimated_files + BM25 suggestions for an issue.
+    Returns (files, prompt_block); falls back to triage's list on errors."""
+    estimated = list(triage.get("estimated_files") or [])
+    try:
+        index = update_code_index()
+    except Exception as e:
+        log.warning("  [INDEX] Code index unavailable: %s", e)
+        return estimated, ""
+    files, dropped = [], []
+    for name in estimated:
+        hits = index.resolve(name)
+        if hits:
+            files.extend(h for h in hits[:2] if h not in files)
+        else:
+            dropped.append(name)
+    query = " ".join([issue.get("title", ""), (issue.get("body") or "")[:3000],
+                      triage.get("approach", ""), " ".join(estimated)])
+    for path, _ in index.search(query, k):
+        if len(files) >= k:
+            break
+        if path not in files:
+            files.append(path)
+    if dropped:
+        log.info("    [INDEX] estimated_files not in repo: %s", ", ".join(dropped))
+    if not files:
+        return estimated, ""
+    lines = ["=== LIKELY RELEVANT FILES (from code index — verify before editing) ==="]
+    for path in files:
+        lines.append(path)
+        lines.extend(f"    {sig}" for sig in index.signatures(path)[:6])
+    return files, "\n".join(lines)
+
+
+# ── REPO MAP ────────────────────────────────────────────────────────────────
+# Compact orientation text (layout, key types per directory, test layout,
+# build/test commands) prepended to triage, implement and hygiene prompts so
+# agents don't spend turns listing directories.  One map per HEAD in
+# REPO_MAP_DIR/<sha>.md; per-directory lines are cached in _dirs.json by git
+# tree id, so a new commit only re-summarises the directories it touched.
+_repo_map_cache = None                   # (head, text)
+_repo_map_lock = threading.Lock()
+
+
+def _ls_tree(treeish, recursive=False):
+    """[(type, sha, path)] for a tree (paths relative to it)."""
+    cmd = ["git", "ls-tree"] + (["-r"] if recursive else []) + [treeish]
+    r = _run(cmd, timeout=60)
+    if r.returncode != 0:
+        return []
+    entries = []
+    for line in r.stdout.splitlines():
+        meta, _, path = line.partition("\t")
+        parts = meta.split()
+        if len(parts) == 3:
+            entries.append((parts[1], parts[2], path))
+    return entries
+
+
+def _summarize_dir(path, tree_sha, index):
+    """One map line for a directory: file counts by kind + main types."""
+    counts = {}
+    for _, _, rel in _ls_tree(tree_sha, recursive=True):
+        ext = os.path.splitext(rel)[1].lower() or "other"
+        if ext in (".cs", ".resx", ".xml", ".settings", ".config", ".json"):
+            counts[ext] = counts.get(ext, 0) + 1
+    kinds = ", ".join(f"{n} {ext}" for ext, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+    types = []
+    if index is not None:
+        for f in sorted(p for p in index.files if p.startswith(path + "/")):
+            for sig in index.signatures(f):
+                kind, _, name = sig.partition(" ")
+                if kind in ("class", "interface", "enum", "struct", "record") and \
+                        name not in types:
+                    types.append(name)
+    shown = ", ".join(types[:6]) + (f" (+{len(types) - 6})" if len(types) > 6 else "")
+    return f"  {path}/ ({kinds or 'no source'})" + (f" — {shown}" if shown else "")
+
+
+def repo_map(head=None):
+    """Repository map text for HEAD (generated once per commit)."""
+    global _repo_map_cache
+    head = head or (_run(["git", "rev-parse", "HEAD"], timeout=10).stdout or "").strip()
+    if not head:
+        return ""
+    if _repo_map_cache and _repo_map_cache[0] == head:
+        return _repo_map_cache[1]
+    path = REPO_MAP_DIR / f"{head[:12]}.md"
+    with _repo_map_lock:
+        if path.exists():
+            text = path.read_text(encoding="utf-8")
+            _repo_map_cache = (head, text)
+            return text
+        dirs_file = REPO_MAP_DIR / "_dirs.json"
+        try:
+            cached = json.loads(dirs_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            cached = {}
+        try:
+            index = update_code_index()
+        except Exception:
+            index = None
+
+        top = _ls_tree("HEAD")
+        lines = [f"Repository map @ {head[:8]}",
+                 "Top level: " + ", ".join(
+                     p + ("/" if t == "tree" else "") for t, _, p in top
+                     if t == "tree" or p.endswith((".sln", ".md", ".ps1")))]
+        fresh, redone = {}, 0
+        for root in CODE_INDEX_DIRS:
+            label = "Tests" if root.endswith("Tests") else "Project"
+            lines.append(f"\n{label} {root}/:")
+            for t, sha, name in _ls_tree(f"HEAD:{root}"):
+                if t != "tree" or name in ("bin", "obj", "Properties"):
+                    continue
+                key = f"{root}/{name}"
+                entry = cached.get(key)
+                if not entry or entry["tree"] != sha:
+                    entry = {"tree": sha, "line": _summarize_dir(key, sha, index)}
+                    redone += 1
+                fresh[key] = entry
+                lines.append(entry["line"])
+        lines += ["\nBuild: powershell.exe -NoProfile -ExecutionPolicy Bypass -File build.ps1",
+                  "Test:  powershell.exe -NoProfile -ExecutionPolicy Bypass -File "
+                  "run-tests.ps1 -NoBuild",
+                  "Test project: mRemoteNGTests (NUnit), mirrors mRemoteNG/ namespaces"]
+        text = "\n".join(lines)
+        if len(text) > REPO_MAP_MAX_CHARS:
+            text = text[:REPO_MAP_MAX_CHARS] + "\n... [map truncated]"
+
+        REPO_MAP_DIR.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+        dirs_file.write_text(json.dumps(fresh, separators=(",", ":")), encoding="utf-8")
+        maps = sorted(REPO_MAP_DIR.glob("*.md"), key=lambda p: p.stat().st_mtime)
+        for old in maps[:-REPO_MAP_KEEP]:
+            old.unlink(missing_ok=True)
+        log.info("  [MAP] Repo map for %s (%d/%d directories re-summarised)",
+                 head[:8], redone, len(fresh))
+        _repo_map_cache = (head, text)
+        return text
+
+
+def _with_repo_map(prompt):
+    """Prepend the repo map to an agent prompt (unchanged if unavailable)."""
+    try:
+        text = repo_map()
+    except Exception as e:
+        log.warning("  [MAP] Repo map unavailable: %s", e)
+        return prompt
+    if not text:
+        return prompt
+    return f"=== REPOSITORY MAP ===\n{text}\n=== END REPOSITORY MAP ===\n\n{prompt}"
+
+
+# ── DUPLICATE COMMIT PREVENTION ──────────────────────────────────────────
+# Persistent commit -> issue index (COMMIT_INDEX_FILE), keyed by commit hash.
+# Schema: {
+#     "head": "<last indexed commit>",
+#     "commits": {"<hash>": [1077, 1084]},
+#     "issues": {"1077": ["<hash>", ...]},     # reverse map, O(1) lookups
+#     "fixed": {"1077": ["<hash>", ...]}       # fix-style references only
+# }
+# "issues" holds every #N (merges, "see #N", cross-references) for the reverse
+# queries; only "fixed" decides whether an issue counts as already committed.
+# Updated incrementally from "head" to HEAD (one git log per update), so the
+# full history is visible without re-scanning it on every run.
+_ISSUE_REF_RE = re.compile(r"#(\d+)")
+_ISSUE_FIX_RE = re.compile(
+    r"\bfix\(#(\d+)\)|\b(?:fix(?:e[sd])?|close[sd]?|resolve[sd]?):?\s+#(\d+)", re.I)
+_commit_index = None                    # lazily loaded COMMIT_INDEX_FILE contents
+
+
+def _empty_commit_index():
+    return {"head": None, "commits": {}, "issues": {}, "fixed": {}}
+
+
+def _load_commit_index():
+    """Load the commit index from disk (cached in memory after first load)."""
+    global _commit_index
+    if _commit_index is not None:
+        return _commit_index
+    _commit_index = _empty_commit_index()
+    if COMMIT_INDEX_FILE.exists():
+        try:
+            data = json.loads(COMMIT_INDEX_FILE.read_text(encoding="utf-8"))
+            if all(isinstance(data.get(k), dict) for k in ("commits", "issues", "fixed")):
+                _commit_index = data
+            else:
+                log.info("  [DEDUP] Commit index predates fix tracking — rebuilding")
+        except Exception:
+            log.warning("  [DEDUP] Commit index corrupt — rebuilding from git log")
+    return _commit_index
+
+
+def _save_commit_index():
+    """Persist the commit index (compact JSON — it can hold the whole history)."""
+    if _commit_index is None:
+        return
+    try:
+        tmp = COMMIT_INDEX_FILE.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(_commit_index, ensure_ascii=False, separators=(",", ":")),
+                       encoding="utf-8")
+        os.replace(tmp, COMMIT_INDEX_FILE)
+    except OSError as e:
+        log.warning("  [DEDUP] Could not save commit index: %s", e)
+
+
+def _index_commit(commit_hash, message):
+    """Add one commit's issue references (subject + body) to the in-memory index."""
+    idx = _load_commit_index()
+    nums = sorted({int(m.group(1)) for m in _ISSUE_REF_RE.finditer(message or "")})
+    fixed = {int(m.group(1) or m.group(2)) for m in _ISSUE_FIX_RE.finditer(message or "")}
+    idx["commits"][commit_hash] = nums
+    for n in nums:
+        hashes = idx["issues"].setdefault(str(n), [])
+        if commit_hash not in hashes:
+            hashes.append(commit_hash)
+    for n in fixed:
+        hashes = idx["fixed"].setdefault(str(n), [])
+        if commit_hash not in hashes:
+            hashes.append(commit_hash)
+        _committed_issues_cache.add(n)
+    return nums
+
+
+def _record_commit_in_index(commit_hash, message):
+    """Index a commit we just created.  The head only advances when the
+    index was current up to the commit's parent; otherwise (commits made
+    before the index was loaded, pulled commits) catch up from git log."""
+    try:
+        idx = _load_commit_index()
+        parent = _run(["git", "rev-parse", f"{commit_hash}^"], timeout=10)
+        if parent.returncode == 0 and idx.get("head") == parent.stdout.strip():
+            _index_commit(commit_hash, message)
+            idx["head"] = commit_hash
+            _save_commit_index()
+        else:
+            update_commit_index()
+    except Exception as e:
+        log.warning("  [DEDUP] Could not index commit %s: %s", commit_hash[:8], e)
+
+
+def update_commit_index():
+    """Bring the commit index up to date with HEAD.  Returns number of new commits.
+
+    Only commits after the last indexed head are read.  If the old head is no
+    longer an ancestor of HEAD (rebase, reset), the index is rebuilt from scratch."""
+    global _commit_index
+    idx = _load_commit_index()
+    r = _run(["git", "rev-parse", "HEAD"], timeout=10)
+    head = (r.stdout or "").strip()
+    if r.returncode != 0 or not head:
+        return 0
+    if head == idx.get("head"):
+        return 0
+
+    rev_range = "HEAD"
+    if idx.get("head"):
+        anc = _run(["git", "merge-base", "--is-ancestor", idx["head"], "HEAD"], timeout=10)
+        if anc.returncode == 0:
+            rev_range = f"{idx['head']}..HEAD"
+        else:
+            log.info("  [DEDUP] Indexed head %s not in history — rebuilding index",
+                     idx["head"][:8])
+            idx = _commit_index = _empty_commit_index()
+
+    r = _run(["git", "log", "--format=%H%x1f%B%x1e", rev_range], timeout=120)
+    if r.returncode != 0:
+        log.warning("  [DEDUP] git log failed: %s", (r.stderr or "")[:200])
+        return 0
+    added = 0
+    for record in (r.stdout or "").split("\x1e"):
+        record = record.strip("\n")
+        if "\x1f" not in record:
+            continue
+        commit_hash, message = record.split("\x1f", 1)
+        _index_commit(commit_hash.strip(), message)
+        added += 1
+    idx["head"] = head
+    _save_commit_index()
+    return added
+
+
+def commits_for_issue(issue_num):
+    """All indexed commits referencing #issue_num (oldest first as indexed)."""
+    return list(_load_commit_index()["issues"].get(str(issue_num), []))
+
+
+def issues_for_commit(commit_hash):
+    """Issue numbers referenced by an indexed commit ([] if unknown)."""
+    return list(_load_commit_index()["commits"].get(commit_hash, []))
+
+
+def _warm_committed_issues_cache():
+    """Pre-populate the dedup cache from the persistent commit index."""
+    try:
+        added = update_commit_index()
+        for key in _load_commit_index()["fixed"]:
+            _committed_issues_cache.add(int(key))
+        log.info("  [DEDUP] Cached %d issue numbers from %d indexed commits (+%d new)",
+                 len(_committed_issues_cache), len(_commit_index["commits"]), added)
     except Exception as e:
         log.warning("  [DEDUP] Cache warming failed: %s", e)
 
 
-def _is_issue_already_committed(issue_num, lookback=100):
-    """Check if issue was already fixed in recent commits.
+def _is_issue_already_committed(issue_num):
+    """Check if issue was already fixed in any indexed commit (fix(#N),
+    fixes/closes/resolves #N — a bare mention does not count).
 
-    Uses the in-memory cache first (warmed at startup), then falls back
-    to scanning git log if not found in cache."""
+    Pure in-memory lookup: the index is brought up to date at startup and
+    git_commit() records every new commit, so a miss costs no subprocess."""
     if issue_num in _committed_issues_cache:
         return True
-    try:
-        r = _run(["git", "log", f"--max-count={lookback}", "--oneline"])
-        for line in (r.stdout or "").splitlines():
-            if f"#{issue_num}" in line:
-                _committed_issues_cache.add(issue_num)
-                return True
-    except Exception:
-        pass
+    if str(issue_num) in _load_commit_index()["fixed"]:
+        _committed_issues_cache.add(issue_num)
+        return True
     return False
 
 
 def git_squash_last(n, message):
     """Squash last N commits into one with given message."""
-    if n <= 1:
+    if n <= 1 or not _require_git_owner("squash"):
         return
     try:
         co_authors = []
@@ -1303,16 +3380,13 @@ def git_squash_last(n, message):
 
 
 # ── CLAUDE JSON OUTPUT PARSER ──────────────────────────────────────────────
-# Global: last parsed usage from claude_run (read by _agent_dispatch for tracking)
-_last_claude_usage = {}
 
 
 def _parse_claude_json_output(raw_output, model=None):
     """Parse claude --output-format json response.
-    Extracts .result as text, stores usage in _last_claude_usage.
+    Extracts .result as text, stores usage in _dispatch_local.claude_usage.
     Falls back to raw text if JSON parsing fails (backward compatible)."""
-    global _last_claude_usage
-    _last_claude_usage = {}
+    _dispatch_local.claude_usage = {}
     if not raw_output:
         return ""
     try:
@@ -1320,7 +3394,7 @@ def _parse_claude_json_output(raw_output, model=None):
         # Store usage for tracking
         usage = data.get("usage") or {}
         cost = data.get("total_cost_usd", 0.0)
-        _last_claude_usage = {
+        _dispatch_local.claude_usage = {
             "input_tokens": usage.get("input_tokens", 0),
             "output_tokens": usage.get("output_tokens", 0),
             "cache_read_tokens": usage.get("cache_read_input_tokens", 0),
@@ -1329,10 +3403,10 @@ def _parse_claude_json_output(raw_output, model=None):
             "duration_ms": data.get("duration_ms", 0),
             "model": model or "",
         }
-        if _last_claude_usage["input_tokens"] > 0:
+        if _dispatch_local.claude_usage["input_tokens"] > 0:
             log.info("    [TOKENS] %d in / %d out / $%.4f (%s)",
-                     _last_claude_usage["input_tokens"],
-                     _last_claude_usage["output_tokens"],
+                     _dispatch_local.claude_usage["input_tokens"],
+                     _dispatch_local.claude_usage["output_tokens"],
                      cost, model or "default")
         # Return the text result (backward compatible)
         result = data.get("result", "")
@@ -1362,7 +3436,7 @@ def claude_run(prompt, max_turns=15, json_output=False, timeout=CLAUDE_TIMEOUT,
     for attempt in range(1, retries + 1):
         try:
             rc, stdout, stderr = _run_with_timeout(
-                cmd, timeout=timeout, cwd=str(REPO_ROOT), env=CLAUDE_ENV,
+                cmd, timeout=timeout, cwd=str(_agent_cwd()), env=CLAUDE_ENV,
             )
             kill_stale_processes()
             if rc != 0:
@@ -1371,39 +3445,62 @@ def claude_run(prompt, max_turns=15, json_output=False, timeout=CLAUDE_TIMEOUT,
                           attempt, retries, rc, err_detail)
                 if attempt < retries:
                     log.info("    [CLAUDE] Retrying in 5s ...")
-                    time.sleep(5)
+                    _sleep(5, "retry_backoff")
                     continue
                 return None
             # Parse JSON output — extract .result text + usage info
             raw = stdout or ""
             return _parse_claude_json_output(raw, model)
         except subprocess.TimeoutExpired as exc:
-            global _last_dispatch_timed_out, _last_dispatch_partial_output
-            _last_dispatch_timed_out = True
+            _dispatch_local.timed_out = True
             log.error("    [CLAUDE] attempt %d/%d TIMEOUT (%ds)", attempt, retries, timeout)
             kill_stale_processes()
             partial = ""
             if hasattr(exc, "output") and exc.output:
                 partial = exc.output if isinstance(exc.output, str) else exc.output.decode("utf-8", errors="replace")
-            _last_dispatch_partial_output = (partial or "")[:3000]
+            _dispatch_local.partial_output = (partial or "")[:3000]
             if partial:
                 log.info("    [CLAUDE] Captured %d chars of partial output before timeout", len(partial))
             if attempt < retries:
                 log.info("    [CLAUDE] Retrying in 5s ...")
-                time.sleep(5)
+                _sleep(5, "retry_backoff")
                 continue
             return None
         except Exception as e:
             log.error("    [CLAUDE] attempt %d/%d ERROR: %s", attempt, retries, e)
             kill_stale_processes()
             if attempt < retries:
-                time.sleep(5)
+                _sleep(5, "retry_backoff")
                 continue
             return None
     return None
 
 
 # ── CORE: GEMINI SUB-AGENT ────────────────────────────────────────────────
+def _parse_gemini_json_output(raw_output, model=None):
+    """Parse `gemini -o json` output -> (response_text, usage_dict).
+    Falls back to (raw_output, {}) if it is not JSON."""
+    try:
+        data = json.loads(raw_output)
+    except (ValueError, TypeError):
+        return raw_output, {}
+    if not isinstance(data, dict):
+        return raw_output, {}
+    text = data.get("response")
+    if text is None:
+        text = raw_output
+    inp = out = cached = 0
+    for model_stats in ((data.get("stats") or {}).get("models") or {}).values():
+        tokens = model_stats.get("tokens") or {}
+        inp += tokens.get("prompt", 0)
+        out += tokens.get("candidates", 0) + tokens.get("thoughts", 0)
+        cached += tokens.get("cached", 0)
+    if not (inp or out):
+        return text, {}
+    return text, {"input_tokens": inp, "output_tokens": out, "cache_read_tokens": cached,
+                  "cost_usd": _estimate_cost(model, inp, out), "model": model or ""}
+
+
 def gemini_run(prompt, max_turns=15, json_output=False, timeout=CLAUDE_TIMEOUT,
                retries=CLAUDE_RETRIES, model=None):
     """Call gemini -p (headless) with retry.  Returns stdout string.
@@ -1416,7 +3513,7 @@ def gemini_run(prompt, max_turns=15, json_output=False, timeout=CLAUDE_TIMEOUT,
     for attempt in range(1, retries + 1):
         try:
             rc, stdout, stderr = _run_with_timeout(
-                cmd, timeout=timeout, cwd=str(REPO_ROOT),
+                cmd, timeout=timeout, cwd=str(_agent_cwd()),
             )
             kill_stale_processes()
             if rc != 0:
@@ -1425,37 +3522,70 @@ def gemini_run(prompt, max_turns=15, json_output=False, timeout=CLAUDE_TIMEOUT,
                           attempt, retries, rc, err_detail)
                 if attempt < retries:
                     log.info("    [GEMINI] Retrying in 5s ...")
-                    time.sleep(5)
+                    _sleep(5, "retry_backoff")
                     continue
                 return None
             return stdout or ""
         except subprocess.TimeoutExpired as exc:
-            global _last_dispatch_timed_out, _last_dispatch_partial_output
-            _last_dispatch_timed_out = True
+            _dispatch_local.timed_out = True
             log.error("    [GEMINI] attempt %d/%d TIMEOUT (%ds)", attempt, retries, timeout)
             kill_stale_processes()
             partial = ""
             if hasattr(exc, "output") and exc.output:
                 partial = exc.output if isinstance(exc.output, str) else exc.output.decode("utf-8", errors="replace")
-            _last_dispatch_partial_output = (partial or "")[:3000]
+            _dispatch_local.partial_output = (partial or "")[:3000]
             if partial:
                 log.info("    [GEMINI] Captured %d chars of partial output before timeout", len(partial))
             if attempt < retries:
                 log.info("    [GEMINI] Retrying in 5s ...")
-                time.sleep(5)
+                _sleep(5, "retry_backoff")
                 continue
             return None
         except Exception as e:
             log.error("    [GEMINI] attempt %d/%d ERROR: %s", attempt, retries, e)
             kill_stale_processes()
             if attempt < retries:
-                time.sleep(5)
+                _sleep(5, "retry_backoff")
                 continue
             return None
     return None
 
 
 # ── CORE: CODEX SUB-AGENT ─────────────────────────────────────────────────
+def _parse_codex_usage(jsonl_output, model=None):
+    """Token usage from codex JSONL events: sums `turn.completed` usage, or
+    falls back to the last cumulative `token_count` event (older CLIs)."""
+    inp = out = cached = 0
+    seen_turns = False
+    last_total = None
+    for line in (jsonl_output or "").splitlines():
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if event.get("type") == "turn.completed" and isinstance(event.get("usage"), dict):
+            u = event["usage"]
+            inp += u.get("input_tokens", 0)
+            out += u.get("output_tokens", 0)
+            cached += u.get("cached_input_tokens", 0)
+            seen_turns = True
+        msg = event.get("msg") if isinstance(event.get("msg"), dict) else None
+        if msg and msg.get("type") == "token_count":
+            info = msg.get("info") or {}
+            last_total = info.get("total_token_usage") or msg
+    if not seen_turns and last_total:
+        inp = last_total.get("input_tokens", 0)
+        out = last_total.get("output_tokens", 0)
+        cached = last_total.get("cached_input_tokens", 0)
+    if not (inp or out):
+        return {}
+    return {"input_tokens": inp, "output_tokens": out, "cache_read_tokens": cached,
+            "cost_usd": _estimate_cost(model, inp, out), "model": model or ""}
+
+
 def _extract_codex_last_message(jsonl_output):
     """Parse JSONL events from codex stdout, extract last assistant message."""
     last_msg = None
@@ -1471,6 +3601,11 @@ def _extract_codex_last_message(jsonl_output):
                     last_msg = event["content"]
                 elif event.get("type") == "message" and event.get("content"):
                     last_msg = event["content"]
+                # `codex exec --json`: {"type": "item.completed", "item": {...}}
+                item = event.get("item")
+                if (event.get("type") == "item.completed" and isinstance(item, dict)
+                        and item.get("type") == "agent_message" and item.get("text")):
+                    last_msg = item["text"]
                 # Also handle text content blocks
                 if isinstance(event.get("content"), list):
                     for block in event["content"]:
@@ -1515,12 +3650,13 @@ def codex_run(prompt, timeout=CODEX_TIMEOUT, retries=CODEX_RETRIES,
                 "--full-auto",                   # auto-approve + workspace-write sandbox
                 "-m", use_model,
                 "-c", f'model_reasoning_effort="{use_reasoning}"',
-                "-C", str(REPO_ROOT),
+                "-C", str(_agent_cwd()),
                 "-o", output_file,
+                "--json",                        # JSONL events on stdout (token usage)
             ]
 
             rc, stdout, stderr = _run_with_timeout(
-                cmd, timeout=timeout, cwd=str(REPO_ROOT),
+                cmd, timeout=timeout, cwd=str(_agent_cwd()),
                 stdin_path=prompt_file,
             )
 
@@ -1540,10 +3676,12 @@ def codex_run(prompt, timeout=CODEX_TIMEOUT, retries=CODEX_RETRIES,
 
                 if attempt < retries:
                     log.info("    [CODEX] Retrying in 10s ...")
-                    time.sleep(10)
+                    _sleep(10, "retry_backoff")
                     continue
                 return None
 
+            _dispatch_local.codex_usage = _parse_codex_usage(stdout, use_model)
+
             # Primary: read from -o output file
             result = None
             try:
@@ -1569,8 +3707,7 @@ def codex_run(prompt, timeout=CODEX_TIMEOUT, retries=CODEX_RETRIES,
             return result or ""
 
         except subprocess.TimeoutExpired as exc:
-            global _last_dispatch_timed_out, _last_dispatch_partial_output
-            _last_dispatch_timed_out = True
+            _dispatch_local.timed_out = True
             log.error("    [CODEX] attempt %d/%d TIMEOUT (%ds)", attempt, retries, timeout)
             kill_stale_processes()
             # Capture partial output from -o file (agent may have written progress)
@@ -1583,19 +3720,19 @@ def codex_run(prompt, timeout=CODEX_TIMEOUT, retries=CODEX_RETRIES,
             # Also grab partial stdout from the exception
             if not partial and hasattr(exc, "output") and exc.output:
                 partial = exc.output if isinstance(exc.output, str) else exc.output.decode("utf-8", errors="replace")
-            _last_dispatch_partial_output = (partial or "")[:3000]
+            _dispatch_local.partial_output = (partial or "")[:3000]
             if partial:
                 log.info("    [CODEX] Captured %d chars of partial output before timeout", len(partial))
             if attempt < retries:
                 log.info("    [CODEX] Retrying in 10s ...")
-                time.sleep(10)
+                _sleep(10, "retry_backoff")
                 continue
             return None
         except Exception as e:
             log.error("    [CODEX] attempt %d/%d ERROR: %s", attempt, retries, e)
             kill_stale_processes()
             if attempt < retries:
-                time.sleep(10)
+                _sleep(10, "retry_backoff")
                 continue
             return None
         finally:
@@ -1613,13 +3750,53 @@ def _agent_dispatch(agent, prompt, max_turns=15, json_output=False,
                     timeout=CLAUDE_TIMEOUT, retries=CLAUDE_RETRIES,
                     claude_model=None, task_type=None):
     """Dispatch a prompt to a specific agent. Returns stdout string or None.
-    Sets _last_dispatch_timed_out if the agent timed out.
+    Sets _dispatch_local.timed_out if the agent timed out.
     Skips agents that are currently rate-limited.
     task_type: selects model variant (fast vs powerful) per agent.
     claude_model: explicit override for Claude model (takes precedence over task_type)."""
-    global _last_dispatch_timed_out, _last_dispatch_partial_output
-    _last_dispatch_timed_out = False
-    _last_dispatch_partial_output = ""
+    _dispatch_local.model = ""
+    issue_num = _dispatch_local.issue
+    usage = _dispatch_local.usage = {"input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+    emit_event("dispatch_start", agent=agent, task=task_type, issue=issue_num,
+               timeout_s=timeout)
+    t0 = time.monotonic()
+    try:
+        with span(f"dispatch:{agent}", cat="dispatch", task=task_type, issue=issue_num):
+            result = _dispatch_to_agent(agent, prompt, max_turns=max_turns,
+                                        json_output=json_output, timeout=timeout,
+                                        retries=retries, claude_model=claude_model,
+                                        task_type=task_type)
+    finally:
+        _dispatch_local.usage = None
+    duration = round(time.monotonic() - t0, 1)
+    if result is not None:
+        outcome = "ok"
+    elif _dispatch_local.timed_out:
+        outcome = "timeout"
+    elif not _dispatch_local.model:
+        outcome = "skipped"     # rate-limited before launch
+    else:
+        outcome = "failed"
+    emit_event("dispatch_end", agent=agent, model=_dispatch_local.model,
+               task=task_type, issue=issue_num, ok=result is not None,
+               timed_out=_dispatch_local.timed_out, duration_s=duration,
+               input_tokens=usage["input_tokens"], output_tokens=usage["output_tokens"],
+               cost_usd=round(usage["cost_usd"], 6))
+    if outcome != "skipped":
+        _ledger_append({
+            "ts": _now_iso(), "agent": agent, "model": _dispatch_local.model,
+            "task": task_type, "issue": issue_num,
+            "input_tokens": usage["input_tokens"], "output_tokens": usage["output_tokens"],
+            "cost_usd": round(usage["cost_usd"], 6), "duration_s": duration,
+            "outcome": outcome,
+        })
+    return result
+
+
+def _dispatch_to_agent(agent, prompt, max_turns, json_output, timeout, retries,
+                       claude_model, task_type):
+    _dispatch_local.timed_out = False
+    _dispatch_local.partial_output = ""
 
     # Check rate limit before dispatching
     is_limited, available_after = _is_agent_rate_limited(agent)
@@ -1627,19 +3804,39 @@ def _agent_dispatch(agent, prompt, max_turns=15, json_output=False,
         log.info("    [RATE] Skipping %s (rate-limited until %s)", agent, available_after)
         return None
 
+    # Cost ceiling: refuse when spent, cheap models when close
+    budget = budget_state(_dispatch_local.issue)
+    if budget == "exhausted":
+        log.warning("    [BUDGET] Refusing %s dispatch — cost ceiling reached", agent)
+        return None
+    cheap_model = BUDGET_CHEAP_MODELS.get(agent) if budget == "downgrade" else None
+
     _session_agents_used.add(agent)
 
     if agent == "codex":
         codex_model = CODEX_MODEL_BY_TASK.get(task_type, CODEX_MODEL) if task_type else None
         codex_reasoning = CODEX_REASONING_BY_TASK.get(task_type, CODEX_REASONING) if task_type else None
+        if cheap_model:
+            codex_model, codex_reasoning = cheap_model, BUDGET_CHEAP_CODEX_REASONING
         _model_tag = codex_model or CODEX_MODEL
+        _dispatch_local.model = _model_tag
         log.info("    [CODEX] model=%s reasoning=%s task=%s",
                  _model_tag, codex_reasoning or CODEX_REASONING, task_type or "default")
-        return codex_run(prompt, timeout=timeout, retries=min(retries, CODEX_RETRIES),
-                         model=codex_model, reasoning=codex_reasoning)
+        _dispatch_local.codex_usage = {}
+        result = codex_run(prompt, timeout=timeout, retries=min(retries, CODEX_RETRIES),
+                           model=codex_model, reasoning=codex_reasoning)
+        if _dispatch_local.codex_usage:
+            _track_tokens(
+                _dispatch_local.issue,
+                _dispatch_local.operation,
+                "codex", _model_tag, _dispatch_local.codex_usage,
+            )
+        return result
 
     if agent == "gemini":
         gemini_model = GEMINI_MODEL_BY_TASK.get(task_type, GEMINI_MODEL) if task_type else GEMINI_MODEL
+        if cheap_model:
+            gemini_model = cheap_model
         # Check per-model rate limit (e.g. gemini-3-pro-preview may be limited while flash works)
         model_rate_key = f"gemini:{gemini_model}"
         is_model_limited, model_available = _is_agent_rate_limited(model_rate_key)
@@ -1648,16 +3845,24 @@ def _agent_dispatch(agent, prompt, max_turns=15, json_output=False,
                      agent, gemini_model, model_available)
             return None
         log.info("    [GEMINI] model=%s task=%s", gemini_model, task_type or "default")
+        _dispatch_local.model = gemini_model
         prompt_file = _write_prompt_file(prompt)
         try:
             rc, stdout, stderr = _run_with_timeout(
-                [GEMINI_CMD, "-p", "", "-y", "-m", gemini_model],
-                timeout=timeout, cwd=str(REPO_ROOT),
+                [GEMINI_CMD, "-p", "", "-y", "-m", gemini_model, "-o", "json"],
+                timeout=timeout, cwd=str(_agent_cwd()),
                 stdin_path=prompt_file,
             )
             kill_stale_processes()
             if rc == 0 and stdout:
-                return stdout
+                text, usage = _parse_gemini_json_output(stdout, gemini_model)
+                if usage:
+                    _track_tokens(
+                        _dispatch_local.issue,
+                        _dispatch_local.operation,
+                        "gemini", gemini_model, usage,
+                    )
+                return text
             all_output = (stderr or "") + "\n" + (stdout or "")
             err_head = all_output.strip()[:200]
             err_tail = all_output.strip()[-300:]
@@ -1692,16 +3897,19 @@ def _agent_dispatch(agent, prompt, max_turns=15, json_output=False,
 
     # Default: claude
     use_claude_model = claude_model or (CLAUDE_MODEL_BY_TASK.get(task_type) if task_type else None)
+    if cheap_model:
+        use_claude_model = cheap_model
     if use_claude_model:
         log.info("    [CLAUDE] model=%s task=%s", use_claude_model, task_type or "default")
+    _dispatch_local.model = use_claude_model or "claude-default"
     result = claude_run(prompt, max_turns=max_turns, json_output=json_output,
                         timeout=timeout, retries=retries, model=use_claude_model)
     # Track token usage from Claude call
-    if _last_claude_usage:
+    if _dispatch_local.claude_usage:
         _track_tokens(
-            _token_tracker.get("current_issue"),
-            _token_tracker.get("current_operation", "dispatch"),
-            "claude", use_claude_model or "", _last_claude_usage,
+            _dispatch_local.issue,
+            _dispatch_local.operation,
+            "claude", use_claude_model or "", _dispatch_local.claude_usage,
         )
     return result
 
@@ -1757,10 +3965,32 @@ def _write_prompt_file(prompt):
     return f.name
 
 
-def chain_triage(issue):
+@traced("triage", cat="chain", args_fn=lambda issue: {"issue": issue["number"]})
+def chain_triage(issue, duplicates=None):
     """Chain-of-agents triage: loops through AGENT_CHAIN until valid JSON.
     Each subsequent agent gets context from previous attempts.
+    duplicates: near-duplicate candidates (find_near_duplicates) for the prompt.
+    Agents run in a triage worktree (see triage_tree), so triage never
+    touches REPO_ROOT while an implement runs there.
     Returns (triage_dict, agent_used) or (None, None)."""
+    with triage_tree() as tree:
+        if tree is None and not _git_owner:
+            log.error("    [TRIAGE] No worktree — worker refuses to triage #%d in the "
+                      "owner's checkout", issue["number"])
+            return None, None
+        if tree is None:
+            log.warning("    [TRIAGE] No worktree — triaging #%d in the repo (serialized)",
+                        issue["number"])
+            with _tree_lock:
+                return _chain_triage(issue, duplicates, None)
+        _dispatch_local.cwd = tree
+        try:
+            return _chain_triage(issue, duplicates, tree)
+        finally:
+            _dispatch_local.cwd = None
+
+
+def _chain_triage(issue, duplicates, tree):
     num = issue["number"]
     title = issue.get("title", "")
     body = (issue.get("body") or "")[:2000]
@@ -1769,6 +3999,11 @@ def chain_triage(issue):
     comments_text = "\n".join(
         f"  [{c.get('author', '?')}]: {c.get('snippet', '')[:300]}" for c in comments
     )
+    dup_text = ""
+    if duplicates:
+        dup_text = "\nPossible duplicates (text similarity — check before deciding):\n" + "\n".join(
+            f"  {d['repo']} #{d['number']} [{d['status']}] {d['similarity']:.0%}: {d['title'][:100]}"
+            for d in duplicates) + "\n"
 
     triage_prompt = f"""IMPORTANT: This is a READ-ONLY classification task. Do NOT modify any files.
 Do NOT edit JSON files. Do NOT run scripts. Do NOT update any database.
@@ -1785,7 +4020,7 @@ Body:
 
 Recent comments:
 {comments_text}
-
+{dup_text}
 Reply with ONLY a JSON object (no other text):
 {{"decision":"implement","reason":"one sentence","priority":"P2-bug","estimated_files":["path.cs"],"approach":"brief fix"}}
 
@@ -1808,8 +4043,8 @@ If unclear, use needs_info."""
 
 Issue body:
 {body[:1000]}
-
-{ctx.format_for_prompt()}
+{dup_text}
+{ctx.format_for_prompt(agent)}
 
 Extract or produce the correct triage JSON from the above attempts, or if they are unusable,
 analyze the issue yourself and produce the triage.
@@ -1817,6 +4052,7 @@ analyze the issue yourself and produce the triage.
 Reply with ONLY a JSON object:
 {{"decision":"implement|wontfix|duplicate|needs_info","reason":"one sentence","priority":"P0-critical|P1-security|P2-bug|P3-enhancement|P4-debt","estimated_files":["path.cs"],"approach":"brief fix"}}"""
 
+        prompt = _with_repo_map(prompt)
         timeout = _estimate_timeout(agent, "triage", issue_key=issue_key,
                                     chain_escalation=chain_esc)
         log.info("    [CHAIN] Step %d: %s triage for #%d (timeout=%ds)",
@@ -1829,17 +4065,16 @@ Reply with ONLY a JSON object:
         elapsed = time.time() - t0
         kill_stale_processes()
 
-        if _last_dispatch_timed_out:
-            modified, diff_summary = _capture_post_timeout_state()
+        if _dispatch_local.timed_out:
+            # CRITICAL: Clean up contaminated files so next agent starts clean
+            modified = _triage_contamination(tree)
             ctx.add_attempt(agent, "triage", False,
-                            raw_output=_last_dispatch_partial_output,
+                            raw_output=_dispatch_local.partial_output,
                             errors=f"TIMEOUT after {timeout}s",
                             files_modified=modified, timed_out=True)
             if modified:
                 log.info("    [CHAIN] %s timed out but modified %d files: %s",
                          agent, len(modified), ", ".join(modified[:5]))
-                # CRITICAL: Clean up contaminated files so next agent starts clean
-                _restore_triage_contamination(modified)
             chain_esc *= TIMEOUT_ESCALATION_FACTOR
         elif raw_output:
             # Record successful duration for future estimates
@@ -1860,9 +4095,7 @@ Reply with ONLY a JSON object:
             ctx.add_attempt(agent, "triage", False, errors="Agent returned None")
             # Clean up any files modified — but skip if agent was rate-limited (never ran)
             if elapsed > 1:  # agent actually ran (not just rate-limit skip)
-                modified_check, _ = _capture_post_timeout_state()
-                if modified_check:
-                    _restore_triage_contamination(modified_check)
+                _triage_contamination(tree)
 
         if not AGENT_FALLBACK_ENABLED:
             break
@@ -1908,6 +4141,7 @@ Reply with ONLY a JSON object:
     return None, None
 
 
+@traced("test_fix", cat="chain", args_fn=lambda num, *a, **k: {"issue": num})
 def _attempt_test_fix(num, title, impl_agent, failed_tests, test_output, status, ctx):
     """Try to fix failing tests instead of reverting the implementation.
 
@@ -2011,11 +4245,76 @@ def chain_implement(issue, triage, status):
     Each agent gets context from previous attempts. If build/test fail,
     leaves modifications in working tree for next agent.
     Returns True if fix was committed."""
+    ok = _chain_implement(issue, triage, status)
+    # Not in a finally: an interrupted chain keeps its checkpoints for resume
+    drop_checkpoints(f"impl_{issue['number']}")
+    return ok
+
+
+def resume_chain_implement(ctx, status):
+    """Continue an implement chain left unfinished by a crash/restart.
+    Restores the last checkpointed working tree and re-enters the chain at
+    the interrupted agent (or straight at build/test if the agent had
+    already finished).  Returns True if the fix was committed."""
+    p = ctx.progress
+    num = int(ctx.task_id)
+    issue, triage = p.get("issue"), p.get("triage")
+    step, index = p.get("step"), p.get("agent_index", 0)
+    if not issue or not triage:
+        ctx.clear_progress()
+        git_restore()
+        return False
+    head = (_run(["git", "rev-parse", "HEAD"], timeout=10).stdout or "").strip()
+    if p.get("head") and p["head"] != head:
+        # Checkpoints are full source trees — replaying them on a moved HEAD
+        # would revert the new commits.  Start the issue over instead, and
+        # drop the interrupted agent's edits so they don't leak into the next
+        # issue.
+        log.warning("  [RESUME] HEAD moved since #%d was interrupted — discarding", num)
+        ctx.clear_progress()
+        drop_checkpoints(f"impl_{num}")
+        git_restore()
+        return False
+
+    verify_first = False
+    if step == "verify" and p.get("verify_checkpoint"):
+        tree, verify_first = p["verify_checkpoint"], True
+    elif step == "attempted":
+        index += 1
+        last = ctx.attempts[-1] if ctx.attempts else {}
+        tree = last.get("checkpoint")
+        if last.get("build_result") == "FAIL":
+            tree = ctx.best_checkpoint() or tree
+    else:
+        tree = p.get("base_checkpoint")
+    if index >= len(AGENT_CHAIN):
+        ctx.save()
+        drop_checkpoints(f"impl_{num}")
+        git_restore()
+        return False
+
+    if tree:
+        restore_checkpoint(tree)
+    else:
+        git_restore()
+    log.info("  [RESUME] #%d: %d attempts recorded, continuing at %s (%s)",
+             num, len(ctx.attempts), AGENT_CHAIN[index],
+             "verification" if verify_first else "agent run")
+    ok = _chain_implement(issue, triage, status, ctx=ctx,
+                          start_index=index, verify_first=verify_first)
+    drop_checkpoints(f"impl_{num}")
+    return ok
+
+
+@traced("implement", cat="chain",
+        args_fn=lambda issue, *a, **k: {"issue": issue["number"]})
+def _chain_implement(issue, triage, status, ctx=None, start_index=0,
+                     verify_first=False):
     num = issue["number"]
     title = issue.get("title", "")
     body = (issue.get("body") or "")[:3000]
     approach = triage.get("approach", "")
-    files = triage.get("estimated_files", [])
+    files, files_block = relevant_files(issue, triage)
 
     impl_prompt = f"""Project: mRemoteNG (.NET 10, WinForms, COM references)
 Working directory: D:\\github\\mRemoteNG
@@ -2029,6 +4328,8 @@ Description:
 Recommended approach: {approach}
 Likely files: {', '.join(files) if files else 'search the codebase'}
 
+{files_block}
+
 RULES (CRITICAL):
 - Read code BEFORE modifying
 - Do NOT change existing behavior — only fix the reported issue
@@ -2040,12 +4341,23 @@ RULES (CRITICAL):
 - If YOUR change breaks tests, fix it.  If tests fail for unrelated reasons, ignore.
 - Do ONLY the fix.  Nothing else."""
 
-    ctx = ChainContext("implement", str(num))
     issue_key = f"impl_{num}"
-    chain_esc = 1.0  # grows within this run on each timeout
+    if ctx is None:
+        ctx = ChainContext("implement", str(num))
+        head = (_run(["git", "rev-parse", "HEAD"], timeout=10).stdout or "").strip()
+        ctx.save_progress(
+            issue={"number": num, "title": title, "body": issue.get("body") or ""},
+            triage=triage, head=head)
+    chain_esc = ctx.progress.get("chain_escalation", 1.0)  # grows on each timeout
+
+    def _checkpoint():
+        return checkpoint_tree(issue_key, len(ctx.attempts) + 1)
     _set_token_context(issue_num=num, operation="implement")
 
     for i, agent in enumerate(AGENT_CHAIN):
+        if i < start_index:
+            continue
+        trace_step("chain_step", cat="chain_step", agent=agent, step=i + 1)
         is_last = (i == len(AGENT_CHAIN) - 1)
         _session_agents_used.add(agent)
 
@@ -2065,36 +4377,49 @@ Likely files: {', '.join(files) if files else 'search the codebase'}
 IMPORTANT — Previous agents already attempted this fix.
 Their changes may still be in the working tree.
 
-{ctx.format_for_prompt()}
+{ctx.format_for_prompt(agent)}
 
 Review the current state of the code, correct any issues, and make the fix work.
 
 RULES: Read code first. Do NOT change existing behavior. NEVER modify infrastructure files (run-tests.ps1, build.ps1, mRemoteNG.sln, Directory.Build.props, Directory.Packages.props). Run build.ps1 then run-tests.ps1 -NoBuild.
 Do ONLY the fix. Nothing else."""
 
+        prompt = _with_repo_map(prompt)
         timeout = _estimate_timeout(agent, "implement", issue_key=issue_key,
                                     triage=triage, chain_escalation=chain_esc)
-        log.info("  [CHAIN] Step %d: %s implementing #%d (timeout=%ds) ...",
-                 i + 1, agent.capitalize(), num, timeout)
-        status.set_task(type="issue_fix", issue=num, step=f"{agent}_fixing")
-
-        t0 = time.time()
-        agent_out = _agent_dispatch(agent, prompt, max_turns=25, timeout=timeout,
-                                    retries=1, task_type="implement")
-        elapsed = time.time() - t0
-        kill_stale_processes()
+        if verify_first and i == start_index:
+            # Resumed after a crash: this agent's output is already restored
+            log.info("  [CHAIN] Step %d: %s output for #%d restored — verifying",
+                     i + 1, agent.capitalize(), num)
+            agent_out, elapsed = "", None
+        else:
+            log.info("  [CHAIN] Step %d: %s implementing #%d (timeout=%ds) ...",
+                     i + 1, agent.capitalize(), num, timeout)
+            status.set_task(type="issue_fix", issue=num, step=f"{agent}_fixing")
+            ctx.save_progress(agent_index=i, step="dispatch", chain_escalation=chain_esc,
+                              base_checkpoint=checkpoint_tree(issue_key, f"base{i}"))
+
+            t0 = time.time()
+            agent_out = _agent_dispatch(agent, prompt, max_turns=25, timeout=timeout,
+                                        retries=1, task_type="implement")
+            elapsed = time.time() - t0
+            kill_stale_processes()
+            if agent_out is not None:
+                ctx.save_progress(step="verify",
+                                  verify_checkpoint=checkpoint_tree(issue_key, f"verify{i}"))
 
         if agent_out is None:
-            if _last_dispatch_timed_out:
+            if _dispatch_local.timed_out:
                 # Timeout — capture FULL partial work (diff, files, output)
                 modified, diff_summary = _capture_post_timeout_state()
                 diff_out = _capture_full_diff()
                 ctx.add_attempt(agent, f"implement #{num}", False,
-                                raw_output=_last_dispatch_partial_output,
+                                raw_output=_dispatch_local.partial_output,
                                 errors=f"TIMEOUT after {timeout}s",
                                 files_modified=modified, timed_out=True,
                                 diff_summary=diff_summary,
-                                diff_output=diff_out)
+                                diff_output=diff_out,
+                                checkpoint=_checkpoint() if modified else None)
                 if modified:
                     log.info("  [CHAIN] %s timed out but modified %d files: %s",
                              agent, len(modified), ", ".join(modified[:5]))
@@ -2102,6 +4427,7 @@ Do ONLY the fix. Nothing else."""
                 else:
                     git_restore()
                 chain_esc *= TIMEOUT_ESCALATION_FACTOR
+                ctx.progress["chain_escalation"] = chain_esc
             else:
                 ctx.add_attempt(agent, f"implement #{num}", False,
                                 errors="Agent returned None after retries")
@@ -2124,7 +4450,8 @@ Do ONLY the fix. Nothing else."""
             continue
 
         # Record successful agent duration for future estimates
-        _record_duration(agent, "implement", elapsed)
+        if elapsed is not None:
+            _record_duration(agent, "implement", elapsed)
 
         # Check build
         status.set_task(type="issue_fix", issue=num, step=f"building_{agent}")
@@ -2184,10 +4511,8 @@ Do ONLY the fix. Nothing else."""
                 status.data["issues"]["implemented"] += 1
                 log.info("  [CHAIN] %s fix committed %s", agent.capitalize(), h[:8])
 
-                status.set_task(type="issue_fix", issue=num, step="pushing")
-                git_push()
-                if post_github_comment(num, h, short):
-                    status.data["issues"]["commented_on_github"] += 1
+                get_outbox().push()
+                post_github_comment(num, h, short)
                 update_issue_json(num, "testing", f"Fix in {h[:8]}")
                 status.clear_task()
                 return True
@@ -2225,10 +4550,8 @@ Do ONLY the fix. Nothing else."""
                     status.data["issues"]["implemented"] += 1
                     log.info("  [CHAIN] %s fix + test fix committed %s", agent.capitalize(), h[:8])
 
-                    status.set_task(type="issue_fix", issue=num, step="pushing")
-                    git_push()
-                    if post_github_comment(num, h, short):
-                        status.data["issues"]["commented_on_github"] += 1
+                    get_outbox().push()
+                    post_github_comment(num, h, short)
                     update_issue_json(num, "testing", f"Fix in {h[:8]}")
                     status.clear_task()
                     return True
@@ -2240,7 +4563,8 @@ Do ONLY the fix. Nothing else."""
                                     diff_output=diff_out, diff_summary=diff_stat,
                                     files_modified=modified,
                                     test_output=test_output[:10000] if test_output else "",
-                                    failed_tests=failed_tests)
+                                    failed_tests=failed_tests,
+                                    checkpoint=_checkpoint())
         else:
             # Build fail — capture FULL context (diff + build errors)
             diff_out = _capture_full_diff()
@@ -2250,8 +4574,15 @@ Do ONLY the fix. Nothing else."""
                             build_result="FAIL", test_result="N/A",
                             errors=f"Build failed:\n{err_snippet}",
                             diff_output=diff_out, diff_summary=diff_stat,
-                            files_modified=modified)
+                            files_modified=modified,
+                            checkpoint=_checkpoint())
             log.warning("  [CHAIN] %s fix has build errors for #%d", agent, num)
+            # A broken build is a worse starting point than an earlier attempt
+            # that compiled — roll back to it for the next agent.
+            best = ctx.best_checkpoint()
+            if best and not is_last and AGENT_FALLBACK_ENABLED:
+                log.info("  [CHAIN] Rolling back to last building attempt for next agent")
+                restore_checkpoint(best)
 
         # Last agent failed — revert
         if is_last:
@@ -2274,7 +4605,8 @@ Do ONLY the fix. Nothing else."""
 
 # ── CORE: GITHUB COMMENTS ──────────────────────────────────────────────────
 def post_github_comment(issue_num, commit_hash, description):
-    """Post a fix-available comment on upstream issue."""
+    """Queue a fix-available comment on the upstream issue (sent by the outbox
+    after the commit is pushed)."""
     beta_tag = get_beta_tag()
     beta_url = get_beta_url()
     comment = (
@@ -2288,17 +4620,8 @@ def post_github_comment(issue_num, commit_hash, description):
         f"---\n"
         f"_Automated by mRemoteNG Issue Intelligence System_"
     )
-    try:
-        _run(
-            ["gh", "issue", "comment", str(issue_num),
-             "--repo", UPSTREAM_REPO, "--body", comment],
-            timeout=30,
-        )
-        log.info("    [GITHUB] Comment posted on #%d", issue_num)
-        return True
-    except Exception as e:
-        log.warning("    [GITHUB] Comment failed on #%d: %s", issue_num, e)
-        return False
+    get_outbox().comment(UPSTREAM_REPO, issue_num, comment)
+    log.info("    [GITHUB] Comment on #%d queued", issue_num)
 
 
 def update_issue_json(issue_num, new_status, description="", *,
@@ -2335,7 +4658,7 @@ def update_issue_json(issue_num, new_status, description="", *,
                 "input_tokens": issue_tokens["input_tokens"],
                 "output_tokens": issue_tokens["output_tokens"],
                 "cost_usd": round(issue_tokens["cost_usd"], 6),
-                "operations": len(issue_tokens.get("ops", [])),
+                "operations": issue_tokens.get("ops", 0),
             }
         data["iterations"].append(iteration_entry)
         # Also store cumulative token_usage at issue level
@@ -2354,6 +4677,227 @@ def update_issue_json(issue_num, new_status, description="", *,
         log.warning("    [IIS] JSON update failed for #%d: %s", issue_num, e)
 
 
+# ── CORE: OUTBOX ───────────────────────────────────────────────────────────
+# Network side effects (git push, GitHub comments) are queued here and sent
+# by a background thread, so the implement loop never waits on the network.
+# Persisted to OUTBOX_FILE: entries left by a crash or a failed send go out
+# on the next run.  Pushes coalesce (one pending push covers every commit
+# made before it runs); comments wait for pending pushes (they link commits)
+# and go out at the comment rate limit; failures back off exponentially.
+# A push that exhausts its attempts is parked, not dropped: the comments
+# behind it stay held (they would link unpushed commits) until the next
+# queued push (or the next run) revives it.
+OUTBOX_POLL_SECS = 5
+OUTBOX_RETRY_BASE_SECS = 30
+OUTBOX_RETRY_MAX_SECS = 1800
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_DRAIN_SECS = 180         # at exit: how long to wait for the outbox to empty
+
+
+class Outbox:
+    """Entries: {"id", "kind": "push"|"comment", "attempts", "not_before", ...};
+    a parked push also carries "abandoned": True."""
+
+    def __init__(self, path=None):
+        self.path = Path(path or OUTBOX_FILE)
+        self.on_sent = None             # callback(entry) after a successful send
+        self.on_abandoned = None        # callback(entry) when a push is parked
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            entries = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return []
+        for e in entries:
+            e.pop("sending", None)          # interrupted mid-send: send again
+            if e.pop("abandoned", None):    # parked push: a new run retries it
+                e.update(attempts=0, not_before=0.0)
+        return entries
+
+    def _save(self):
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.entries, indent=1, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def _add(self, entry):
+        entry.update(id=f"{time.time():.6f}", attempts=0, not_before=0.0, created=_now_iso())
+        self.entries.append(entry)
+        self._save()
+        self._wake.set()
+
+    def push(self):
+        """Queue a git push; coalesces with one pending (not already running).
+        A parked push is revived with a fresh set of attempts."""
+        with self._lock:
+            pending = next((e for e in self.entries
+                            if e["kind"] == "push" and not e.get("sending")), None)
+            if pending is None:
+                self._add({"kind": "push"})
+            elif pending.pop("abandoned", None):
+                log.info("  [OUTBOX] Retrying parked push (%d comment(s) held)",
+                         self._held_comments())
+                pending.update(attempts=0, not_before=0.0)
+                self._save()
+                self._wake.set()
+
+    def comment(self, repo, issue, body):
+        with self._lock:
+            self._add({"kind": "comment", "repo": repo, "issue": issue, "body": body})
+
+    def _held_comments(self):
+        """Comments blocked behind a parked push."""
+        if not any(e.get("abandoned") for e in self.entries):
+            return 0
+        return sum(1 for e in self.entries if e["kind"] == "comment")
+
+    def _sendable(self):
+        """Pushes first; comments only once no push (parked or not) is pending."""
+        pushes = [e for e in self.entries if e["kind"] == "push"]
+        if pushes:
+            return [e for e in pushes if not e.get("abandoned")]
+        return self.entries
+
+    def _next_due(self, now):
+        return next((e for e in self._sendable() if e["not_before"] <= now), None)
+
+    def _send(self, entry, now):
+        """True sent, False failed, or a timestamp to retry at (rate limit)."""
+        if entry["kind"] == "push":
+            return git_push()
+        state = _load_comment_rate()
+        wait = _comment_rate_delay(state, now)
+        if wait is None:
+            tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+            return time.mktime(tomorrow.timetuple())
+        if wait > 0:
+            return now + wait
+        return _gh_comment_now(entry["repo"], entry["issue"], entry["body"], state)
+
+    def process_once(self, now=None):
+        """Send the next due entry.  Returns True if one was attempted."""
+        now = now or time.time()
+        with self._lock:
+            entry = self._next_due(now)
+            if entry is None:
+                return False
+            entry["sending"] = True
+        result = self._send(entry, now)
+        with self._lock:
+            entry.pop("sending")
+            if result is True:
+                self.entries.remove(entry)
+                emit_event("outbox_sent", kind=entry["kind"], issue=entry.get("issue"),
+                           attempts=entry["attempts"] + 1)
+            elif result is False:
+                entry["attempts"] += 1
+                if entry["attempts"] >= OUTBOX_MAX_ATTEMPTS and entry["kind"] == "push":
+                    entry["abandoned"] = True
+                    held = self._held_comments()
+                    log.error("  [OUTBOX] Giving up on push after %d attempts — "
+                              "%d comment(s) held until the next push",
+                              entry["attempts"], held)
+                    emit_event("outbox_abandoned", kind="push", held=held)
+                elif entry["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                    self.entries.remove(entry)
+                    log.error("  [OUTBOX] Giving up on %s after %d attempts",
+                              entry["kind"], entry["attempts"])
+                    emit_event("outbox_dropped", kind=entry["kind"], issue=entry.get("issue"))
+                else:
+                    entry["not_before"] = now + min(
+                        OUTBOX_RETRY_BASE_SECS * 2 ** (entry["attempts"] - 1),
+                        OUTBOX_RETRY_MAX_SECS)
+            else:
+                entry["not_before"] = result        # rate limited: not a failure
+            self._save()
+        if result is True and self.on_sent:
+            self.on_sent(entry)
+        elif entry.get("abandoned") and self.on_abandoned:
+            self.on_abandoned(entry)
+        return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                sent = self.process_once()
+            except Exception as e:
+                log.warning("  [OUTBOX] %s", e)
+                sent = False
+            if not sent:
+                self._wake.wait(OUTBOX_POLL_SECS)
+                self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            if self.entries:
+                log.info("  [OUTBOX] Resuming %d queued item(s)", len(self.entries))
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+            self._thread.start()
+
+    def drain(self, timeout=OUTBOX_DRAIN_SECS):
+        """Wait until nothing is due (bounded), then stop.  Returns entries left."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                due = [e for e in self._sendable() if e["not_before"] <= time.time() + 15]
+            if not due or self._thread is None:
+                break
+            self._wake.set()
+            time.sleep(0.2)
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=35)
+            self._thread = None
+        return len(self.entries)
+
+
+_outbox = None
+
+
+def get_outbox():
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox()
+    return _outbox
+
+
+def start_outbox(status=None):
+    box = get_outbox()
+    if status is not None:
+        def on_sent(entry):
+            if entry["kind"] == "comment":
+                status.data["issues"]["commented_on_github"] += 1
+            elif status.data.pop("outbox_blocked", None):
+                status.save()
+
+        def on_abandoned(entry):
+            status.data["outbox_blocked"] = {"push_abandoned_at": _now_iso(),
+                                             "comments_held": box._held_comments()}
+            status.save()
+        box.on_sent = on_sent
+        box.on_abandoned = on_abandoned
+    box.start()
+    return box
+
+
+def stop_outbox(timeout=OUTBOX_DRAIN_SECS):
+    if _outbox is None:
+        return
+    left = _outbox.drain(timeout)
+    if left:
+        log.warning("  [OUTBOX] %d item(s) left queued for the next run", left)
+    held = _outbox._held_comments()
+    if held:
+        log.warning("  [OUTBOX] Push abandoned — %d comment(s) held until a push succeeds",
+                    held)
+
+
 # ── CORE: WARNING PARSER ───────────────────────────────────────────────────
 _WARN_RE = re.compile(r"(.+?)\((\d+),\d+\):\s*warning\s+(CS\d{4}):\s*(.+)")
 
@@ -2391,6 +4935,645 @@ def find_dependents(fpath, all_warnings):
     return dependents[:5]  # limit to 5 most relevant
 
 
+# ── CORE: PIPELINE ─────────────────────────────────────────────────────────
+# Small staged pipeline: items stream from a source through declared stages,
+# each with its own worker threads (concurrency), bounded input queue
+# (backpressure), retry policy and counters.  Stages overlap — the next
+# issue is triaged while the current one builds — and per-stage throughput
+# shows up in the status file, metrics (iis_stage_*) and trace (cat=stage).
+PIPELINE_CONCURRENCY = {"triage": 1}    # stage -> worker threads (implement must stay 1)
+_STAGE_END = object()
+
+_METRIC_HELP.update({
+    "iis_stage_items_total": ("counter", "Pipeline stage items by outcome"),
+    "iis_stage_duration_seconds": ("histogram", "Pipeline stage time per item"),
+})
+
+
+class Stage:
+    """fn(item) returns the item for the next stage, or None when the item
+    is finished here.  An exception retries up to `retries` times (backoff
+    doubling from retry_backoff s), then goes to the pipeline's on_error."""
+
+    def __init__(self, name, fn, concurrency=1, retries=0, retry_backoff=5.0,
+                 queue_size=None):
+        self.name, self.fn = name, fn
+        self.concurrency = max(1, concurrency)
+        self.retries, self.retry_backoff = retries, retry_backoff
+        self.queue = queue.Queue(maxsize=queue_size or self.concurrency)
+        self.stats = {"in": 0, "passed": 0, "finished": 0, "failed": 0, "retried": 0,
+                      "dropped": 0, "busy_s": 0.0, "max_depth": 0}
+
+
+class Pipeline:
+    """Run `source` items through `stages`.  stop() ends intake; items still
+    queued are handed to on_drop, items mid-stage finish normally."""
+
+    def __init__(self, name, stages, on_error=None, on_drop=None):
+        self.name, self.stages = name, stages
+        self.on_error = on_error or (lambda stage, item, exc: None)
+        self.on_drop = on_drop or (lambda stage, item: None)
+        self.stop_reason = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def stop(self, reason):
+        if not self._stopped.is_set():
+            self.stop_reason = reason
+            log.warning("  [PIPELINE] %s stopping: %s", self.name, reason)
+            self._stopped.set()
+
+    def _count(self, stage, key, value=1):
+        with self._lock:
+            stage.stats[key] += value
+
+    def _worker(self, idx, remaining):
+        stage = self.stages[idx]
+        nxt = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _STAGE_END:
+                with self._lock:
+                    remaining[idx] -= 1
+                    last = remaining[idx] == 0
+                if last and nxt:
+                    for _ in range(nxt.concurrency):
+                        nxt.queue.put(_STAGE_END)
+                return
+            if self.stopped:
+                self._count(stage, "dropped")
+                self.on_drop(stage.name, item)
+                continue
+            self._count(stage, "in")
+            for attempt in range(stage.retries + 1):
+                t0 = time.monotonic()
+                try:
+                    with span(stage.name, cat="stage"):
+                        out = stage.fn(item)
+                except Exception as e:
+                    self._count(stage, "busy_s", time.monotonic() - t0)
+                    if attempt < stage.retries and not self.stopped:
+                        self._count(stage, "retried")
+                        log.warning("  [PIPELINE] %s failed (%s) — retry %d/%d",
+                                    stage.name, e, attempt + 1, stage.retries)
+                        time.sleep(stage.retry_backoff * 2 ** attempt)
+                        continue
+                    self._count(stage, "failed")
+                    _metric_inc("iis_stage_items_total", stage=stage.name, outcome="failed")
+                    log.error("  [PIPELINE] %s failed: %s", stage.name, e, exc_info=True)
+                    self.on_error(stage.name, item, e)
+                    break
+                dt = time.monotonic() - t0
+                self._count(stage, "busy_s", dt)
+                _metric_observe("iis_stage_duration_seconds", dt, stage=stage.name)
+                if out is not None and nxt is not None:
+                    self._count(stage, "passed")
+                    _metric_inc("iis_stage_items_total", stage=stage.name, outcome="passed")
+                    nxt.queue.put(out)
+                    with self._lock:
+                        nxt.stats["max_depth"] = max(nxt.stats["max_depth"], nxt.queue.qsize())
+                else:
+                    self._count(stage, "finished")
+                    _metric_inc("iis_stage_items_total", stage=stage.name, outcome="finished")
+                break
+
+    def run(self, source):
+        """Feed `source` (pulled lazily on this thread) and wait for every
+        stage to drain.  Returns stats()."""
+        remaining = [s.concurrency for s in self.stages]
+        threads = [threading.Thread(target=self._worker, args=(idx, remaining), daemon=True,
+                                    name=f"{self.name}-{stage.name}-{n}")
+                   for idx, stage in enumerate(self.stages) for n in range(stage.concurrency)]
+        for t in threads:
+            t.start()
+        first = self.stages[0]
+        t0 = time.monotonic()
+        try:
+            for item in source:
+                if self.stopped:
+                    self.on_drop("source", item)
+                    break
+                first.queue.put(item)
+        finally:
+            for _ in range(first.concurrency):
+                first.queue.put(_STAGE_END)
+            for t in threads:
+                t.join()
+        self.wall_s = time.monotonic() - t0
+        return self.stats()
+
+    def stats(self):
+        """{stage: counters + utilization (busy time / wall time / workers)}."""
+        wall = getattr(self, "wall_s", 0) or 1e-9
+        with self._lock:
+            return {s.name: dict(s.stats, busy_s=round(s.stats["busy_s"], 1),
+                                 utilization=round(s.stats["busy_s"] / wall / s.concurrency, 2))
+                    for s in self.stages}
+
+
+def log_pipeline_stats(stats):
+    for name, st in stats.items():
+        log.info("  [PIPELINE] %-10s in=%d passed=%d finished=%d failed=%d retried=%d"
+                 " dropped=%d busy=%.0fs util=%.0f%% max_queue=%d", name, st["in"],
+                 st["passed"], st["finished"], st["failed"], st["retried"], st["dropped"],
+                 st["busy_s"], st["utilization"] * 100, st["max_depth"])
+
+
+# ── FLUX 1: WORK QUEUE ─────────────────────────────────────────────────────
+# Persistent, scored queue of issues (SQLite/WAL, so lease/settle updates are
+# atomic across processes and survive crashes).  flux_issues leases the best
+# ready item, works it and settles it: done, failed (retry with exponential
+# backoff up to WORK_QUEUE_MAX_ATTEMPTS) or released (untouched, e.g. budget
+# skip).  Leases are kept alive by a heartbeat; a lease whose holder died
+# expires and is reclaimed.  Triage workers (run_triage_worker) share the
+# queue: they settle items as "triaged" and the git owner implements them.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+_PRIORITY_SCORE = {"P0-critical": 100, "P1-security": 90, "P2-bug": 60,
+                   "P3-enhancement": 30, "P4-debt": 10}
+_git_owner = True       # False in worker mode: never commit/push/restore the tree
+
+
+def score_issue(issue, history=None):
+    """Higher = work first.  Priority dominates; waiting users, long-open
+    issues and comment activity raise it; expected success (Laplace-smoothed
+    past implement outcomes) and timeout escalation scale it."""
+    score = float(_PRIORITY_SCORE.get(issue.get("priority"), 20))
+    if issue.get("waiting_for_us"):
+        score += 15
+    age = _issue_age_days(issue)
+    if age:
+        score += min(age / 365 * 3, 15)
+    score += min(sum(1 for c in (issue.get("comments") or []) if not c.get("is_ours")), 10)
+    if history is None:
+        history = query_chain_history(issue=issue["number"], task_type="implement", load=False)
+    wins = sum(1 for e in history if e["outcome"] == "success")
+    score *= 0.5 + (wins + 1) / (len(history) + 2)
+    score /= _get_escalation(f"impl_{issue['number']}")
+    return round(score, 2)
+
+
+def _lease_owner_dead(owner):
+    """True if a lease owner ("host:pid") is a dead process on this host.
+    Owners on other hosts can't be probed — their leases just expire."""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False        # exists, owned by someone else
+    return False
+
+
+class WorkQueue:
+    """Items keyed "issue:<number>"; state pending|leased|triaged|done|failed|dropped."""
+
+    _COLUMNS = {"payload": "TEXT", "triage": "TEXT"}    # added after the first schema
+
+    def __init__(self, path=None):
+        self.path = Path(path or WORK_QUEUE_DB)
+        self._lock = threading.RLock()      # one connection, shared by pipeline stages
+        self.db = sqlite3.connect(str(self.path), timeout=30,
+                                  isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA busy_timeout=30000")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS items (
+            key TEXT PRIMARY KEY, number INTEGER, title TEXT, version TEXT,
+            score REAL, state TEXT NOT NULL DEFAULT 'pending', resumed INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0, not_before REAL DEFAULT 0,
+            lease_owner TEXT, lease_expires REAL, last_error TEXT, result TEXT,
+            created REAL, updated REAL)""")
+        have = {r["name"] for r in self.db.execute("PRAGMA table_info(items)")}
+        for col, typ in self._COLUMNS.items():
+            if col not in have:
+                self.db.execute(f"ALTER TABLE items ADD COLUMN {col} {typ}")
+        self.db.execute("CREATE INDEX IF NOT EXISTS items_ready ON items (state, not_before)")
+
+    def close(self):
+        self.db.close()
+
+    @contextlib.contextmanager
+    def _tx(self):
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def sync(self, issues, scorer=score_issue, now=None):
+        """Upsert actionable issues and refresh waiting scores.  An item whose
+        issue changed upstream (new github_updated_at) gets a fresh start —
+        worker triage included; first-timers no longer actionable are dropped."""
+        now = now or time.time()
+        keys = set()
+        with self._tx():
+            for iss in issues:
+                key = f"issue:{iss['number']}"
+                keys.add(key)
+                version = iss.get("github_updated_at") or ""
+                fields = (iss.get("title", ""), version, scorer(iss),
+                          json.dumps(iss, ensure_ascii=False), now)
+                row = self.db.execute("SELECT state, version FROM items WHERE key=?",
+                                      (key,)).fetchone()
+                if row is None:
+                    self.db.execute(
+                        "INSERT INTO items (title, version, score, payload, updated, key, number,"
+                        " created) VALUES (?,?,?,?,?,?,?,?)", fields + (key, iss["number"], now))
+                    continue
+                changed = row["version"] != version
+                if row["state"] == "dropped" or (changed and row["state"] != "leased"):
+                    reset = ", state='pending', triage=NULL, attempts=0, not_before=0"
+                elif row["state"] in ("pending", "triaged"):
+                    reset = ""
+                else:
+                    continue
+                self.db.execute("UPDATE items SET title=?, version=?, score=?, payload=?,"
+                                " updated=?" + reset + " WHERE key=?", fields + (key,))
+            for row in self.db.execute(
+                    "SELECT key FROM items WHERE state IN ('pending', 'triaged')"
+                    " AND attempts=0").fetchall():
+                if row["key"] not in keys:
+                    self.db.execute("UPDATE items SET state='dropped', updated=? WHERE key=?",
+                                    (now, row["key"]))
+
+    def requeue_leases(self):
+        """Return leases held by dead processes on this host to the front of
+        the queue (a crashed run resumes first).  Returns the count."""
+        with self._tx():
+            dead = [r["key"] for r in self.db.execute(
+                "SELECT key, lease_owner FROM items WHERE state='leased'").fetchall()
+                if _lease_owner_dead(r["lease_owner"])]
+            for key in dead:
+                self.db.execute(
+                    "UPDATE items SET state=CASE WHEN triage IS NULL THEN 'pending'"
+                    " ELSE 'triaged' END, resumed=1, lease_owner=NULL, lease_expires=NULL"
+                    " WHERE key=?", (key,))
+        return len(dead)
+
+    def lease(self, owner=WORKER_ID, ttl=WORK_QUEUE_LEASE_SECS, exclude=(),
+              states=("pending", "triaged"), now=None):
+        """Atomically take the best ready item in `states` (or an expired
+        lease).  Triage workers lease only "pending"."""
+        now = now or time.time()
+        excl = list(exclude)
+        with self._tx():
+            row = self.db.execute(
+                f"SELECT * FROM items WHERE ((state IN ({','.join('?' * len(states))})"
+                " AND not_before<=?) OR (state='leased' AND lease_expires<?"
+                + ("" if "triaged" in states else " AND triage IS NULL") + "))"
+                + (f" AND key NOT IN ({','.join('?' * len(excl))})" if excl else "") +
+                " ORDER BY resumed DESC, score DESC, number LIMIT 1",
+                list(states) + [now, now] + excl).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE items SET state='leased', lease_owner=?, lease_expires=?, updated=?"
+                " WHERE key=?", (owner, now + ttl, now, row["key"]))
+        return dict(row, state="leased", lease_owner=owner)
+
+    def renew(self, key, owner=WORKER_ID, ttl=WORK_QUEUE_LEASE_SECS):
+        """Heartbeat: extend a lease.  False if it was lost."""
+        with self._tx():
+            cur = self.db.execute(
+                "UPDATE items SET lease_expires=? WHERE key=? AND state='leased'"
+                " AND lease_owner=?", (time.time() + ttl, key, owner))
+        return cur.rowcount == 1
+
+    def settle(self, key, outcome, owner=WORKER_ID, detail="", now=None):
+        """outcome: "done", "failed" (retry with backoff), "triaged" (detail =
+        triage JSON, waits for the git owner) or "release"."""
+        now = now or time.time()
+        with self._tx():
+            row = self.db.execute(
+                "SELECT attempts, triage FROM items WHERE key=? AND state='leased'"
+                " AND lease_owner=?", (key, owner)).fetchone()
+            if row is None:
+                return False                     # lease lost (expired and re-taken)
+            if outcome == "done":
+                sets = ("state='done', result=?", (detail,))
+            elif outcome == "triaged":
+                sets = ("state='triaged', triage=?", (detail,))
+            elif outcome == "failed":
+                attempts = row["attempts"] + 1
+                delay = min(WORK_QUEUE_RETRY_BASE_SECS * 2 ** (attempts - 1),
+                            WORK_QUEUE_RETRY_MAX_SECS)
+                state = "failed" if attempts >= WORK_QUEUE_MAX_ATTEMPTS else "pending"
+                sets = ("state=?, triage=NULL, attempts=?, not_before=?, last_error=?",
+                        (state, attempts, now + delay, detail))
+            else:
+                sets = ("state=?", ("pending" if row["triage"] is None else "triaged",))
+            self.db.execute(
+                f"UPDATE items SET {sets[0]}, resumed=0, lease_owner=NULL, lease_expires=NULL,"
+                " updated=? WHERE key=?", sets[1] + (now, key))
+        return True
+
+    def complete(self, number, detail=""):
+        """Mark an issue done outside a lease (e.g. a resumed chain)."""
+        with self._tx():
+            self.db.execute("UPDATE items SET state='done', result=?, resumed=0,"
+                            " lease_owner=NULL, lease_expires=NULL, updated=? WHERE key=?",
+                            (detail, time.time(), f"issue:{number}"))
+
+    def ready_count(self, states=("pending", "triaged"), now=None):
+        return self._query(
+            f"SELECT COUNT(*) FROM items WHERE state IN ({','.join('?' * len(states))})"
+            " AND not_before<=?", list(states) + [now or time.time()])[0][0]
+
+    def peek(self, limit=None, now=None):
+        return [dict(r) for r in self._query(
+            "SELECT * FROM items WHERE state IN ('pending', 'triaged') AND not_before<=?"
+            " ORDER BY resumed DESC, score DESC, number LIMIT ?",
+            (now or time.time(), limit or -1))]
+
+    def counts(self):
+        return {r["state"]: r["n"] for r in self._query(
+            "SELECT state, COUNT(*) AS n FROM items GROUP BY state")}
+
+
+class LeasedIssues:
+    """Issues leased from a WorkQueue by this process.  take() leases the
+    next one and settle() records its result; several may be in flight (one
+    per pipeline stage).  A heartbeat thread renews every held lease.
+
+    Iterating is the sequential form: the loop body records the result with
+    done()/failed()/triaged(); anything else (continue, break, exception)
+    releases the lease.  Released items are not offered again this run."""
+
+    def __init__(self, queue, load_issue=None, max_items=None, owner=WORKER_ID,
+                 states=("pending", "triaged"), heartbeat_secs=WORK_QUEUE_HEARTBEAT_SECS):
+        self.queue, self.load_issue = queue, load_issue
+        self.max_items, self.owner, self.states = max_items, owner, states
+        self.heartbeat_secs = heartbeat_secs
+        self.skipped = set()
+        self.lost = 0                   # leases that expired under us (heartbeat failed)
+        self._held = {}                 # key -> queue item
+        self._item = None
+        self._outcome = None
+        self._beat = None
+        self._stop = threading.Event()
+
+    def done(self, detail=""):
+        self._outcome = ("done", detail)
+
+    def failed(self, error):
+        self._outcome = ("failed", error)
+
+    def triaged(self, triage, agent):
+        self._outcome = ("triaged", json.dumps({"agent": agent, "triage": triage}))
+
+    def stored_triage(self, item=None):
+        """(triage, agent) left on an item (default: current) by a triage worker."""
+        item = item or self._item
+        raw = item and item.get("triage")
+        if not raw:
+            return None, None
+        data = json.loads(raw)
+        return data["triage"], f"worker:{data['agent']}"
+
+    def start(self):
+        if self._beat is None:
+            self._stop.clear()
+            self._beat = threading.Thread(target=self._heartbeat, name="lease-heartbeat",
+                                          daemon=True)
+            self._beat.start()
+
+    def stop(self):
+        """Release everything still held and stop the heartbeat."""
+        for item in list(self._held.values()):
+            self.settle(item, "release")
+        self._stop.set()
+        self._beat = None
+
+    def take(self):
+        """Lease the next issue: (issue, item), or None when nothing is ready."""
+        while True:
+            item = self.queue.lease(self.owner, exclude=self.skipped, states=self.states)
+            if item is None:
+                return None
+            issue = self.load_issue(item["number"]) if self.load_issue else None
+            if issue is None and item.get("payload"):
+                issue = json.loads(item["payload"])
+            if issue is not None:
+                self._held[item["key"]] = item
+                return issue, item
+            self.queue.settle(item["key"], "done", self.owner, "not in issue DB")
+
+    def settle(self, item, outcome, detail=""):
+        if self._held.pop(item["key"], None) is None:
+            return
+        if outcome == "release":
+            self.skipped.add(item["key"])
+        if not self.queue.settle(item["key"], outcome, self.owner, detail):
+            log.warning("  [QUEUE] Lease on %s was lost — result discarded", item["key"])
+
+    def _settle_current(self):
+        if self._item is not None:
+            self.settle(self._item, *(self._outcome or ("release", "")))
+        self._item = self._outcome = None
+
+    def _heartbeat(self):
+        hb = WorkQueue(self.queue.path)
+        try:
+            while not self._stop.wait(self.heartbeat_secs):
+                for key in list(self._held):
+                    if not hb.renew(key, self.owner) and key in self._held:
+                        self.lost += 1
+                        log.warning("  [QUEUE] Heartbeat could not renew %s", key)
+        finally:
+            hb.close()
+
+    def __iter__(self):
+        taken = 0
+        self.start()
+        try:
+            while not self.max_items or taken < self.max_items:
+                got = self.take()
+                if got is None:
+                    return
+                issue, self._item = got
+                taken += 1
+                yield issue
+                self._settle_current()
+        finally:
+            self._settle_current()
+            self.stop()
+
+
+def _load_issue_from_db(number):
+    try:
+        return iis_read_json(ISSUES_DB_DIR / f"{number:04d}.json")
+    except Exception:
+        return None
+
+
+# ── FLUX 1: TRIAGE WORKER ──────────────────────────────────────────────────
+def run_triage_worker(max_issues=None):
+    """Worker mode: triage issues from the shared queue, never touch the
+    owner's tree.  Agents run in this worker's own worktrees (removed at
+    exit); no git writes, restores or taskkill in REPO_ROOT.  Any number of
+    workers (this host or others sharing WORK_QUEUE_DB) can run next to the
+    orchestrator; decisions are applied by the git owner.
+    Returns the number of issues triaged."""
+    global _git_owner
+    _git_owner = False
+    queue = WorkQueue()
+    requeued = queue.requeue_leases()
+    if requeued:
+        log.info("  [WORKER] Requeued %d lease(s) of dead local processes", requeued)
+    log.info("  [WORKER] %s on %s — %d item(s) ready", WORKER_ID, queue.path,
+             queue.ready_count(states=("pending",)))
+    leases = LeasedIssues(queue, max_items=max_issues, states=("pending",))
+    triaged = failures = 0
+    try:
+        for issue in leases:
+            num = issue["number"]
+            if _session_budget_state() == "exhausted":
+                log.warning("  [WORKER] Cost ceiling reached — stopping")
+                break
+            duplicates = find_near_duplicates(issue)
+            triage, agent = pretriage(issue, duplicates)
+            if not triage:
+                triage, agent = chain_triage(issue, duplicates=duplicates)
+            if not triage:
+                leases.failed("triage chain failed (worker)")
+                failures += 1
+                if failures >= 10:
+                    log.error("  [WORKER] %d consecutive triage failures — stopping", failures)
+                    break
+                continue
+            failures = 0
+            triaged += 1
+            leases.triaged(triage, agent)
+            log.info("  [WORKER] #%d → %s (%s)", num, triage.get("decision"), agent)
+    finally:
+        remove_triage_trees()
+    log.info("  [WORKER] Done: %d triaged, queue %s", triaged, queue.counts())
+    queue.close()
+    return triaged
+
+
+# ── FLUX 1: PRE-TRIAGE RULES ───────────────────────────────────────────────
+# Cheap local rules that settle obvious triage decisions before any agent
+# call.  A rule is fn(issue, facts) -> None | (decision, confidence, reason);
+# register with @pretriage_rule.  The most confident verdict at or above
+# PRETRIAGE_MIN_CONFIDENCE is recorded directly (see flux_issues).
+PRETRIAGE_MIN_CONFIDENCE = 0.9
+PRETRIAGE_DISABLED_RULES = set()        # rule names to switch off
+PRETRIAGE_STALE_DAYS = 2 * 365          # "old" for the label-based rules
+PRETRIAGE_RULES = []
+
+
+def pretriage_rule(fn):
+    PRETRIAGE_RULES.append(fn)
+    return fn
+
+
+def _issue_age_days(issue, now=None):
+    try:
+        created = datetime.datetime.fromisoformat(
+            (issue.get("created_at") or "").replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=datetime.timezone.utc)
+    return (now - created).days
+
+
+def pretriage_facts(issue, duplicates=None, now=None):
+    """Features the rules see (computed once per issue)."""
+    comments = issue.get("comments") or []
+    return {
+        "labels": {lbl.lower() for lbl in (issue.get("labels") or [])},
+        "age_days": _issue_age_days(issue, now),
+        "waiting_for_us": bool(issue.get("waiting_for_us")),
+        "answered_by_us": bool(comments) and bool(comments[-1].get("is_ours")),
+        "reporter_followed_up": bool(issue.get("author")) and any(
+            c.get("author") == issue["author"] for c in comments),
+        "last_iteration": ((issue.get("iterations") or [{}])[-1]).get("type"),
+        "duplicates": duplicates or [],
+    }
+
+
+@pretriage_rule
+def rule_near_duplicate(issue, facts):
+    verdict = dedup_pretriage(issue, facts["duplicates"])
+    if verdict:
+        sim = max(d["similarity"] for d in facts["duplicates"]
+                  if d["number"] == verdict["duplicate_of"])
+        return "duplicate", sim, verdict["reason"]
+    return None
+
+
+@pretriage_rule
+def rule_duplicate_label(issue, facts):
+    if "duplicate" not in facts["labels"]:
+        return None
+    old = (facts["age_days"] or 0) >= PRETRIAGE_STALE_DAYS
+    # A fresh label may still be disputed: leave it to the agents
+    return "duplicate", 0.95 if old else 0.8, "labelled Duplicate upstream"
+
+
+@pretriage_rule
+def rule_stale_need_check(issue, facts):
+    if "need 2 check" not in facts["labels"] or facts["waiting_for_us"] \
+            or facts["reporter_followed_up"]:
+        return None
+    if (facts["age_days"] or 0) < PRETRIAGE_STALE_DAYS:
+        return None
+    return ("needs_info", 0.9,
+            f"'Need 2 check' for {facts['age_days'] // 365}+ years with no reporter follow-up")
+
+
+@pretriage_rule
+def rule_answered_by_us(issue, facts):
+    if not facts["answered_by_us"] or facts["waiting_for_us"]:
+        return None
+    if facts["last_iteration"] in ("testing", "released"):
+        return "needs_info", 0.95, "fix already shipped; awaiting reporter feedback"
+    return "needs_info", 0.9, "last comment is ours; awaiting reporter reply"
+
+
+def pretriage(issue, duplicates=None, now=None):
+    """(triage_dict, "rule:<name>") for a confident rule verdict, else (None, None)."""
+    facts = pretriage_facts(issue, duplicates, now)
+    best = None
+    for rule in PRETRIAGE_RULES:
+        if rule.__name__ in PRETRIAGE_DISABLED_RULES:
+            continue
+        try:
+            verdict = rule(issue, facts)
+        except Exception as e:
+            log.warning("  [PRE-TRIAGE] Rule %s failed: %s", rule.__name__, e)
+            continue
+        if verdict and verdict[1] >= PRETRIAGE_MIN_CONFIDENCE and \
+                (best is None or verdict[1] > best[1][1]):
+            best = (rule.__name__, verdict)
+    if not best:
+        return None, None
+    name, (decision, confidence, reason) = best
+    return {
+        "decision": decision,
+        "reason": reason,
+        "priority": issue.get("priority") or _auto_classify(issue)["priority"],
+        "confidence": confidence,
+    }, f"rule:{name}"
+
+
 # ── FLUX 1: OPEN ISSUES ────────────────────────────────────────────────────
 def load_actionable_issues():
     """Load issues from JSON DB that need triage or implementation.
@@ -2539,12 +5722,8 @@ RULES (CRITICAL):
     status.data["issues"]["implemented"] += 1
     log.info("  [FIX] Committed %s — %s", h[:8], msg)
 
-    status.set_task(type="issue_fix", issue=num, step="pushing")
-    git_push()
-
-    status.set_task(type="issue_fix", issue=num, step="commenting")
-    if post_github_comment(num, h, short):
-        status.data["issues"]["commented_on_github"] += 1
+    get_outbox().push()
+    post_github_comment(num, h, short)
     update_issue_json(num, "testing", f"Fix in {h[:8]}")
 
     status.clear_task()
@@ -2610,6 +5789,7 @@ def _classify_test_failures(failed_tests):
     return groups
 
 
+@traced("hygiene_fix", cat="hygiene")
 def _attempt_hygiene_fix(group, status):
     """Try to fix a group of pre-existing test failures.
 
@@ -2648,6 +5828,7 @@ RULES:
 8. NEVER modify infrastructure files: run-tests.ps1, build.ps1, mRemoteNG.sln, Directory.Build.props"""
 
         status.set_task(type="test_hygiene", step=f"fix_{group['description']}_{attempt}")
+        prompt = _with_repo_map(prompt)
         timeout = 600  # 10 min per hygiene fix attempt
         agent_out = _agent_dispatch(TEST_HYGIENE_AGENT, prompt, max_turns=20,
                                      timeout=timeout, retries=1, task_type="test_hygiene")
@@ -2698,6 +5879,7 @@ RULES:
     return False
 
 
+@traced(cat="flux", args_fn=lambda status, phase="pre-flight": {"phase": phase})
 def flux_test_hygiene(status, phase="pre-flight"):
     """Detect and auto-fix pre-existing test failures.
 
@@ -2789,6 +5971,37 @@ def flux_test_hygiene(status, phase="pre-flight"):
     status.clear_task()
 
 
+# Issues whose interrupted chain was resumed (or dropped) this run; flux_issues
+# completes them in the work queue.
+_resumed_issues = set()
+
+
+def _resume_unfinished_chains(status):
+    """Resume implement chains left in chain-context/_active/.
+    Runs before pre-flight hygiene — hygiene commits with `git add -A`, which
+    would sweep up the interrupted agent's edits and move HEAD, so every
+    resume would then be discarded.  Returns the set of issue numbers that
+    were handled (also recorded in _resumed_issues)."""
+    handled = set()
+    for task_id in ChainContext.unfinished("implement"):
+        ctx = ChainContext.load_progress("implement", task_id)
+        if ctx is None or not task_id.isdigit():
+            continue
+        num = int(task_id)
+        handled.add(num)
+        _resumed_issues.add(num)
+        if _is_issue_already_committed(num):
+            log.info("  [RESUME] #%d already committed — dropping stale chain", num)
+            ctx.clear_progress()
+            drop_checkpoints(f"impl_{num}")
+            continue
+        log.info("  [RESUME] Unfinished chain for #%d found", num)
+        if resume_chain_implement(ctx, status):
+            status.save()
+    return handled
+
+
+@traced(cat="flux")
 def flux_issues(status, dry_run=False, max_issues=None):
     """FLUX 1: Sync, triage, implement open issues."""
     log.info("=" * 60)
@@ -2807,98 +6020,129 @@ def flux_issues(status, dry_run=False, max_issues=None):
     status.save()
     log.info("  Found %d actionable issues", len(issues))
 
-    # Warm the committed-issues cache from recent git log
-    _warm_committed_issues_cache(lookback=200)
-
+    # Warm the committed-issues cache from the persistent commit index
+    _warm_committed_issues_cache()
+
+    # ── QUEUE: persistent, scored; leases left by a dead run go first ──
+    queue = WorkQueue()
+    requeued = queue.requeue_leases()
+    if requeued:
+        log.info("  [QUEUE] Requeued %d item(s) leased by a previous run", requeued)
+    queue.sync(issues)
+
+    # ── RESUME: finish chains interrupted by a crash/restart first ──
+    if not dry_run:
+        _resume_unfinished_chains(status)
+        for num in sorted(_resumed_issues):
+            queue.complete(num, "resumed chain")
+        _resumed_issues.clear()
+
+    by_num = {iss["number"]: iss for iss in issues}
+    planned = queue.ready_count()
     if max_issues:
-        issues = issues[:max_issues]
-
-    consecutive_triage_failures = 0
-    consecutive_impl_failures = 0
-    consecutive_phantom_tests = 0
-    for i, issue in enumerate(issues, 1):
-        num = issue["number"]
-        title = issue.get("title", "")[:50]
-        log.info("[%d/%d] Issue #%d: %s", i, len(issues), num, title)
-        print_progress("ISSUES", i, len(issues), f"#{num} {title}", status)
-
+        planned = min(planned, max_issues)
+    log.info("  [QUEUE] %d ready, %s", planned, queue.counts())
+    leases = LeasedIssues(queue, lambda n: by_num.get(n) or _load_issue_from_db(n))
+    breaker = {"triage": 0, "impl": 0, "dispatched": 0}
+    breaker_lock = threading.Lock()
+
+    # ── SOURCE: lease in score order; budget gates intake ──
+    def leased_issues():
+        i = 0
+        while not max_issues or i < max_issues:
+            got = leases.take()
+            if got is None:
+                return
+            issue, item = got
+            i += 1
+            num = issue["number"]
+            title = issue.get("title", "")[:50]
+            log.info("[%d/%d] Issue #%d: %s", i, planned, num, title)
+            print_progress("ISSUES", i, planned, f"#{num} {title}", status)
+            if dry_run:
+                log.info("  [DRY RUN] skip triage")
+                leases.settle(item, "release")
+                continue
+            budget = _session_budget_state()
+            if budget == "exhausted":
+                log.warning("  [BUDGET] Cost ceiling reached — stopping with %d issues left",
+                            planned - i + 1)
+                leases.settle(item, "release")
+                return
+            if budget == "downgrade" and issue.get("priority") in BUDGET_SKIP_PRIORITIES:
+                log.info("  [BUDGET] Near cost ceiling — skipping %s issue", issue.get("priority"))
+                leases.settle(item, "release")
+                continue
+            triage, agent = leases.stored_triage(item)
+            yield {"issue": issue, "lease": item, "triage": triage, "agent": agent}
+
+    # ── STAGE pretriage: worker result or deterministic rules (no agent) ──
+    def stage_pretriage(w):
+        num = w["issue"]["number"]
+        if w["triage"]:
+            log.info("  [QUEUE] #%d triaged by %s", num, w["agent"])
+            return w
+        w["duplicates"] = find_near_duplicates(w["issue"])
+        triage, rule = pretriage(w["issue"], w["duplicates"])
+        if triage:
+            status.data["issues"]["pretriaged"] += 1
+            log.info("  [PRE-TRIAGE] #%d %s (%s, %.0f%%) — agent triage skipped",
+                     num, triage["decision"], rule, triage["confidence"] * 100)
+            emit_event("triage_skipped", issue=num, rule=rule,
+                       decision=triage["decision"], confidence=triage["confidence"])
+            w["triage"], w["agent"] = triage, rule
+        return w
+
+    # ── STAGE triage: agent chain ──
+    def stage_triage(w):
+        if w["triage"]:
+            return route_decision(w)
+        num = w["issue"]["number"]
         status.set_task(type="triage", issue=num, step="analyzing")
-        if dry_run:
-            log.info("  [DRY RUN] skip triage")
-            continue
-
         # Rate-limit: pause between API calls (2s normal, 30s after failures)
-        if i > 1:
-            delay = 30 if consecutive_triage_failures >= 3 else 2
-            time.sleep(delay)
-
-        triage, triage_agent = chain_triage(issue)
+        with breaker_lock:
+            first = breaker["dispatched"] == 0
+            breaker["dispatched"] += 1
+        if not first:
+            _sleep(30 if breaker["triage"] >= 3 else 2, "sleep_between_issues")
+        triage, agent = chain_triage(w["issue"], duplicates=w.get("duplicates"))
         if not triage:
             status.add_error(f"issue_{num}", "triage", "chain failed (both agents)")
             status.data["issues"]["failed"] += 1
-            consecutive_triage_failures += 1
-            if consecutive_triage_failures >= 10:
-                log.error("  [CIRCUIT BREAKER] %d consecutive triage failures — stopping", consecutive_triage_failures)
-                break
-            continue
-
-        consecutive_triage_failures = 0  # reset on success
+            leases.settle(w["lease"], "failed", "triage chain failed")
+            with breaker_lock:
+                breaker["triage"] += 1
+                tripped = breaker["triage"] >= 10
+            if tripped:
+                pipe.stop(f"{breaker['triage']} consecutive triage failures")
+            return None
+        with breaker_lock:
+            breaker["triage"] = 0
+        w["triage"], w["agent"] = triage, agent
+        return route_decision(w)
+
+    # ── Triage decisions: only "implement" goes on to the implement stage ──
+    def note_decision(w):
+        triage = w["triage"]
         decision = triage.get("decision", "needs_info")
-        ai_priority = triage.get("priority")
         ai_reason = triage.get("reason", "")
         ai_approach = triage.get("approach", "")
-        ai_notes = f"AI triage ({triage_agent}): {ai_reason}" + (
+        ai_notes = f"AI triage ({w['agent']}): {ai_reason}" + (
             f"\nApproach: {ai_approach}" if ai_approach else ""
         )
         status.data["issues"]["triaged"] += 1
-        log.info("  Decision: %s [%s] — %s", decision, triage_agent, ai_reason)
-
-        if decision == "implement":
-            # ── DEDUP: skip if already committed ──
-            if _is_issue_already_committed(num):
-                log.info("  [DEDUP] #%d already committed — skipping", num)
-                update_issue_json(num, "testing", "Already committed (dedup)")
-                continue
-
-            status.data["issues"]["to_implement"] += 1
-            update_issue_json(num, "triaged", ai_reason,
-                              priority=ai_priority, notes=ai_notes)
-            impl_ok = chain_implement(issue, triage, status)
-
-            if impl_ok:
-                consecutive_impl_failures = 0
-                consecutive_phantom_tests = 0
-            else:
-                consecutive_impl_failures += 1
-
-                # ── CIRCUIT BREAKER: consecutive implementation failures ──
-                if consecutive_impl_failures >= IMPL_CONSECUTIVE_FAIL_LIMIT:
-                    log.error("  [CIRCUIT BREAKER] %d consecutive implementation failures — stopping!",
-                              consecutive_impl_failures)
-                    log.error("  [CIRCUIT BREAKER] Last %d issues all failed. Likely infrastructure problem.",
-                              IMPL_CONSECUTIVE_FAIL_LIMIT)
-                    # Verify infrastructure: do a baseline build+test
-                    log.info("  [CIRCUIT BREAKER] Running baseline build+test to check infrastructure...")
-                    b_ok, _ = run_build(capture_output=True)
-                    if b_ok:
-                        t_result = run_tests(return_details=True)
-                        t_phantom = len(t_result) == 4 and t_result[3]
-                        t_ok = t_result[0]
-                        if t_phantom:
-                            log.error("  [CIRCUIT BREAKER] CONFIRMED: tests are phantom — STOPPING run")
-                            log.error("  [CIRCUIT BREAKER] Fix test infrastructure before resuming")
-                            break
-                        elif not t_ok:
-                            log.error("  [CIRCUIT BREAKER] Baseline tests failing — STOPPING run")
-                            break
-                        else:
-                            log.info("  [CIRCUIT BREAKER] Baseline OK — issues may be genuinely hard. Resetting counter.")
-                            consecutive_impl_failures = 0
-                    else:
-                        log.error("  [CIRCUIT BREAKER] Build itself is failing — STOPPING run")
-                        break
-
-        elif decision == "wontfix":
+        log.info("  #%d decision: %s [%s] — %s",
+                 w["issue"]["number"], decision, w["agent"], ai_reason)
+        return decision, triage.get("priority"), ai_reason, ai_notes
+
+    def route_decision(w):
+        """Pass implement decisions on; record the rest here — they only touch
+        the issue JSON, so they never wait behind the implement stage."""
+        if w["triage"].get("decision", "needs_info") == "implement":
+            return w
+        num = w["issue"]["number"]
+        decision, ai_priority, ai_reason, ai_notes = note_decision(w)
+        if decision == "wontfix":
             status.data["issues"]["skipped_wontfix"] += 1
             update_issue_json(num, "wontfix", ai_reason,
                               priority=ai_priority, notes=ai_notes)
@@ -2910,15 +6154,100 @@ def flux_issues(status, dry_run=False, max_issues=None):
             status.data["issues"]["skipped_needs_info"] += 1
             update_issue_json(num, "triaged", ai_reason,
                               priority=ai_priority, notes=ai_notes)
+        leases.settle(w["lease"], "done", decision)
+        status.save()
+        return None
+
+    # ── STAGE implement: owns the working tree (implement → verify → commit) ──
+    def stage_implement(w):
+        with _tree_lock:
+            return implement_issue(w)
+
+    def implement_issue(w):
+        issue, triage, item = w["issue"], w["triage"], w["lease"]
+        num = issue["number"]
+        _, ai_priority, ai_reason, ai_notes = note_decision(w)
+        # ── DEDUP: skip if already committed ──
+        if _is_issue_already_committed(num):
+            log.info("  [DEDUP] #%d already committed — skipping", num)
+            update_issue_json(num, "testing", "Already committed (dedup)")
+            leases.settle(item, "done", "already committed")
+            return None
+
+        status.data["issues"]["to_implement"] += 1
+        update_issue_json(num, "triaged", ai_reason,
+                          priority=ai_priority, notes=ai_notes)
+        impl_ok = chain_implement(issue, triage, status)
+
+        if impl_ok:
+            leases.settle(item, "done", "implemented")
+            breaker["impl"] = 0
+        else:
+            leases.settle(item, "failed", "implementation chain failed")
+            breaker["impl"] += 1
+
+            # ── CIRCUIT BREAKER: consecutive implementation failures ──
+            if breaker["impl"] >= IMPL_CONSECUTIVE_FAIL_LIMIT:
+                log.error("  [CIRCUIT BREAKER] %d consecutive implementation failures — stopping!",
+                          breaker["impl"])
+                log.error("  [CIRCUIT BREAKER] Last %d issues all failed. Likely infrastructure problem.",
+                          IMPL_CONSECUTIVE_FAIL_LIMIT)
+                # Verify infrastructure: do a baseline build+test
+                log.info("  [CIRCUIT BREAKER] Running baseline build+test to check infrastructure...")
+                b_ok, _ = run_build(capture_output=True)
+                if b_ok:
+                    t_result = run_tests(return_details=True)
+                    t_phantom = len(t_result) == 4 and t_result[3]
+                    t_ok = t_result[0]
+                    if t_phantom:
+                        log.error("  [CIRCUIT BREAKER] Fix test infrastructure before resuming")
+                        pipe.stop("tests are phantom (confirmed by baseline run)")
+                    elif not t_ok:
+                        pipe.stop("baseline tests failing")
+                    else:
+                        log.info("  [CIRCUIT BREAKER] Baseline OK — issues may be genuinely hard. Resetting counter.")
+                        breaker["impl"] = 0
+                else:
+                    pipe.stop("build itself is failing")
 
         status.save()
+        return None
+
+    def on_error(stage, w, exc):
+        num = w["issue"]["number"]
+        status.add_error(f"issue_{num}", stage, str(exc)[:200])
+        leases.settle(w["lease"], "failed", f"{stage}: {exc}"[:500])
+
+    pipe = Pipeline("issues", [
+        Stage("pretriage", stage_pretriage),
+        Stage("triage", stage_triage, concurrency=PIPELINE_CONCURRENCY.get("triage", 1)),
+        Stage("implement", stage_implement),
+    ], on_error=on_error, on_drop=lambda stage, w: leases.settle(w["lease"], "release"))
+    leases.start()
+    try:
+        stats = pipe.run(leased_issues())
+    finally:
+        leases.stop()
+    status.data["pipeline"] = stats
+    status.save()
+    log_pipeline_stats(stats)
+
+    if status.data["issues"]["pretriaged"]:
+        log.info("  [PRE-TRIAGE] %d of %d triage decisions made by rules — %d agent calls saved",
+                 status.data["issues"]["pretriaged"], status.data["issues"]["triaged"],
+                 status.data["issues"]["pretriaged"])
+    log.info("  [QUEUE] %s", queue.counts())
+    queue.close()
 
 
 # ── FLUX 2: WARNING CLEANUP ────────────────────────────────────────────────
+@traced("fix_file", cat="warning",
+        args_fn=lambda fpath, *a, **k: {"file": os.path.basename(str(fpath))})
 def _fix_single_file(fpath, file_warnings, all_warnings, status, squash_mode):
     """Fix warnings in a single file. Returns (success: bool, fixed_count: int)."""
     rel = os.path.relpath(fpath, REPO_ROOT)
     n = len(file_warnings)
+    _dispatch_local.issue = None               # not an issue: no per-issue budget
     _set_token_context(operation="warning_fix")
 
     status.set_task(type="warning_fix", file=rel, step="fixing", count=n)
@@ -3014,7 +6343,7 @@ CRITICAL RULES:
             log.info("  Committed %s — fixed %d warnings (%d remaining)",
                      h[:8], fixed, new_total)
 
-    status.data["files_processed"].append(rel)
+    status.add_file_processed(rel)
     status.save()
     return True, fixed
 
@@ -3116,6 +6445,7 @@ def _group_independent_files(sorted_files, all_warnings, batch_size):
     return batches
 
 
+@traced("fix_batch", cat="warning")
 def _fix_batch_parallel(batch, all_warnings, status, squash_mode):
     """Fix a batch of files in parallel with Claude, then one build + test.
     Returns (total_fixed: int, files_fixed: list[str])."""
@@ -3225,13 +6555,13 @@ def _fix_batch_parallel(batch, all_warnings, status, squash_mode):
 
     files_fixed = [os.path.relpath(f, REPO_ROOT) for f in succeeded]
     for rel in files_fixed:
-        if rel not in status.data["files_processed"]:
-            status.data["files_processed"].append(rel)
+        status.add_file_processed(rel)
     status.save()
 
     return fixed, files_fixed
 
 
+@traced(cat="flux")
 def flux_warnings(status, dry_run=False, max_files=None, squash=False, max_passes=10,
                   parallel=0):
     """FLUX 2: Extract warnings, fix file-by-file, verify, commit.
@@ -3241,6 +6571,10 @@ def flux_warnings(status, dry_run=False, max_files=None, squash=False, max_passe
     use_parallel = parallel > 1
 
     for pass_num in range(1, max_passes + 1):
+        trace_step("pass", cat="pass", pass_num=pass_num)
+        if _session_budget_state() == "exhausted":
+            log.warning("  [BUDGET] Cost ceiling reached — stopping warning cleanup")
+            break
         status.data["current_pass"] = pass_num
         log.info("=" * 60)
         log.info("  FLUX 2: Warning Cleanup — Pass %d%s", pass_num,
@@ -3367,7 +6701,7 @@ def flux_warnings(status, dry_run=False, max_files=None, squash=False, max_passe
                 # Squash all uncommitted changes into one commit
                 if git_has_changes():
                     msg = (f"chore: fix {status.data['warnings']['fixed_this_session']} "
-                           f"nullable warnings across {len(status.data['files_processed'])} files "
+                           f"nullable warnings across {status.data['totals']['files_processed']} files "
                            f"(pass {pass_num})")
                     h = git_commit(msg)
                     if h:
@@ -3375,8 +6709,8 @@ def flux_warnings(status, dry_run=False, max_files=None, squash=False, max_passe
                         log.info("  Squash committed %s", h[:8])
 
             if status.data["commits"]:
-                log.info("  Pushing commits (pass %d) ...", pass_num)
-                git_push()
+                log.info("  Queueing push (pass %d) ...", pass_num)
+                get_outbox().push()
 
         # Check convergence: if this pass fixed nothing, stop
         if pass_fixed_total == 0:
@@ -3394,6 +6728,180 @@ def flux_warnings(status, dry_run=False, max_files=None, squash=False, max_passe
     status.clear_task()
 
 
+# ── FORECAST ────────────────────────────────────────────────────────────────
+# Projects duration/cost of an `issues` run by bootstrap-resampling past
+# per-issue chains: every planned issue draws a triage sample and, with the
+# historical implement rate for its priority, an implement sample.  Wall
+# time comes from chain contexts (agents + build + tests), cost from the
+# token ledger; _timeout_history.json is the fallback for durations.
+FORECAST_SIMULATIONS = 1000
+FORECAST_MIN_SAMPLES = 5        # below this a priority bucket uses the pooled samples
+FORECAST_DEFAULT_IMPLEMENT_RATE = 0.5
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def _issue_priorities():
+    """{issue number (str): priority} for every issue in the JSON DB."""
+    prios = {}
+    if not ISSUES_DB_DIR.exists():
+        return prios
+    for f in ISSUES_DB_DIR.glob("*.json"):
+        if f.name.startswith("_"):
+            continue
+        try:
+            data = json.loads(f.read_text(encoding="utf-8-sig"))
+            prios[str(data["number"])] = data.get("priority") or "P4-debt"
+        except Exception:
+            pass
+    return prios
+
+
+def forecast_samples():
+    """Historical per-issue samples: {"triage": {prio: [(secs, usd)]},
+    "implement": {prio: [(secs, usd)]}, "implement_rate": {prio: float}}.
+    The "*" bucket pools all priorities."""
+    cost = {}
+    for rec in iter_ledger():
+        phase = "triage" if rec.get("task") == "triage" else "implement"
+        key = (str(rec.get("issue")), phase)
+        cost[key] = cost.get(key, 0.0) + rec.get("cost_usd", 0.0)
+
+    durations = {}
+    for e in query_chain_history(load=False):
+        if e["task_type"] in ("triage", "implement") and e.get("duration_s") is not None:
+            key = (e["issue"], e["task_type"])
+            durations[key] = durations.get(key, 0.0) + e["duration_s"]
+
+    prios = _issue_priorities()
+    samples = {"triage": {}, "implement": {}}
+    for (issue, phase), secs in durations.items():
+        prio = prios.get(issue, "P4-debt")
+        sample = (secs, cost.get((issue, phase)))
+        for bucket in (prio, "*"):
+            samples[phase].setdefault(bucket, []).append(sample)
+
+    # Timeout history only has agent durations (no build/test, no cost)
+    if not samples["triage"] or not samples["implement"]:
+        hist = _load_timeout_history().get("durations", {})
+        for phase in ("triage", "implement"):
+            if not samples[phase]:
+                samples[phase]["*"] = [(secs, None) for by_task in hist.values()
+                                       for secs in by_task.get(phase, [])]
+
+    # Fill missing costs with the phase median so pairs stay usable
+    for phase, buckets in samples.items():
+        known = sorted(c for _, c in buckets.get("*", []) if c is not None)
+        median = _percentile(known, 0.5)
+        for bucket, pairs in buckets.items():
+            buckets[bucket] = [(d, median if c is None else c) for d, c in pairs]
+
+    triaged, implemented = {}, {}
+    for (issue, phase) in durations:
+        target = triaged if phase == "triage" else implemented
+        for bucket in (prios.get(issue, "P4-debt"), "*"):
+            target[bucket] = target.get(bucket, 0) + 1
+    samples["implement_rate"] = {
+        b: min(1.0, implemented.get(b, 0) / n) for b, n in triaged.items()
+    }
+    return samples
+
+
+def _bucket(buckets, prio):
+    pairs = buckets.get(prio) or []
+    return pairs if len(pairs) >= FORECAST_MIN_SAMPLES else buckets.get("*") or []
+
+
+def forecast_run(issues, samples=None, simulations=FORECAST_SIMULATIONS,
+                 seed=0, budget_hours=None, budget_usd=None, q=0.8):
+    """Simulate processing `issues` in order.  Returns percentiles of the
+    total duration/cost and the largest issue count whose q-percentile
+    cumulative duration and cost stay within the budgets."""
+    samples = samples or forecast_samples()
+    rng = random.Random(seed)
+    rates = samples.get("implement_rate", {})
+    plan = []
+    for iss in issues:
+        prio = iss.get("priority") or "P4-debt"
+        rate = rates.get(prio)
+        if rate is None or len(samples["implement"].get(prio, [])) < FORECAST_MIN_SAMPLES:
+            rate = rates.get("*", FORECAST_DEFAULT_IMPLEMENT_RATE)
+        plan.append((_bucket(samples["triage"], prio),
+                     _bucket(samples["implement"], prio), rate))
+
+    n = len(plan)
+    cum_secs = [[0.0] * simulations for _ in range(n)]
+    cum_usd = [[0.0] * simulations for _ in range(n)]
+    for sim in range(simulations):
+        secs = usd = 0.0
+        for i, (triage_s, impl_s, rate) in enumerate(plan):
+            if triage_s:
+                d, c = rng.choice(triage_s)
+                secs += d
+                usd += c
+            if impl_s and rng.random() < rate:
+                d, c = rng.choice(impl_s)
+                secs += d
+                usd += c
+            cum_secs[i][sim] = secs
+            cum_usd[i][sim] = usd
+
+    result = {"issues": n, "history": {
+        "triage": len(samples["triage"].get("*", [])),
+        "implement": len(samples["implement"].get("*", [])),
+        "implement_rate": rates.get("*")}}
+    totals_s = sorted(cum_secs[-1]) if n else []
+    totals_c = sorted(cum_usd[-1]) if n else []
+    for pct in (50, 80, 95):
+        result[f"p{pct}_hours"] = round(_percentile(totals_s, pct / 100) / 3600, 2)
+        result[f"p{pct}_usd"] = round(_percentile(totals_c, pct / 100), 2)
+
+    recommended = n
+    if budget_hours is not None or budget_usd is not None:
+        recommended = 0
+        for i in range(n):
+            hours = _percentile(sorted(cum_secs[i]), q) / 3600
+            usd = _percentile(sorted(cum_usd[i]), q)
+            if (budget_hours is not None and hours > budget_hours) or \
+                    (budget_usd is not None and usd > budget_usd):
+                break
+            recommended = i + 1
+    result["recommended_max_issues"] = recommended
+    return result
+
+
+def show_forecast(max_issues=None, budget_hours=None, budget_usd=None):
+    """`forecast` mode: projected duration/cost of the current issue queue."""
+    issues = load_actionable_issues()
+    if max_issues:
+        issues = issues[:max_issues]
+    fc = forecast_run(issues, budget_hours=budget_hours, budget_usd=budget_usd)
+    hist = fc["history"]
+    print()
+    print("=== Run Forecast (issues mode) ===")
+    print(f"  Queue:      {fc['issues']} actionable issues")
+    rate = hist["implement_rate"]
+    print(f"  History:    {hist['triage']} triage / {hist['implement']} implement samples"
+          + (f", implement rate {rate:.0%}" if rate is not None else ""))
+    if not hist["triage"] and not hist["implement"]:
+        print("  No history yet (chain contexts / timeout history) — nothing to project.")
+        print()
+        return
+    for pct in (50, 80, 95):
+        print(f"  p{pct}:        {fc[f'p{pct}_hours']:>7.2f} h   ${fc[f'p{pct}_usd']:>8.2f}")
+    if budget_hours is not None or budget_usd is not None:
+        limits = " and ".join(
+            x for x in (f"{budget_hours} h" if budget_hours is not None else "",
+                        f"${budget_usd}" if budget_usd is not None else "") if x)
+        print(f"  Recommended: --max-issues {fc['recommended_max_issues']}"
+              f"  (p80 within {limits})")
+    print()
+
+
 # ── DISPLAY ─────────────────────────────────────────────────────────────────
 def print_progress(phase, current, total, detail, status):
     """Print live progress line."""
@@ -3403,8 +6911,8 @@ def print_progress(phase, current, total, detail, status):
     pct = int(100 * current / max(total, 1))
 
     w = status.data["warnings"]
-    commits = len(status.data["commits"])
-    errors = len(status.data["errors"])
+    commits = status.data["totals"]["commits"]
+    errors = status.data["totals"]["errors"]
 
     line = f"  [{bar}] {current}/{total} ({pct}%)  {detail[:45]:<45}"
     if w["total_start"]:
@@ -3430,6 +6938,12 @@ def print_summary(status):
               f"{iss['skipped_needs_info']} needs-info, "
               f"{iss['failed']} failed")
         print(f"             {iss['commented_on_github']} GitHub comments posted")
+        if iss.get("pretriaged"):
+            print(f"             {iss['pretriaged']} decided by pre-triage rules "
+                  f"(agent calls saved)")
+        for name, st in (s.get("pipeline") or {}).items():
+            print(f"    {name:<10} {st['in']:>3} in, {st['failed']} failed, "
+                  f"busy {st['busy_s']:.0f}s ({st['utilization'] * 100:.0f}%)")
 
     w = s["warnings"]
     if w["total_start"]:
@@ -3444,13 +6958,18 @@ def print_summary(status):
         print(f"\n  Passes:    {passes}")
 
     if s["commits"]:
-        print(f"\n  Commits:   {len(s['commits'])}")
+        print(f"\n  Commits:   {s['totals']['commits']}")
         for c in s["commits"][-10:]:
             tag = "OK" if c["tests_passed"] else "FAIL"
             print(f"    [{tag}] {c['hash'][:8]} {c['message'][:55]}")
 
+    blocked = s.get("outbox_blocked")
+    if blocked:
+        print(f"\n  Outbox:    push abandoned at {blocked['push_abandoned_at']} — "
+              f"{blocked['comments_held']} GitHub comment(s) held until a push succeeds")
+
     if s["errors"]:
-        print(f"\n  Errors:    {len(s['errors'])}")
+        print(f"\n  Errors:    {s['totals']['errors']}")
         for e in s["errors"][-5:]:
             print(f"    [{e['time']}] {e['task']}: {e['step']} -- {e['error'][:55]}")
 
@@ -3509,12 +7028,21 @@ def show_status():
 
     commits = s.get("commits", [])
     errors = s.get("errors", [])
-    print(f"\n  Commits: {len(commits)}  |  Errors: {len(errors)}")
+    totals = s.get("totals", {})
+    print(f"\n  Commits: {totals.get('commits', len(commits))}  |  "
+          f"Errors: {totals.get('errors', len(errors))}")
 
     if errors:
         print(f"\n  Last errors:")
         for e in errors[-3:]:
             print(f"    [{e['time']}] {e['task']}: {e['step']} -- {e['error'][:60]}")
+
+    history = chain_history_stats()
+    if history:
+        print(f"\n  Chain history:")
+        for task_type, by in sorted(history.items()):
+            parts = ", ".join(f"{k}={v}" for k, v in sorted(by.items()))
+            print(f"    {task_type}: {parts}")
     print()
 
 
@@ -3602,13 +7130,48 @@ def _save_comment_rate(state):
         log.warning("  [RATE] Failed to save rate state: %s", e)
 
 
+def _comment_rate_delay(state, now=None):
+    """Seconds until the next comment may go out (0 = now), or None when
+    today's limit is used up."""
+    if state["daily_count"] >= _COMMENT_RATE_DAILY_LIMIT:
+        return None
+    last = state.get("last_post_ts", 0)
+    if last <= 0:
+        return 0
+    return max(0.0, _COMMENT_RATE_MIN_INTERVAL - ((now or time.time()) - last))
+
+
+def _gh_comment_now(repo, num, body, state):
+    """Post without rate checks; records the post in `state`.  True on success."""
+    try:
+        r = _run(
+            ["gh", "issue", "comment", str(num), "--repo", repo, "--body", body],
+            timeout=30,
+        )
+    except Exception as e:
+        log.warning("  [GH] Comment failed on #%d: %s", num, e)
+        return False
+    if r.returncode != 0:
+        log.warning("  [GH] Comment failed on #%d: %s", num, (r.stderr or "").strip()[:200])
+        return False
+    state["last_post_ts"] = time.time()
+    state["daily_count"] += 1
+    state["log"].append({"issue": num, "repo": repo,
+                         "time": datetime.datetime.now().isoformat()})
+    _save_comment_rate(state)
+    log.info("  [GH] Comment posted on #%d (%d/%d today)",
+             num, state["daily_count"], _COMMENT_RATE_DAILY_LIMIT)
+    return True
+
+
 def gh_post_comment(repo, num, body):
-    """Post a comment on a GitHub issue. Returns True on success.
+    """Post a comment on a GitHub issue now (interactive `update`; the
+    orchestrator goes through the outbox).  Returns True on success.
     Rate-limited: min 10s between posts, max 10/day (persisted to disk)."""
     state = _load_comment_rate()
 
-    # Check daily limit
-    if state["daily_count"] >= _COMMENT_RATE_DAILY_LIMIT:
+    wait = _comment_rate_delay(state)
+    if wait is None:
         log.warning("  [RATE LIMIT] Daily comment limit reached (%d/%d). "
                      "Skipping comment on #%d. Use --force-comments to override.",
                      state["daily_count"], _COMMENT_RATE_DAILY_LIMIT, num)
@@ -3617,31 +7180,337 @@ def gh_post_comment(repo, num, body):
         return False
 
     # Enforce minimum interval (using wall-clock timestamps)
-    now_ts = time.time()
-    elapsed = now_ts - state.get("last_post_ts", 0)
-    if elapsed < _COMMENT_RATE_MIN_INTERVAL and state.get("last_post_ts", 0) > 0:
-        wait = _COMMENT_RATE_MIN_INTERVAL - elapsed
+    if wait > 0:
         log.info("  [RATE LIMIT] Waiting %.1fs before next comment...", wait)
         print(f"Rate-limiting: waiting {wait:.0f}s before posting comment on #{num}...")
-        time.sleep(wait)
+        _sleep(wait, "comment_rate_limit")
+
+    return _gh_comment_now(repo, num, body, state)
+
+
+# ── IIS: NEAR-DUPLICATE DETECTION ─────────────────────────────────────────
+# MinHash signatures of word 3-shingles (title + body snippet + comments),
+# bucketed with LSH (DUP_BANDS bands of DUP_NUM_PERM / DUP_BANDS rows; pairs
+# above ~50% Jaccard collide).  Maintained on sync, queried before triage:
+# candidates go into the triage prompt, and a very close match against an
+# issue already fixed (testing/released) skips the agents entirely.
+DUP_NUM_PERM = 64
+DUP_BANDS = 16
+DUP_CANDIDATE_SIMILARITY = 0.5    # estimated Jaccard to list as a candidate
+DUP_SKIP_SIMILARITY = 0.85        # ... to pre-classify without an agent call
+DUP_RESOLVED_STATUSES = ("testing", "released")
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)          # fixed: signatures must be stable across runs
+_DUP_PERMS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+              for _ in range(DUP_NUM_PERM)]
+del _rng
+_dup_index = None
+
+
+def _issue_dup_text(issue):
+    parts = [issue.get("title") or "", issue.get("body") or issue.get("body_snippet") or ""]
+    parts += [c.get("snippet", "") for c in (issue.get("comments") or [])
+              if not c.get("is_ours")]
+    return "\n".join(parts)
+
+
+def minhash_signature(text):
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    if len(words) >= 3:
+        shingles = {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+    else:
+        shingles = set(words)
+    if not shingles:
+        return None
+    hashes = [zlib.crc32(sh.encode("utf-8")) for sh in shingles]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _DUP_PERMS]
+
+
+def _sig_similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class DupIndex:
+    """MinHash signatures by "<repo_key>/<number>" plus in-memory LSH buckets."""
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}        # key -> {"fp": crc32 of text, "sig": [...]}
+        self.buckets = {}
+        for key, e in self.entries.items():
+            self._bucket(key, e["sig"])
+
+    @classmethod
+    def load(cls):
+        try:
+            data = json.loads(DUP_INDEX_FILE.read_text(encoding="utf-8"))
+            if data.get("num_perm") == DUP_NUM_PERM:
+                return cls(data.get("issues"))
+        except (OSError, ValueError):
+            pass
+        return cls()
+
+    def save(self):
+        DUP_INDEX_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = DUP_INDEX_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"num_perm": DUP_NUM_PERM, "issues": self.entries},
+                                  separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, DUP_INDEX_FILE)
+
+    def _bands(self, sig):
+        rows = DUP_NUM_PERM // DUP_BANDS
+        return [(b, tuple(sig[b * rows:(b + 1) * rows])) for b in range(DUP_BANDS)]
+
+    def _bucket(self, key, sig, remove=False):
+        for band in self._bands(sig):
+            keys = self.buckets.setdefault(band, set())
+            if remove:
+                keys.discard(key)
+            else:
+                keys.add(key)
+
+    def add(self, key, text):
+        """Index/refresh one issue; returns True if its signature changed."""
+        fp = zlib.crc32(text.encode("utf-8"))
+        old = self.entries.get(key)
+        if old and old["fp"] == fp:
+            return False
+        if old:
+            self._bucket(key, old["sig"], remove=True)
+        sig = minhash_signature(text)
+        if sig is None:
+            self.entries.pop(key, None)
+            return bool(old)
+        self.entries[key] = {"fp": fp, "sig": sig}
+        self._bucket(key, sig)
+        return True
 
+    def similar(self, key, min_similarity=DUP_CANDIDATE_SIMILARITY):
+        """[(other_key, estimated Jaccard)] best first."""
+        entry = self.entries.get(key)
+        if not entry:
+            return []
+        candidates = set()
+        for band in self._bands(entry["sig"]):
+            candidates |= self.buckets.get(band, set())
+        candidates.discard(key)
+        scored = [(c, _sig_similarity(entry["sig"], self.entries[c]["sig"]))
+                  for c in candidates]
+        return sorted([x for x in scored if x[1] >= min_similarity], key=lambda x: -x[1])
+
+
+def get_dup_index():
+    """Loaded index; built from the whole issue DB on first use."""
+    global _dup_index
+    if _dup_index is None:
+        _dup_index = DupIndex.load()
+        if not _dup_index.entries:
+            for iss in iis_load_all_issues():
+                _dup_index.add(f"{iss['_repo_key']}/{iss['number']}", _issue_dup_text(iss))
+            if _dup_index.entries:
+                _dup_index.save()
+                log.info("  [DUP] Built near-duplicate index over %d issues",
+                         len(_dup_index.entries))
+    return _dup_index
+
+
+def find_near_duplicates(issue, repo_key="upstream", limit=5):
+    """Candidate duplicates: [{"number", "repo", "title", "status", "similarity"}]."""
     try:
-        r = _run(
-            ["gh", "issue", "comment", str(num), "--repo", repo, "--body", body],
-            timeout=30,
-        )
-        if r.returncode == 0:
-            state["last_post_ts"] = time.time()
-            state["daily_count"] += 1
-            state["log"].append({"issue": num, "repo": repo,
-                                 "time": datetime.datetime.now().isoformat()})
-            _save_comment_rate(state)
-            log.info("  [GH] Comment posted on #%d (%d/%d today)",
-                     num, state["daily_count"], _COMMENT_RATE_DAILY_LIMIT)
-            return True
-        return False
-    except Exception:
-        return False
+        index = get_dup_index()
+        key = f"{repo_key}/{issue['number']}"
+        if index.add(key, _issue_dup_text(issue)):
+            index.save()
+        matches = index.similar(key)[:limit]
+    except Exception as e:
+        log.warning("  [DUP] Near-duplicate lookup failed: %s", e)
+        return []
+    out = []
+    for other, sim in matches:
+        other_repo, _, other_num = other.partition("/")
+        try:
+            data = iis_read_json(ISSUES_DB_ROOT / other_repo / f"{int(other_num):04d}.json")
+        except Exception:
+            continue
+        out.append({"number": int(other_num), "repo": other_repo,
+                    "title": data.get("title", ""), "status": data.get("our_status", "new"),
+                    "similarity": round(sim, 2)})
+    return out
+
+
+def dedup_pretriage(issue, duplicates):
+    """Triage dict for a confident duplicate of an already-fixed issue, else None."""
+    for d in duplicates:
+        if d["similarity"] >= DUP_SKIP_SIMILARITY and d["status"] in DUP_RESOLVED_STATUSES:
+            return {
+                "decision": "duplicate",
+                "reason": f"near-duplicate of {d['repo']} #{d['number']} "
+                          f"({d['similarity']:.0%} similar, already {d['status']})",
+                "priority": issue.get("priority"),
+                "duplicate_of": d["number"],
+            }
+    return None
+
+
+# ── IIS: SEARCH ───────────────────────────────────────────────────────────
+# Inverted index over title (x3), labels (x2), body snippet and comment
+# snippets of every issue in the DB, ranked with BM25 (_bm25_scores).  Each
+# doc remembers its file's (mtime_ns, size), so a refresh only re-reads files
+# that changed — whoever wrote them (sync, update, update_issue_json, the
+# PowerShell tools).  Queries run against in-memory postings.
+_SEARCH_FIELD_WEIGHTS = (("title", 3), ("labels", 2), ("body", 1), ("comments", 1))
+_issue_search_index = None
+
+
+def _issue_search_doc(issue, stamp):
+    fields = {
+        "title": issue.get("title") or "",
+        "labels": " ".join(issue.get("labels") or []),
+        "body": issue.get("body") or issue.get("body_snippet") or "",
+        "comments": "\n".join(c.get("snippet", "") for c in (issue.get("comments") or [])),
+    }
+    tf, length = {}, 0
+    for field, weight in _SEARCH_FIELD_WEIGHTS:
+        terms = _index_terms(fields[field])
+        length += len(terms)
+        for t in terms:
+            tf[t] = tf.get(t, 0) + weight
+    return {
+        "stamp": stamp, "len": length, "tf": tf,
+        "number": issue.get("number"), "title": fields["title"],
+        "labels": issue.get("labels") or [], "status": issue.get("our_status", "new"),
+        "state": issue.get("state", "open"), "created": (issue.get("created_at") or "")[:10],
+    }
+
+
+class IssueSearchIndex:
+    """Docs keyed "<repo_key>/<number>"; postings rebuilt in memory on load."""
+
+    def __init__(self, docs=None):
+        self.docs = docs or {}
+        self._reindex()
+
+    def _reindex(self):
+        self.postings = {}
+        for key, d in self.docs.items():
+            for term, n in d["tf"].items():
+                self.postings.setdefault(term, []).append((key, n))
+        self.avg_len = (sum(d["len"] for d in self.docs.values()) / len(self.docs)
+                        if self.docs else 0)
+
+    @classmethod
+    def load(cls):
+        try:
+            return cls(json.loads(ISSUE_SEARCH_INDEX_FILE.read_text(encoding="utf-8"))["docs"])
+        except (OSError, ValueError, KeyError):
+            return cls()
+
+    def save(self):
+        tmp = ISSUE_SEARCH_INDEX_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"docs": self.docs}, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, ISSUE_SEARCH_INDEX_FILE)
+
+    def refresh(self, repos=("upstream", "fork")):
+        """Re-read only new/changed issue files; drop deleted ones.  Returns
+        the number of docs changed (index saved if any)."""
+        seen, changed = set(), 0
+        for repo_key in repos:
+            d = ISSUES_DB_ROOT / repo_key
+            if not d.exists():
+                continue
+            for entry in os.scandir(d):
+                if not (entry.name[:1].isdigit() and entry.name.endswith(".json")):
+                    continue
+                st = entry.stat()
+                stamp = [st.st_mtime_ns, st.st_size]
+                key = f"{repo_key}/{int(entry.name[:-5])}"
+                seen.add(key)
+                if self.docs.get(key, {}).get("stamp") == stamp:
+                    continue
+                try:
+                    self.docs[key] = _issue_search_doc(iis_read_json(entry.path), stamp)
+                    changed += 1
+                except Exception:
+                    continue
+        for key in [k for k in self.docs if k.split("/")[0] in repos and k not in seen]:
+            del self.docs[key]
+            changed += 1
+        if changed:
+            self._reindex()
+            self.save()
+        return changed
+
+    def search(self, query, labels=None, status=None, since=None, until=None,
+               repo=None, state=None, limit=20):
+        """Ranked hits: [{"key", "repo", "number", "title", "status", "labels",
+        "created", "score"}].  labels: any-of (case-insensitive); status: str
+        or list; since/until: YYYY-MM-DD on created date.  An empty query
+        lists all matching issues, newest first."""
+        statuses = {status} if isinstance(status, str) else set(status or ())
+        wanted = {lbl.lower() for lbl in (labels or [])}
+        allowed = set()
+        for key, d in self.docs.items():
+            if repo and not key.startswith(repo + "/"):
+                continue
+            if statuses and d["status"] not in statuses:
+                continue
+            if state and d["state"] != state:
+                continue
+            if since and d["created"] < since:
+                continue
+            if until and d["created"] > until:
+                continue
+            if wanted and not wanted & {lbl.lower() for lbl in d["labels"]}:
+                continue
+            allowed.add(key)
+        terms = _index_terms(query or "")
+        if terms:
+            scores = _bm25_scores(terms, self.postings, self.docs, self.avg_len, allowed)
+            ranked = sorted(scores.items(), key=lambda kv: -kv[1])
+        else:
+            ranked = [(k, 0.0) for k in sorted(allowed, key=lambda k: self.docs[k]["created"],
+                                                 reverse=True)]
+        hits = []
+        for key, score in ranked[:limit]:
+            d = self.docs[key]
+            hits.append({"key": key, "repo": key.split("/")[0], "number": d["number"],
+                         "title": d["title"], "status": d["status"], "labels": d["labels"],
+                         "created": d["created"], "score": round(score, 3)})
+        return hits
+
+
+def get_search_index(refresh=True):
+    """Process-wide issue search index, refreshed against the DB on request."""
+    global _issue_search_index
+    if _issue_search_index is None:
+        _issue_search_index = IssueSearchIndex.load()
+    if refresh:
+        _issue_search_index.refresh()
+    return _issue_search_index
+
+
+def search_issues(query, **filters):
+    """Python API: ranked issue hits (see IssueSearchIndex.search)."""
+    return get_search_index().search(query, **filters)
+
+
+def iis_search(query, labels=None, status=None, since=None, until=None, repos="both",
+               limit=20):
+    """`search` subcommand: print ranked issues with query time."""
+    t0 = time.perf_counter()
+    index = get_search_index()
+    t1 = time.perf_counter()
+    hits = index.search(query, labels=labels, status=status, since=since, until=until,
+                        repo=None if repos == "both" else repos, limit=limit)
+    t2 = time.perf_counter()
+    print(f"=== Issue search: {query or '(all)'} ===")
+    for h in hits:
+        labels_s = f"  [{', '.join(h['labels'])}]" if h["labels"] else ""
+        print(f"  {h['score']:>7.2f}  {h['repo']:<8} #{h['number']:<5} {h['status']:<10} "
+              f"{h['created']}  {h['title'][:70]}{labels_s}")
+    if not hits:
+        print("  No matches.")
+    print(f"  {len(hits)} hits from {len(index.docs)} issues — "
+          f"load/refresh {(t1 - t0) * 1000:.0f} ms, query {(t2 - t1) * 1000:.1f} ms")
 
 
 # ── IIS: SYNC ─────────────────────────────────────────────────────────────
@@ -3700,6 +7569,7 @@ def iis_sync(repos="both", issue_numbers=None, include_closed=False, max_issues=
         repo_dir.mkdir(parents=True, exist_ok=True)
 
         skipped_unchanged = 0
+        dup_index = get_dup_index()
         for idx, issue_stub in enumerate(issues_list, 1):
             num = issue_stub["number"]
             pct = int(idx * 100 / max(len(issues_list), 1))
@@ -3825,6 +7695,7 @@ def iis_sync(repos="both", issue_numbers=None, include_closed=False, max_issues=
             }
 
             iis_write_json(file_path, issue_obj)
+            dup_index.add(f"{repo_key}/{num}", _issue_dup_text(issue_obj))
 
             # Print status
             if is_new:
@@ -3847,6 +7718,7 @@ def iis_sync(repos="both", issue_numbers=None, include_closed=False, max_issues=
 
             print()
 
+        dup_index.save()
         if skipped_unchanged > 0:
             print(f"  Skipped {skipped_unchanged} unchanged issues (same updatedAt)")
         stats["repos_synced"].append(repo_name)
@@ -3866,6 +7738,12 @@ def iis_sync(repos="both", issue_numbers=None, include_closed=False, max_issues=
         "duration_sec": round(duration, 1),
     }
     iis_write_json(META_PATH, meta)
+    try:
+        reindexed = get_search_index(refresh=False).refresh()
+        if reindexed:
+            print(f"Search index: {reindexed} issues re-indexed")
+    except Exception as e:
+        log.warning("  [SEARCH] Could not update search index: %s", e)
 
     # Summary
     print("=== Sync Complete ===")
@@ -4452,8 +8330,12 @@ def main():
     parser.add_argument(
         "mode", nargs="?", default="all",
         choices=["all", "issues", "warnings", "status", "test-hygiene",
-                 "sync", "analyze", "update", "report"],
-        help="sync/analyze/update/report (IIS), or all/issues/warnings/status/test-hygiene (orchestrator)",
+                 "sync", "analyze", "update", "report", "profile", "cost",
+                 "forecast", "search", "worker"],
+        help="sync/analyze/update/report (IIS), all/issues/warnings/status/test-hygiene "
+             "(orchestrator), profile (summarise a run trace), cost (token ledger), "
+             "forecast (projected run time/cost), search (issue DB full-text search), "
+             "or worker (triage-only, shares the work queue with a running orchestrator)",
     )
     # ── Orchestrator args ──
     parser.add_argument("--dry-run", action="store_true",
@@ -4468,6 +8350,10 @@ def main():
                         help="Max multi-pass iterations (default: 10)")
     parser.add_argument("--parallel", type=int, default=0,
                         help="Fix N files in parallel per batch (0=serial)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus metrics on 127.0.0.1:PORT (0=off)")
+    parser.add_argument("--metrics-textfile", action="store_true",
+                        help=f"Periodically write Prometheus metrics to {METRICS_TEXTFILE.name}")
     # ── Agent args ──
     parser.add_argument("--agent", default=None,
                         choices=["codex", "claude", "gemini"],
@@ -4490,7 +8376,7 @@ def main():
     parser.add_argument("--priority", default=None,
                         help="Filter by priority (e.g. P2-bug)")
     parser.add_argument("--status", default=None,
-                        help="Filter status (analyze) or new status (update)")
+                        help="Filter status (analyze/search, comma-separated for search) or new status (update)")
     parser.add_argument("--show-all", action="store_true",
                         help="Show all issues in analyze mode")
     # ── IIS update args ──
@@ -4517,6 +8403,37 @@ def main():
                         help="Notes to add/update on the issue")
     parser.add_argument("--add-to-roadmap", action="store_true",
                         help="Add issue to _roadmap.json")
+    # ── Cost args ──
+    parser.add_argument("--by", default=None, choices=sorted(_COST_GROUPINGS),
+                        help="cost mode: show only this grouping")
+    parser.add_argument("--days", type=int, default=None,
+                        help="cost mode: only the last N days")
+    # ── Search args ──
+    parser.add_argument("--query", "-q", default="",
+                        help="search mode: free-text query (ranked)")
+    parser.add_argument("--label", action="append", default=None,
+                        help="search mode: only issues with this label (repeatable)")
+    parser.add_argument("--since", default=None,
+                        help="search mode: created on/after YYYY-MM-DD")
+    parser.add_argument("--until", default=None,
+                        help="search mode: created on/before YYYY-MM-DD")
+    parser.add_argument("--limit", type=int, default=20,
+                        help="search mode: max results")
+    # ── Forecast args ──
+    parser.add_argument("--budget-hours", type=float, default=None,
+                        help="forecast mode: wall-time budget for --max-issues advice")
+    parser.add_argument("--budget-usd", type=float, default=None,
+                        help="forecast mode: cost budget for --max-issues advice")
+    # ── Budget args ──
+    parser.add_argument("--max-cost", type=float, default=None,
+                        help="Session cost ceiling in USD (cheap models from 80%%, stop at 100%%)")
+    parser.add_argument("--max-cost-per-issue", type=float, default=None,
+                        help="Per-issue cost ceiling in USD")
+    # ── Profile args ──
+    parser.add_argument("--queue-db", default=None,
+                        help="Work queue database (worker mode: path on a shared directory)")
+    parser.add_argument("--trace", default=None,
+                        help="Trace file for profile mode (default: newest in traces/)")
     # ── IIS report args ──
     parser.add_argument("--include-all", action="store_true",
                         help="Include full issue inventory in report")
@@ -4534,6 +8451,13 @@ def main():
                  include_closed=args.include_closed)
         return
 
+    if args.mode == "search":
+        iis_search(args.query, labels=args.label,
+                   status=args.status.split(",") if args.status else None,
+                   since=args.since, until=args.until, repos=args.repos,
+                   limit=args.limit)
+        return
+
     if args.mode == "analyze":
         iis_analyze(show_all=args.show_all, waiting_only=args.waiting_only,
                     priority_filter=args.priority, status_filter=args.status)
@@ -4570,9 +8494,22 @@ def main():
         show_status()
         return
 
+    if args.mode == "profile":
+        show_profile(args.trace)
+        return
+
+    if args.mode == "cost":
+        show_cost(group_by=args.by, since_days=args.days)
+        return
+
+    if args.mode == "forecast":
+        show_forecast(max_issues=args.max_issues, budget_hours=args.budget_hours,
+                      budget_usd=args.budget_usd)
+        return
+
     # ── Orchestrator modes (all, issues, warnings) ──
     # Apply agent CLI overrides
-    global GEMINI_MODEL, CODEX_MODEL
+    global GEMINI_MODEL, CODEX_MODEL, WORK_QUEUE_DB
     if args.agent:
         for key in AGENT_CONFIG:
             AGENT_CONFIG[key] = args.agent
@@ -4584,6 +8521,18 @@ def main():
         CODEX_MODEL = args.codex_model
         log.info("Codex model override: %s", CODEX_MODEL)
 
+    if args.queue_db:
+        WORK_QUEUE_DB = Path(args.queue_db)
+
+    # ── TRIAGE WORKER: no lock, no git — leases from the shared queue ──
+    if args.mode == "worker":
+        configure_budget(args.max_cost, args.max_cost_per_issue)
+        try:
+            run_triage_worker(max_issues=args.max_issues)
+        finally:
+            flush_events()
+        return
+
     # ── SINGLE INSTANCE LOCK ──
     # Prevent multiple orchestrator instances from running simultaneously.
     # Concurrent instances cause race conditions on git, garbled test output,
@@ -4647,8 +8596,36 @@ def main():
         sys.exit(1)
 
     status = Status()
+    configure_budget(args.max_cost, args.max_cost_per_issue)
+    emit_event("run_start", mode=args.mode)
+    start_heartbeat(status)
+    if not args.dry_run:
+        start_outbox(status)
+    try:
+        trace_path = start_trace()
+        log.info("  [TRACE] Writing spans to %s", trace_path.name)
+    except OSError as e:
+        log.warning("  [TRACE] Tracing disabled: %s", e)
+    if args.metrics_port or args.metrics_textfile:
+        try:
+            start_metrics(port=args.metrics_port or None, textfile=args.metrics_textfile)
+        except OSError as e:
+            log.warning("  [METRICS] Could not start exporter: %s", e)
 
     try:
+        # Roll old chain contexts into the compressed, indexed archive
+        try:
+            compact_chain_contexts()
+        except Exception as e:
+            log.warning("  [ARCHIVE] Compaction failed: %s", e)
+
+        # ── Resume interrupted chains before hygiene commits anything ──
+        if args.mode in ("all", "issues") and not args.dry_run:
+            status.set_phase("resume")
+            _resume_unfinished_chains(status)
+        elif args.mode == "test-hygiene" and ChainContext.unfinished("implement"):
+            git_restore()   # partial work stays in the checkpoints
+
         # ── Pre-flight test hygiene ──
         if args.mode in ("all", "issues", "test-hygiene"):
             status.set_phase("test_hygiene_pre")
@@ -4684,6 +8661,13 @@ def main():
         status.finish()
 
     finally:
+        stop_outbox()
+        stop_heartbeat()
+        emit_event("run_end", mode=args.mode)
+        flush_events()
+        stop_trace()
+        if args.metrics_port or args.metrics_textfile:
+            stop_metrics(textfile=args.metrics_textfile)
         # Always remove lock file on exit
         lock_file.unlink(missing_ok=True)
 
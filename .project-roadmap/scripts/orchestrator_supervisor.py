@@ -8,6 +8,7 @@ and restarts with exponential backoff. Designed to run continuously.
 Usage:
     python orchestrator_supervisor.py                    # run supervisor loop
     python orchestrator_supervisor.py --check            # one-shot health check
+    python orchestrator_supervisor.py --stats            # restart/recovery history
     python orchestrator_supervisor.py --max-restarts 5   # limit restarts
     python orchestrator_supervisor.py --orchestrator-args "issues --max-issues 10"
 
@@ -17,9 +18,15 @@ Failure modes detected (from /insights analysis + code audit):
     FM3: Phantom test processes (testhost.exe lingering)
     FM4: Rate-limit file corruption or stale entries
     FM5: Status file corruption (partial JSON write)
-    FM6: Orchestrator process hung (no status update for N minutes)
+    FM6: Orchestrator process hung (heartbeat stopped, a subprocess outlived
+         its timeout, or no status update for N minutes)
     FM7: Orchestrator crashed (process dead, lock still present)
     FM8: Stale editor/tool processes (notepad.exe, mstsc.exe)
+
+Every failure, recovery, orchestrator run (uptime, exit code) and outage is
+recorded in supervisor-history.json.  The same failure (mode or non-zero exit
+code) CRASH_LOOP_THRESHOLD times within CRASH_LOOP_WINDOW_MINUTES is a crash
+loop: recovery still runs, but restarts pause for CRASH_LOOP_PAUSE_MINUTES.
 """
 
 import sys
@@ -32,6 +39,7 @@ import datetime
 import json
 import logging
 import os
+import re
 import signal
 import subprocess
 import time
@@ -47,15 +55,26 @@ STATUS_FILE = SCRIPTS_DIR / "orchestrator-status.json"
 LOG_FILE = SCRIPTS_DIR / "orchestrator.log"
 RATE_LIMIT_FILE = SCRIPTS_DIR / "_agent_rate_limits.json"
 SUPERVISOR_LOG = SCRIPTS_DIR / "supervisor.log"
+EVENTS_FILE = SCRIPTS_DIR / "orchestrator-events.jsonl"
+HEARTBEAT_FILE = SCRIPTS_DIR / "orchestrator-heartbeat.json"
+HISTORY_FILE = SCRIPTS_DIR / "supervisor-history.json"
 ORCHESTRATOR_SCRIPT = SCRIPTS_DIR / "iis_orchestrator.py"
 
 # Thresholds
-HUNG_TIMEOUT_MINUTES = 15          # no status update = hung
+HUNG_TIMEOUT_MINUTES = 15          # no status update = hung (no heartbeat / no subprocess)
+HEARTBEAT_STALE_SECONDS = 45       # no heartbeat this long = process wedged
+CHILD_OVERRUN_GRACE_SECONDS = 60   # subprocess past its own timeout by this = hung
 STALE_LOCK_HOURS = 24              # lock older than this = definitely stale
 MAX_RESTART_BACKOFF_SECONDS = 600  # cap backoff at 10 min
 INITIAL_BACKOFF_SECONDS = 10       # first restart delay
 HEALTH_CHECK_INTERVAL = 30        # seconds between checks in supervisor loop
+MIN_CHECK_INTERVAL = 2            # earliest re-check after a watched file changed
+SNAPSHOT_MAX_AGE_SECONDS = 5      # process snapshot reused within one cycle
 REPORT_INTERVAL_CYCLES = 10       # report every N health checks (~5 min at 30s interval)
+CRASH_LOOP_THRESHOLD = 3          # same failure this many times ...
+CRASH_LOOP_WINDOW_MINUTES = 30    # ... within this window = crash loop
+CRASH_LOOP_PAUSE_MINUTES = 30     # restarts paused this long after a crash loop
+HISTORY_MAX_ENTRIES = 500         # per list in supervisor-history.json
 
 # Stale processes to monitor
 STALE_PROCESSES = ["notepad.exe", "testhost.exe", "mstsc.exe", "dotnet.exe"]
@@ -117,12 +136,72 @@ class RecoveryResult:
     detail: str = ""
 
 
+# ── EVENT STREAM TAIL ───────────────────────────────────────────────────────
+class EventTail:
+    """Incremental reader for the orchestrator's JSONL event stream.
+
+    Keeps a byte offset and only reads what was appended since the last
+    call; a file smaller than the offset was rotated, so reading restarts
+    at the top.  Partial trailing lines are left for the next call."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or EVENTS_FILE
+        self.offset = 0
+
+    def read_new(self) -> list:
+        try:
+            size = self.path.stat().st_size
+        except OSError:
+            return []
+        if size < self.offset:
+            self.offset = 0
+        if size == self.offset:
+            return []
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                chunk = f.read(size - self.offset)
+        except OSError:
+            return []
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return []
+        self.offset += end + 1
+        events = []
+        for line in chunk[:end].splitlines():
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        return events
+
+
 # ── HEALTH CHECKER ──────────────────────────────────────────────────────────
 class HealthChecker:
     """Detects all known failure modes by inspecting system state."""
 
+    def __init__(self):
+        self.events = EventTail()
+        self.last_event_at: Optional[datetime.datetime] = None
+        self.test_running: Optional[bool] = None   # None = no events seen yet
+
+    def _poll_events(self):
+        """Fold newly appended orchestrator events into the checker state."""
+        for evt in self.events.read_new():
+            try:
+                self.last_event_at = datetime.datetime.fromisoformat(evt["ts"])
+            except (KeyError, ValueError, TypeError):
+                pass
+            etype = evt.get("type")
+            if etype == "test_start":
+                self.test_running = True
+            elif etype in ("test_end", "run_start", "run_end"):
+                self.test_running = False
+
     def check_all(self) -> HealthStatus:
         status = HealthStatus(healthy=True)
+        process_snapshot(refresh=True)      # one enumeration, shared by all checks
+        self._poll_events()
         # Run all checks — order matters (some depend on others)
         self._check_lock_file(status)
         self._check_multiple_instances(status)
@@ -135,45 +214,45 @@ class HealthChecker:
 
     def _check_lock_file(self, status: HealthStatus):
         """FM1: Stale lock file — PID dead but lock exists."""
-        if not LOCK_FILE.exists():
+        lock_data, error = read_json_cached(LOCK_FILE)
+        if isinstance(error, json.JSONDecodeError):
+            status.add_failure(FailureMode.FM1_STALE_LOCK,
+                               "Lock file is corrupt JSON")
+            return
+        if error is not None:
+            status.add_failure(FailureMode.FM1_STALE_LOCK,
+                               f"Cannot read lock file: {error}")
+            return
+        if lock_data is None:
             status.details["lock"] = "no_lock"
             return
 
-        try:
-            lock_data = json.loads(LOCK_FILE.read_text(encoding="utf-8"))
-            pid = lock_data.get("pid")
-            started = lock_data.get("started", "")
-
-            if pid is None:
-                status.add_failure(FailureMode.FM1_STALE_LOCK,
-                                   "Lock file exists but has no PID")
-                return
-
-            # Check if PID is alive
-            if not _is_pid_alive(pid):
-                status.add_failure(FailureMode.FM7_CRASHED_PROCESS,
-                                   f"Lock file PID {pid} is dead (started: {started})")
-                return
-
-            # Check age — even if PID alive, >24h is suspicious
-            if started:
-                try:
-                    start_dt = datetime.datetime.fromisoformat(started)
-                    age_hours = (datetime.datetime.now() - start_dt).total_seconds() / 3600
-                    if age_hours > STALE_LOCK_HOURS:
-                        status.add_failure(FailureMode.FM1_STALE_LOCK,
-                                           f"Lock file is {age_hours:.1f}h old (PID {pid})")
-                except (ValueError, TypeError):
-                    pass
-
-            status.details["lock"] = {"pid": pid, "started": started, "alive": True}
+        pid = lock_data.get("pid")
+        started = lock_data.get("started", "")
 
-        except json.JSONDecodeError:
+        if pid is None:
             status.add_failure(FailureMode.FM1_STALE_LOCK,
-                               "Lock file is corrupt JSON")
-        except OSError as e:
-            status.add_failure(FailureMode.FM1_STALE_LOCK,
-                               f"Cannot read lock file: {e}")
+                               "Lock file exists but has no PID")
+            return
+
+        # Check if PID is alive
+        if not _is_pid_alive(pid):
+            status.add_failure(FailureMode.FM7_CRASHED_PROCESS,
+                               f"Lock file PID {pid} is dead (started: {started})")
+            return
+
+        # Check age — even if PID alive, >24h is suspicious
+        if started:
+            try:
+                start_dt = datetime.datetime.fromisoformat(started)
+                age_hours = (datetime.datetime.now() - start_dt).total_seconds() / 3600
+                if age_hours > STALE_LOCK_HOURS:
+                    status.add_failure(FailureMode.FM1_STALE_LOCK,
+                                       f"Lock file is {age_hours:.1f}h old (PID {pid})")
+            except (ValueError, TypeError):
+                pass
+
+        status.details["lock"] = {"pid": pid, "started": started, "alive": True}
 
     def _check_multiple_instances(self, status: HealthStatus):
         """FM2: Multiple orchestrator Python processes running."""
@@ -184,12 +263,16 @@ class HealthChecker:
         status.details["orchestrator_pids"] = pids
 
     def _check_hung_process(self, status: HealthStatus):
-        """FM6: Orchestrator alive but status not updated for too long."""
-        if not STATUS_FILE.exists():
+        """FM6: Orchestrator alive but not making progress.  With a heartbeat
+        this is decided in under a minute; without one (older orchestrator,
+        or no subprocess in flight) fall back to the status file's age."""
+        if self._check_heartbeat(status):
             return
+        data, error = read_json_cached(STATUS_FILE)
+        if data is None:
+            return  # Missing, or handled by _check_status_file
 
         try:
-            data = json.loads(STATUS_FILE.read_text(encoding="utf-8"))
             last_updated = data.get("last_updated")
             running = data.get("running", False)
 
@@ -198,6 +281,9 @@ class HealthChecker:
 
             if last_updated:
                 last_dt = datetime.datetime.fromisoformat(last_updated)
+                # Any event newer than the status file also counts as progress
+                if self.last_event_at and self.last_event_at > last_dt:
+                    last_dt = self.last_event_at
                 age_min = (datetime.datetime.now() - last_dt).total_seconds() / 60
                 if age_min > HUNG_TIMEOUT_MINUTES:
                     task = data.get("current_task", "unknown")
@@ -205,8 +291,45 @@ class HealthChecker:
                                        f"No status update for {age_min:.0f}min "
                                        f"(last task: {task})")
                 status.details["status_age_min"] = round(age_min, 1)
-        except (json.JSONDecodeError, OSError):
-            pass  # Handled by _check_status_file
+        except (ValueError, TypeError):
+            pass
+
+    def _check_heartbeat(self, status: HealthStatus) -> bool:
+        """FM6 via orchestrator-heartbeat.json.  True if the heartbeat settled
+        the question (hung, or busy in a subprocess that is within its
+        timeout); False to fall through to the status-age check."""
+        hb, _ = read_json_cached(HEARTBEAT_FILE)
+        if not isinstance(hb, dict) or not hb.get("pid"):
+            return False
+        lock, _ = read_json_cached(LOCK_FILE)
+        if isinstance(lock, dict) and lock.get("pid") and lock["pid"] != hb["pid"]:
+            return False    # left over from an earlier run
+        if not _is_pid_alive(hb["pid"]):
+            return False    # dead — FM7's business
+        try:
+            now = time.time()
+            age = now - float(hb["ts"])
+            status.details["heartbeat_age_s"] = round(age, 1)
+            if age > HEARTBEAT_STALE_SECONDS:
+                status.add_failure(FailureMode.FM6_HUNG_PROCESS,
+                                   f"No heartbeat for {age:.0f}s (PID {hb['pid']})")
+                return True
+            children = hb.get("children") or []
+            for child in children:
+                deadline = child.get("deadline")
+                if deadline and now > float(deadline) + CHILD_OVERRUN_GRACE_SECONDS:
+                    status.add_failure(FailureMode.FM6_HUNG_PROCESS,
+                                       f"{child.get('cmd')} (PID {child.get('pid')}) "
+                                       f"{now - float(deadline):.0f}s past its timeout")
+                    return True
+        except (KeyError, ValueError, TypeError):
+            return False
+        if children:
+            oldest = min(float(c.get("started") or now) for c in children)
+            status.details["subprocess"] = {"cmd": children[0].get("cmd"),
+                                            "running_s": round(now - oldest)}
+            return True     # long agent call / build / test inside its timeout
+        return False
 
     def _check_phantom_tests(self, status: HealthStatus):
         """FM3: testhost.exe processes lingering after test run."""
@@ -234,76 +357,70 @@ class HealthChecker:
 
     def _check_rate_limit_file(self, status: HealthStatus):
         """FM4: Rate-limit file corruption or expired entries not cleaned."""
-        if not RATE_LIMIT_FILE.exists():
+        data, error = read_json_cached(RATE_LIMIT_FILE)
+        if isinstance(error, json.JSONDecodeError):
+            status.add_failure(FailureMode.FM4_RATE_LIMIT_CORRUPTION,
+                               "Rate-limit file is corrupt JSON")
+            return
+        if error is not None:
+            status.add_failure(FailureMode.FM4_RATE_LIMIT_CORRUPTION,
+                               f"Cannot read rate-limit file: {error}")
+            return
+        if data is None:
             return
 
-        try:
-            data = json.loads(RATE_LIMIT_FILE.read_text(encoding="utf-8"))
-            expired = []
-            corrupt = []
-            now = datetime.datetime.now()
+        expired = []
+        corrupt = []
+        now = datetime.datetime.now()
 
-            for agent, entry in data.items():
-                avail = entry.get("available_after")
-                if not avail:
-                    corrupt.append(agent)
-                    continue
-                try:
-                    avail_dt = datetime.datetime.fromisoformat(avail)
-                    if now >= avail_dt:
-                        expired.append(agent)
-                except (ValueError, TypeError):
-                    corrupt.append(agent)
-
-            if expired or corrupt:
-                detail = []
-                if expired:
-                    detail.append(f"expired: {expired}")
-                if corrupt:
-                    detail.append(f"corrupt: {corrupt}")
-                status.add_failure(FailureMode.FM4_RATE_LIMIT_CORRUPTION,
-                                   "; ".join(detail))
-            status.details["rate_limits"] = {
-                "expired": expired, "corrupt": corrupt,
-                "active": [a for a in data if a not in expired and a not in corrupt],
-            }
-        except json.JSONDecodeError:
-            status.add_failure(FailureMode.FM4_RATE_LIMIT_CORRUPTION,
-                               "Rate-limit file is corrupt JSON")
-        except OSError as e:
+        for agent, entry in data.items():
+            avail = entry.get("available_after")
+            if not avail:
+                corrupt.append(agent)
+                continue
+            try:
+                avail_dt = datetime.datetime.fromisoformat(avail)
+                if now >= avail_dt:
+                    expired.append(agent)
+            except (ValueError, TypeError):
+                corrupt.append(agent)
+
+        if expired or corrupt:
+            detail = []
+            if expired:
+                detail.append(f"expired: {expired}")
+            if corrupt:
+                detail.append(f"corrupt: {corrupt}")
             status.add_failure(FailureMode.FM4_RATE_LIMIT_CORRUPTION,
-                               f"Cannot read rate-limit file: {e}")
+                               "; ".join(detail))
+        status.details["rate_limits"] = {
+            "expired": expired, "corrupt": corrupt,
+            "active": [a for a in data if a not in expired and a not in corrupt],
+        }
 
     def _check_status_file(self, status: HealthStatus):
         """FM5: Status file corruption (partial JSON from crash)."""
-        if not STATUS_FILE.exists():
-            return
-
-        try:
-            data = json.loads(STATUS_FILE.read_text(encoding="utf-8"))
+        data, error = read_json_cached(STATUS_FILE)
+        if isinstance(error, json.JSONDecodeError):
+            status.add_failure(FailureMode.FM5_STATUS_CORRUPTION,
+                               f"Corrupt JSON: {error}")
+        elif error is not None:
+            status.add_failure(FailureMode.FM5_STATUS_CORRUPTION,
+                               f"Cannot read: {error}")
+        elif data is not None:
             # Validate required fields
             required = ["started_at", "running", "last_updated"]
             missing = [f for f in required if f not in data]
             if missing:
                 status.add_failure(FailureMode.FM5_STATUS_CORRUPTION,
                                    f"Missing fields: {missing}")
-        except json.JSONDecodeError as e:
-            status.add_failure(FailureMode.FM5_STATUS_CORRUPTION,
-                               f"Corrupt JSON: {e}")
-        except OSError as e:
-            status.add_failure(FailureMode.FM5_STATUS_CORRUPTION,
-                               f"Cannot read: {e}")
 
     def _is_actively_testing(self) -> bool:
         """Check if orchestrator is currently in a test phase."""
-        if not STATUS_FILE.exists():
-            return False
-        try:
-            data = json.loads(STATUS_FILE.read_text(encoding="utf-8"))
-            task = data.get("current_task", "")
-            return "test" in str(task).lower()
-        except Exception:
-            return False
+        if self.test_running is not None:
+            return self.test_running
+        data, _ = read_json_cached(STATUS_FILE)
+        return bool(data) and "test" in str(data.get("current_task", "")).lower()
 
 
 # ── RECOVERY ENGINE ─────────────────────────────────────────────────────────
@@ -496,8 +613,9 @@ class RecoveryEngine:
             if _kill_pid(pid):
                 killed.append(pid)
 
-        # Clean lock after killing
+        # Clean lock (and the dead run's heartbeat) after killing
         LOCK_FILE.unlink(missing_ok=True)
+        HEARTBEAT_FILE.unlink(missing_ok=True)
 
         return RecoveryResult(
             mode=FailureMode.FM6_HUNG_PROCESS,
@@ -543,6 +661,7 @@ class RecoveryEngine:
 
     def _verify_recovery(self, mode: FailureMode) -> bool:
         """Run targeted re-check to confirm recovery worked."""
+        process_snapshot(refresh=True)      # recovery may have killed processes
         checker = HealthChecker()
         status = HealthStatus(healthy=True)
 
@@ -567,6 +686,151 @@ class RecoveryEngine:
         return True
 
 
+# ── SUPERVISOR HISTORY ──────────────────────────────────────────────────────
+class SupervisorHistory:
+    """Restart/recovery telemetry persisted to HISTORY_FILE across supervisor
+    restarts: per-FailureMode counters, incidents (with recovery action time),
+    orchestrator runs (uptime, exit code), outages (time to recover) and
+    crash loops.  Lists are ring buffers of HISTORY_MAX_ENTRIES."""
+
+    # Failures that take the orchestrator down — the only ones that can loop
+    LOOP_MODES = {FailureMode.FM1_STALE_LOCK.value, FailureMode.FM6_HUNG_PROCESS.value,
+                  FailureMode.FM7_CRASHED_PROCESS.value}
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or HISTORY_FILE)
+        self.data = self._load()
+
+    def _load(self) -> dict:
+        data = {}
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+        if not isinstance(data, dict):
+            data = {}
+        data.setdefault("failures", {})       # mode -> {"count", "recovered", "action_s"}
+        for key in ("incidents", "runs", "outages", "crash_loops"):
+            data.setdefault(key, [])
+        data.setdefault("paused_until", None)
+        return data
+
+    def save(self):
+        for key in ("incidents", "runs", "outages", "crash_loops"):
+            del self.data[key][:-HISTORY_MAX_ENTRIES]
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(self.data, indent=1), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("[HISTORY] Could not save: %s", e)
+
+    def record_failure(self, failure: dict, result: RecoveryResult, seconds: float):
+        mode = failure["mode"]
+        agg = self.data["failures"].setdefault(
+            mode, {"count": 0, "recovered": 0, "action_s": 0.0})
+        agg["count"] += 1
+        agg["recovered"] += int(result.success)
+        agg["action_s"] = round(agg["action_s"] + seconds, 2)
+        self.data["incidents"].append({
+            "at": time.time(), "mode": mode, "detail": failure["detail"][:200],
+            "success": result.success, "verified": result.verified,
+            "action_s": round(seconds, 2)})
+
+    def record_start(self, pid: int):
+        self.data["runs"].append({"pid": pid, "started": time.time(),
+                                  "ended": None, "uptime_s": None, "exit_code": None})
+
+    def record_exit(self, pid: int, exit_code: Optional[int]):
+        for run in reversed(self.data["runs"]):
+            if run["pid"] == pid and run["ended"] is None:
+                run["ended"] = time.time()
+                run["uptime_s"] = round(run["ended"] - run["started"], 1)
+                run["exit_code"] = exit_code
+                return run
+        return None
+
+    def record_outage(self, started: float, modes: list):
+        """The orchestrator is healthy again after being down since `started`."""
+        self.data["outages"].append({"at": started, "recover_s": round(time.time() - started, 1),
+                                     "modes": sorted(set(modes))})
+
+    # ── crash loops ──
+    def _signatures(self, since: float) -> list:
+        """Failure signatures after `since`: a LOOP_MODES failure, or
+        exit:<code> for an orchestrator that exited non-zero."""
+        sigs = [i["mode"] for i in self.data["incidents"]
+                if i["at"] > since and i["mode"] in self.LOOP_MODES]
+        sigs += [f"exit:{r['exit_code']}" for r in self.data["runs"]
+                 if r["ended"] and r["ended"] > since and r["exit_code"] not in (0, None)]
+        return sigs
+
+    def detect_crash_loop(self, now: Optional[float] = None) -> Optional[str]:
+        """A signature seen CRASH_LOOP_THRESHOLD times within the window
+        (counting only since the last pause ended), else None."""
+        now = now or time.time()
+        since = max(now - CRASH_LOOP_WINDOW_MINUTES * 60, self.data["paused_until"] or 0)
+        sigs = self._signatures(since)
+        for sig in dict.fromkeys(sigs):
+            if sigs.count(sig) >= CRASH_LOOP_THRESHOLD:
+                return sig
+        return None
+
+    def pause(self, signature: str, now: Optional[float] = None) -> float:
+        now = now or time.time()
+        until = now + CRASH_LOOP_PAUSE_MINUTES * 60
+        self.data["paused_until"] = until
+        self.data["crash_loops"].append({"at": now, "signature": signature, "until": until})
+        return until
+
+    def paused(self, now: Optional[float] = None) -> bool:
+        until = self.data["paused_until"]
+        return bool(until) and (now or time.time()) < until
+
+    # ── report ──
+    def report(self) -> str:
+        d = self.data
+        lines = [f"=== Supervisor stats ({self.path.name}) ==="]
+        runs = [r for r in d["runs"] if r["ended"]]
+        uptimes = sorted(r["uptime_s"] for r in runs)
+        lines.append(f"  Orchestrator runs: {len(d['runs'])} started, {len(runs)} exited")
+        if uptimes:
+            lines.append(f"  Uptime between restarts: median {_fmt_secs(uptimes[len(uptimes) // 2])}, "
+                         f"min {_fmt_secs(uptimes[0])}, max {_fmt_secs(uptimes[-1])}")
+            codes = {}
+            for r in runs:
+                codes[r["exit_code"]] = codes.get(r["exit_code"], 0) + 1
+            lines.append("  Exit codes: " + ", ".join(
+                f"{code}×{n}" for code, n in sorted(codes.items(), key=lambda kv: -kv[1])))
+        lines.append("  Failures by mode:")
+        if not d["failures"]:
+            lines.append("    (none)")
+        for mode, agg in sorted(d["failures"].items(), key=lambda kv: -kv[1]["count"]):
+            lines.append(f"    {mode:<26} {agg['count']:>4}  recovered {agg['recovered']:>4}  "
+                         f"avg action {agg['action_s'] / agg['count']:.1f}s")
+        outages = sorted(o["recover_s"] for o in d["outages"])
+        if outages:
+            lines.append(f"  Time to recover: {len(outages)} outages, "
+                         f"mean {_fmt_secs(sum(outages) / len(outages))}, "
+                         f"median {_fmt_secs(outages[len(outages) // 2])}, "
+                         f"max {_fmt_secs(outages[-1])}")
+        if d["crash_loops"]:
+            last = d["crash_loops"][-1]
+            lines.append(f"  Crash loops: {len(d['crash_loops'])} (last: {last['signature']} at "
+                         f"{_fmt_ts(last['at'])})")
+        if self.paused():
+            lines.append(f"  Restarts PAUSED until {_fmt_ts(d['paused_until'])}")
+        return "\n".join(lines)
+
+
+def _fmt_secs(seconds: float) -> str:
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def _fmt_ts(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+
+
 # ── SUPERVISOR ──────────────────────────────────────────────────────────────
 class Supervisor:
     """Continuously monitors orchestrator, recovers from failures, restarts."""
@@ -583,6 +847,14 @@ class Supervisor:
         self._cycle_count = 0
         self._last_report_triaged = 0
         self._last_report_implemented = 0
+        self._watch = FileWatch([LOCK_FILE, STATUS_FILE, RATE_LIMIT_FILE])
+        self._proc_seen_exit = None
+        self._hb_stall_seen = None
+        self.history = SupervisorHistory()
+        self._down_since: Optional[float] = None    # outage start (epoch)
+        self._down_modes: list = []
+        self._exit_recorded = None                  # pid whose exit is in history
+        self._pause_logged = False
 
         signal.signal(signal.SIGINT, self._handle_signal)
         signal.signal(signal.SIGTERM, self._handle_signal)
@@ -609,8 +881,12 @@ class Supervisor:
         log.info("=" * 60)
 
         while self._running:
+            self._note_exit()
+
             # Phase 1: Health check + recovery
             health = self.checker.check_all()
+            if health.healthy and self._down_since and self._is_orchestrator_running():
+                self._end_outage()
 
             if not health.healthy:
                 log.warning("[SUPERVISOR] Health check FAILED — %d issues",
@@ -620,8 +896,9 @@ class Supervisor:
 
                 # Recover each failure
                 all_recovered = True
+                self._begin_outage(f["mode"] for f in health.failures)
                 for failure in health.failures:
-                    result = self.recovery.recover(failure)
+                    result = self._recover(failure)
                     if result.success and result.verified:
                         log.info("[RECOVERY] %s: OK — %s (verified)",
                                  result.mode.value, result.action_taken)
@@ -632,6 +909,7 @@ class Supervisor:
                         log.error("[RECOVERY] %s: FAILED — %s",
                                   result.mode.value, result.action_taken)
                         all_recovered = False
+                self._check_crash_loop()
 
                 if not all_recovered:
                     log.error("[SUPERVISOR] Some recoveries failed — "
@@ -646,6 +924,14 @@ class Supervisor:
                     log.info("[SUPERVISOR] Max restarts (%d) reached — exiting",
                              self.max_restarts)
                     break
+                if self.history.paused():
+                    if not self._pause_logged:
+                        log.error("[SUPERVISOR] Crash loop — restarts paused until %s "
+                                  "(see --stats)", _fmt_ts(self.history.data["paused_until"]))
+                        self._pause_logged = True
+                    self._wait_for_change(HEALTH_CHECK_INTERVAL)
+                    continue
+                self._pause_logged = False
 
                 log.info("[SUPERVISOR] Orchestrator not running — "
                          "starting (attempt %d, backoff %ds)",
@@ -653,6 +939,9 @@ class Supervisor:
 
                 self._start_orchestrator()
                 self.restart_count += 1
+                if self._orchestrator_proc:
+                    self.history.record_start(self._orchestrator_proc.pid)
+                    self.history.save()
                 # Reset backoff on successful start
                 time.sleep(5)  # Give it time to initialize
                 if self._is_orchestrator_running():
@@ -667,23 +956,99 @@ class Supervisor:
             if self._cycle_count % REPORT_INTERVAL_CYCLES == 0:
                 self._periodic_report()
 
-            # Phase 4: Wait before next check
-            for _ in range(HEALTH_CHECK_INTERVAL):
-                if not self._running:
-                    break
-                time.sleep(1)
+            # Phase 4: Wait for the next check — early if something changed
+            self._wait_for_change(HEALTH_CHECK_INTERVAL)
 
         log.info("[SUPERVISOR] Shutting down — %d restarts total",
                  self.restart_count)
 
+    def _recover(self, failure: dict) -> RecoveryResult:
+        """Recover one failure and record it in the history."""
+        t0 = time.monotonic()
+        result = self.recovery.recover(failure)
+        self.history.record_failure(failure, result, time.monotonic() - t0)
+        self.history.save()
+        return result
+
+    def _note_exit(self):
+        """Record the exit code and uptime of the orchestrator we started."""
+        proc = self._orchestrator_proc
+        if not proc or proc.poll() is None or self._exit_recorded == proc.pid:
+            return
+        self._exit_recorded = proc.pid
+        run = self.history.record_exit(proc.pid, proc.returncode)
+        uptime = run["uptime_s"] if run else 0
+        log.info("[SUPERVISOR] Orchestrator PID %d exited with code %s after %s",
+                 proc.pid, proc.returncode, _fmt_secs(uptime))
+        if proc.returncode != 0:
+            self._begin_outage([f"exit:{proc.returncode}"])
+            self._check_crash_loop()
+        self.history.save()
+
+    def _begin_outage(self, modes):
+        if self._down_since is None:
+            self._down_since = time.time()
+        self._down_modes.extend(modes)
+
+    def _end_outage(self):
+        self.history.record_outage(self._down_since, self._down_modes)
+        log.info("[SUPERVISOR] Recovered after %s",
+                 _fmt_secs(time.time() - self._down_since))
+        self._down_since, self._down_modes = None, []
+        self.history.save()
+
+    def _check_crash_loop(self):
+        if self.history.paused():
+            return
+        signature = self.history.detect_crash_loop()
+        if signature:
+            until = self.history.pause(signature)
+            log.error("[SUPERVISOR] Crash loop: %s %d times within %dmin — "
+                      "pausing restarts until %s", signature, CRASH_LOOP_THRESHOLD,
+                      CRASH_LOOP_WINDOW_MINUTES, _fmt_ts(until))
+            self.history.save()
+
+    def _wait_for_change(self, timeout: float) -> str:
+        """Sleep until `timeout`, or until the orchestrator we started exits,
+        the lock or rate-limit file changes, or the status file says the run
+        stopped.  Only stat() calls while waiting.  Returns the reason."""
+        started = time.monotonic()
+        while self._running and time.monotonic() - started < timeout:
+            time.sleep(1)
+            if time.monotonic() - started < MIN_CHECK_INTERVAL:
+                continue
+            proc = self._orchestrator_proc
+            if proc and proc.poll() is not None and self._proc_seen_exit != proc.pid:
+                self._proc_seen_exit = proc.pid
+                return "exited"
+            if self._heartbeat_stalled():
+                return "heartbeat"
+            changed = self._watch.changed()
+            if LOCK_FILE in changed or RATE_LIMIT_FILE in changed:
+                return "changed"
+            if STATUS_FILE in changed:
+                data, error = read_json_cached(STATUS_FILE)
+                if error is not None or (data is not None and not data.get("running")):
+                    return "status"
+        return "timeout"
+
+    def _heartbeat_stalled(self) -> bool:
+        """True once per stall: the heartbeat file stopped changing while a
+        lock is held (stat only — the full check runs after the wake-up)."""
+        stamp = _file_stamp(HEARTBEAT_FILE)
+        if stamp is None or not LOCK_FILE.exists() or stamp == self._hb_stall_seen:
+            return False
+        if time.time() - stamp[0] / 1e9 <= HEARTBEAT_STALE_SECONDS:
+            return False
+        self._hb_stall_seen = stamp
+        return True
+
     def _periodic_report(self):
         """Log a concise progress summary from orchestrator-status.json."""
-        if not STATUS_FILE.exists():
+        data, _ = read_json_cached(STATUS_FILE)
+        if not data or not data.get("running"):
             return
         try:
-            data = json.loads(STATUS_FILE.read_text(encoding="utf-8"))
-            if not data.get("running"):
-                return
 
             issues = data.get("issues", {})
             tokens = data.get("token_usage", {})
@@ -737,8 +1102,11 @@ class Supervisor:
             log.info("[REPORT] Triaged: %d | Implemented: %d | Failed: %d | "
                      "Wontfix: %d | NeedsInfo: %d",
                      triaged, implemented, failed, wontfix, needs_info)
+            # commits/errors are ring buffers — "totals" has the full counts
+            totals = data.get("totals", {})
             log.info("[REPORT] Commits: %d | Errors: %d | Cost: $%.2f ($%.2f/issue)",
-                     len(commits), len(errors), cost, cost_per)
+                     totals.get("commits", len(commits)),
+                     totals.get("errors", len(errors)), cost, cost_per)
             if task_desc:
                 log.info("[REPORT] Current: %s", task_desc)
             if duration:
@@ -753,7 +1121,7 @@ class Supervisor:
         if self._orchestrator_proc and self._orchestrator_proc.poll() is None:
             return True
         # Also check for externally-started orchestrators
-        return len(_find_orchestrator_pids()) > 0
+        return len(_find_orchestrator_pids(refresh=True)) > 0
 
     def _start_orchestrator(self):
         """Start the orchestrator as a subprocess."""
@@ -811,7 +1179,7 @@ class Supervisor:
 
             # Auto-recover
             for failure in health.failures:
-                result = self.recovery.recover(failure)
+                result = self._recover(failure)
                 status = "OK" if result.success else "FAILED"
                 verified = " (verified)" if result.verified else ""
                 log.info("[RECOVERY] %s: %s — %s%s",
@@ -821,6 +1189,151 @@ class Supervisor:
         return health
 
 
+# ── PROCESS SNAPSHOT ────────────────────────────────────────────────────────
+@dataclass
+class ProcInfo:
+    pid: int
+    name: str           # image name, lower-case ("python.exe" / "python3")
+    cmdline: str
+
+
+class ProcessSnapshot:
+    """Every process on the machine, captured once per health-check cycle
+    and shared by all checks: /proc on Linux, one `wmic` call on Windows
+    (tasklist as a names-only fallback)."""
+
+    def __init__(self, procs: Optional[list] = None):
+        self.procs = procs if procs is not None else self._capture()
+        self.taken = time.monotonic()
+
+    @staticmethod
+    def _capture() -> list:
+        if os.path.isdir("/proc"):
+            return _procs_from_proc()
+        return _procs_from_wmic() or _procs_from_tasklist()
+
+    def count(self, name: str) -> int:
+        want = name.lower()
+        bare = want[:-4] if want.endswith(".exe") else want
+        return sum(1 for p in self.procs if p.name in (want, bare))
+
+    def orchestrator_pids(self) -> list:
+        """Orchestrators holding (or competing for) the lock — not workers."""
+        return sorted(
+            p.pid for p in self.procs
+            if "python" in p.name and "iis_orchestrator" in p.cmdline
+            and "supervisor" not in p.cmdline.lower() and not _is_worker_cmd(p.cmdline))
+
+
+_snapshot: Optional[ProcessSnapshot] = None
+
+
+def process_snapshot(refresh: bool = False) -> ProcessSnapshot:
+    """The current cycle's snapshot (HealthChecker.check_all refreshes it)."""
+    global _snapshot
+    if refresh or _snapshot is None or time.monotonic() - _snapshot.taken > SNAPSHOT_MAX_AGE_SECONDS:
+        _snapshot = ProcessSnapshot()
+    return _snapshot
+
+
+def _procs_from_proc() -> list:
+    procs = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                argv = f.read().split(b"\0")
+            with open(f"/proc/{entry}/comm", "rb") as f:
+                comm = f.read().strip()
+        except OSError:
+            continue        # exited while we looked
+        name = os.path.basename(argv[0].decode(errors="replace")) if argv[0] else ""
+        procs.append(ProcInfo(int(entry), (name or comm.decode(errors="replace")).lower(),
+                              b" ".join(argv).decode(errors="replace").strip()))
+    return procs
+
+
+def _procs_from_wmic() -> list:
+    try:
+        result = subprocess.run(
+            ["wmic", "process", "get", "CommandLine,Name,ProcessId", "/format:csv"],
+            capture_output=True, text=True, timeout=15,
+        )
+    except Exception:
+        return []
+    procs = []
+    for line in result.stdout.splitlines():
+        # Node,CommandLine,Name,ProcessId — the command line may contain commas
+        parts = line.strip().split(",")
+        if len(parts) < 4 or not parts[-1].isdigit():
+            continue
+        procs.append(ProcInfo(int(parts[-1]), parts[-2].lower(), ",".join(parts[1:-2])))
+    return procs
+
+
+def _procs_from_tasklist() -> list:
+    try:
+        result = subprocess.run(["tasklist", "/FO", "CSV", "/NH"],
+                                capture_output=True, text=True, timeout=15)
+    except Exception:
+        return []
+    procs = []
+    for line in result.stdout.splitlines():
+        parts = [p.strip('"') for p in line.split('","')]
+        if len(parts) > 1 and parts[1].isdigit():
+            procs.append(ProcInfo(int(parts[1]), parts[0].lower(), ""))
+    return procs
+
+
+# ── FILE WATCH ──────────────────────────────────────────────────────────────
+_json_cache: dict = {}      # path -> ((mtime_ns, size), data, error)
+
+
+def _file_stamp(path: Path):
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def read_json_cached(path: Path):
+    """(data, error) for a JSON file, re-parsed only when its mtime/size
+    changed.  (None, None) if it doesn't exist; error is a JSONDecodeError
+    or OSError."""
+    stamp = _file_stamp(path)
+    if stamp is None:
+        _json_cache.pop(path, None)
+        return None, None
+    cached = _json_cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1], cached[2]
+    try:
+        data, error = json.loads(path.read_text(encoding="utf-8")), None
+    except (json.JSONDecodeError, OSError) as e:
+        data, error = None, e
+    _json_cache[path] = (stamp, data, error)
+    return data, error
+
+
+class FileWatch:
+    """Cheap stat-based change detection for the supervisor's wait loop."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.stamps = {p: _file_stamp(p) for p in self.paths}
+
+    def changed(self) -> list:
+        out = []
+        for p in self.paths:
+            stamp = _file_stamp(p)
+            if stamp != self.stamps[p]:
+                self.stamps[p] = stamp
+                out.append(p)
+        return out
+
+
 # ── UTILITIES ───────────────────────────────────────────────────────────────
 def _is_pid_alive(pid: int) -> bool:
     """Check if a process with given PID exists."""
@@ -831,45 +1344,22 @@ def _is_pid_alive(pid: int) -> bool:
         return False
 
 
-def _find_orchestrator_pids() -> list:
-    """Find all Python processes running iis_orchestrator.py."""
-    try:
-        result = subprocess.run(
-            ["wmic", "process", "where",
-             "name='python.exe' or name='python3.exe'",
-             "get", "processid,commandline"],
-            capture_output=True, text=True, timeout=10,
-        )
-        pids = []
-        for line in result.stdout.splitlines():
-            if "iis_orchestrator" in line and "supervisor" not in line.lower():
-                # Extract PID (last number on line)
-                parts = line.strip().split()
-                if parts:
-                    try:
-                        pid = int(parts[-1])
-                        pids.append(pid)
-                    except ValueError:
-                        pass
-        return sorted(pids)
-    except Exception:
-        return []
+def _is_worker_cmd(cmdline: str) -> bool:
+    """True if the command line runs `iis_orchestrator.py ... worker`.  The mode
+    is a positional argument, so options may come before it."""
+    args = [a.strip("\"'") for a in cmdline.split()]
+    script = next((i for i, a in enumerate(args) if a.endswith("iis_orchestrator.py")), None)
+    return script is not None and "worker" in args[script + 1:]
+
+
+def _find_orchestrator_pids(refresh: bool = False) -> list:
+    """PIDs of Python processes running iis_orchestrator.py (not workers)."""
+    return process_snapshot(refresh).orchestrator_pids()
 
 
 def _count_processes(name: str) -> int:
-    """Count running processes by name."""
-    try:
-        result = subprocess.run(
-            ["tasklist", "/FI", f"IMAGENAME eq {name}", "/NH"],
-            capture_output=True, text=True, timeout=10,
-        )
-        count = 0
-        for line in result.stdout.splitlines():
-            if name.lower() in line.lower():
-                count += 1
-        return count
-    except Exception:
-        return 0
+    """Count running processes by image name (this cycle's snapshot)."""
+    return process_snapshot().count(name)
 
 
 def _kill_pid(pid: int) -> bool:
@@ -908,8 +1398,13 @@ def main():
                         help="Max restarts before exit (0 = unlimited)")
     parser.add_argument("--orchestrator-args", type=str, default="",
                         help="Arguments to pass to orchestrator")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print restart/recovery history and exit")
     args = parser.parse_args()
 
+    if args.stats:
+        print(SupervisorHistory().report())
+        return
     if args.check:
         supervisor = Supervisor()
         health = supervisor.one_shot_check()
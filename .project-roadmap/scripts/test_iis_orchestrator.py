@@ -0,0 +1,1661 @@
+#!/usr/bin/env python3
+"""
+Tests for iis_orchestrator.py
+
+Covers the persistent state helpers (indexes, ledgers, queues) that the
+orchestrator keeps next to the scripts.  Uses temporary directories and
+throwaway git repositories — no agent CLIs, builds or network access.
+"""
+
+import sys
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8", errors="replace")
+    sys.stderr.reconfigure(encoding="utf-8", errors="replace")
+
+import datetime
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Import the module under test
+sys.path.insert(0, str(Path(__file__).parent))
+import iis_orchestrator as orch
+
+
+class TempFilesMixin:
+    """Mixin to redirect orchestrator state files to a temp directory."""
+
+    _PATCHED = ("SCRIPTS_DIR", "CHAIN_CONTEXT_DIR", "TIMEOUT_HISTORY_FILE",
+                "COMMIT_INDEX_FILE", "STATUS_FILE", "CHAIN_ARCHIVE_DIR",
+                "STATUS_HISTORY_FILE", "STATUS_WRITE_DEBOUNCE_SECS", "EVENTS_FILE",
+                "TRACES_DIR", "TOKEN_LEDGER_FILE", "CODE_INDEX_FILE",
+                "REPO_MAP_DIR", "WORK_QUEUE_DB", "OUTBOX_FILE", "_COMMENT_RATE_FILE",
+                "HEARTBEAT_FILE")
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self._orig = {name: getattr(orch, name) for name in self._PATCHED}
+        orch.SCRIPTS_DIR = self.tmpdir
+        orch.CHAIN_CONTEXT_DIR = self.tmpdir / "chain-context"
+        orch.TIMEOUT_HISTORY_FILE = orch.CHAIN_CONTEXT_DIR / "_timeout_history.json"
+        orch.COMMIT_INDEX_FILE = self.tmpdir / "_commit_index.json"
+        orch.STATUS_FILE = self.tmpdir / "orchestrator-status.json"
+        orch.CHAIN_ARCHIVE_DIR = orch.CHAIN_CONTEXT_DIR / "archive"
+        orch.STATUS_HISTORY_FILE = self.tmpdir / "orchestrator-status-history.jsonl"
+        orch.STATUS_WRITE_DEBOUNCE_SECS = 0     # write-through unless a test opts in
+        orch.EVENTS_FILE = self.tmpdir / "orchestrator-events.jsonl"
+        orch.TRACES_DIR = self.tmpdir / "traces"
+        orch.TOKEN_LEDGER_FILE = self.tmpdir / "_token_ledger.jsonl"
+        orch.CODE_INDEX_FILE = self.tmpdir / "_code_index.json"
+        orch.REPO_MAP_DIR = self.tmpdir / "repo-map"
+        orch.WORK_QUEUE_DB = self.tmpdir / "_work_queue.db"
+        orch.OUTBOX_FILE = self.tmpdir / "_outbox.json"
+        orch._COMMENT_RATE_FILE = self.tmpdir / "_comment_rate.json"
+        orch.HEARTBEAT_FILE = self.tmpdir / "orchestrator-heartbeat.json"
+        orch._outbox = None
+        orch._heartbeat = None
+        orch._triage_pool.clear()
+        orch._triage_trees_made = 0
+        orch._code_index = None
+        orch._repo_map_cache = None
+        orch._commit_index = None
+        orch._committed_issues_cache.clear()
+        orch._tree_snapshot_cache = None
+        orch._chain_index = None
+
+    def tearDown(self):
+        orch.flush_events()
+        for name, value in self._orig.items():
+            setattr(orch, name, value)
+        orch._commit_index = None
+        orch._committed_issues_cache.clear()
+        orch._tree_snapshot_cache = None
+        orch._chain_index = None
+        orch._code_index = None
+        orch._repo_map_cache = None
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+class GitRepoMixin(TempFilesMixin):
+    """Creates a throwaway git repo and points REPO_ROOT at it."""
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.tmpdir / "repo"
+        self.repo.mkdir()
+        self._orig_root = orch.REPO_ROOT
+        orch.REPO_ROOT = self.repo
+        self._git("init", "-q")
+        self._git("config", "user.email", "test@example.com")
+        self._git("config", "user.name", "test")
+
+    def tearDown(self):
+        orch.REPO_ROOT = self._orig_root
+        super().tearDown()
+
+    def _git(self, *args):
+        return subprocess.run(["git"] + list(args), cwd=str(self.repo),
+                              capture_output=True, text=True, check=True).stdout
+
+    def _commit(self, message, fname="file.txt"):
+        path = self.repo / fname
+        path.write_text(path.read_text() + "x\n" if path.exists() else "x\n")
+        self._git("add", "-A")
+        self._git("commit", "-q", "-m", message)
+        return self._git("rev-parse", "HEAD").strip()
+
+
+# ── COMMIT INDEX ────────────────────────────────────────────────────────────
+class TestCommitIndex(GitRepoMixin, unittest.TestCase):
+
+    def test_indexes_subject_and_body_references(self):
+        h = self._commit("fix(#101): crash on start\n\nAlso closes #202")
+        self.assertEqual(orch.update_commit_index(), 1)
+        self.assertEqual(orch.issues_for_commit(h), [101, 202])
+        self.assertEqual(orch.commits_for_issue(202), [h])
+        self.assertTrue(orch._is_issue_already_committed(101))
+        self.assertFalse(orch._is_issue_already_committed(303))
+
+    def test_mentions_are_indexed_but_not_treated_as_fixed(self):
+        h = self._commit("Merge pull request #55 from fork/branch\n\nsee #56, related to #57")
+        self._commit("Resolves #58", fname="other.txt")
+        orch.update_commit_index()
+        self.assertEqual(orch.issues_for_commit(h), [55, 56, 57])
+        self.assertEqual(orch.commits_for_issue(55), [h])
+        for num in (55, 56, 57):
+            self.assertFalse(orch._is_issue_already_committed(num))
+        self.assertTrue(orch._is_issue_already_committed(58))
+
+    def test_incremental_update_reads_only_new_commits(self):
+        self._commit("fix(#1): one")
+        self.assertEqual(orch.update_commit_index(), 1)
+        self.assertEqual(orch.update_commit_index(), 0)
+        self._commit("fix(#2): two")
+        self.assertEqual(orch.update_commit_index(), 1)
+        self.assertEqual(len(orch._load_commit_index()["commits"]), 2)
+
+    def test_index_persists_across_loads(self):
+        h = self._commit("fix(#7): seven")
+        orch.update_commit_index()
+        orch._commit_index = None
+        self.assertEqual(orch.commits_for_issue(7), [h])
+        data = json.loads(orch.COMMIT_INDEX_FILE.read_text(encoding="utf-8"))
+        self.assertEqual(data["head"], h)
+
+    def test_rewritten_history_triggers_rebuild(self):
+        self._commit("fix(#1): one")
+        self._commit("fix(#2): two")
+        orch.update_commit_index()
+        self._git("reset", "-q", "--hard", "HEAD~1")
+        self._commit("fix(#3): three", fname="other.txt")
+        orch.update_commit_index()
+        self.assertEqual(orch.commits_for_issue(2), [])
+        self.assertEqual(len(orch.commits_for_issue(3)), 1)
+
+    def test_record_commit_advances_head(self):
+        h = self._commit("fix(#9): nine")
+        orch._record_commit_in_index(h, "fix(#9): nine")
+        self.assertEqual(orch._load_commit_index()["head"], h)
+        self.assertEqual(orch.update_commit_index(), 0)
+
+    def test_record_commit_catches_up_on_unindexed_parents(self):
+        self._commit("fix(#100): hundred")
+        orch.update_commit_index()
+        self._commit("fix #101")                    # e.g. test hygiene, or a pull
+        h = self._commit("fix(#102): own commit")
+        orch._record_commit_in_index(h, "fix(#102): own commit")
+        self.assertEqual(orch._load_commit_index()["head"], h)
+        self.assertTrue(orch._is_issue_already_committed(101))
+        self.assertEqual(orch.update_commit_index(), 0)
+
+    def test_record_commit_before_first_index_builds_it(self):
+        self._commit("fix #101")
+        h = self._commit("fix(#102): own commit")
+        orch._record_commit_in_index(h, "fix(#102): own commit")
+        self.assertTrue(orch._is_issue_already_committed(101))
+        self.assertEqual(orch.commits_for_issue(102), [h])
+
+
+# ── WORKING-TREE SNAPSHOT ───────────────────────────────────────────────────
+class TestTreeSnapshot(GitRepoMixin, unittest.TestCase):
+
+    def test_parses_porcelain_v2_entries(self):
+        out = "\0".join([
+            "1 .M N... 100644 100644 100644 aaa bbb src/a.cs",
+            "1 A. N... 000000 100644 100644 000 ccc src/new file.cs",
+            "2 R. N... 100644 100644 100644 ddd ddd R100 src/b2.cs", "src/b.cs",
+            "? notes.txt",
+            "! bin/obj.dll",
+        ]) + "\0"
+        snap = orch.TreeSnapshot(out)
+        self.assertEqual(snap.unstaged, ["src/a.cs"])
+        self.assertEqual(snap.staged, ["src/new file.cs", "src/b2.cs"])
+        self.assertEqual(snap.renamed, {"src/b2.cs": "src/b.cs"})
+        self.assertEqual(snap.untracked, ["notes.txt"])
+        self.assertEqual(snap.modified, ["src/a.cs", "src/b2.cs", "src/new file.cs"])
+
+    def test_untracked_files_count_as_changes(self):
+        self._commit("init")
+        self.assertFalse(orch.git_has_changes())
+        (self.repo / "new.txt").write_text("hi\n")
+        orch._invalidate_tree_snapshot()
+        snap = orch.tree_snapshot()
+        self.assertTrue(snap.has_changes)
+        self.assertEqual(snap.untracked, ["new.txt"])
+        self.assertEqual(snap.modified, [])
+
+    def test_snapshot_memoised_until_invalidated(self):
+        self._commit("init")
+        first = orch.tree_snapshot()
+        self.assertIs(orch.tree_snapshot(), first)
+        orch._run(["git", "log", "-1"])             # read-only: keeps snapshot
+        self.assertIs(orch.tree_snapshot(), first)
+        orch._invalidate_tree_snapshot()
+        self.assertIsNot(orch.tree_snapshot(), first)
+
+    def test_post_timeout_state_and_diff_stat(self):
+        self._commit("init")
+        (self.repo / "file.txt").write_text("x\ny\n")
+        modified, summary = orch._capture_post_timeout_state()
+        self.assertEqual(modified, ["file.txt"])
+        self.assertIn("file.txt", summary)
+        self.assertIn("1 files changed, 1 insertions(+)", summary)
+        self.assertIn("+y", orch._capture_full_diff())
+
+    def test_diff_stat_counts_header_like_content_lines(self):
+        (self.repo / "file.sql").write_text("-- comment\nselect 1;\n")
+        self._git("add", "-A")
+        self._git("commit", "-q", "-m", "sql")
+        (self.repo / "file.sql").write_text("++ added\nselect 1;\n")
+        summary = orch.tree_snapshot(refresh=True).diff_stat()
+        self.assertIn("1 files changed, 1 insertions(+), 1 deletions(-)", summary)
+
+
+# ── CHECKPOINTS ─────────────────────────────────────────────────────────────
+class TestCheckpoints(GitRepoMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        (self.repo / "mRemoteNG").mkdir()
+        self._commit("init", "mRemoteNG/App.cs")
+        self._commit("state", "state.json")
+
+    def test_checkpoint_leaves_real_index_untouched(self):
+        (self.repo / "mRemoteNG/App.cs").write_text("changed\n")
+        (self.repo / "mRemoteNG/New.cs").write_text("new\n")
+        tree = orch.checkpoint_tree()
+        self.assertTrue(tree)
+        self.assertEqual(self._git("diff", "--cached", "--name-only"), "")
+        self.assertEqual(orch.checkpoint_files(tree), ["mRemoteNG/App.cs", "mRemoteNG/New.cs"])
+
+    def test_restore_returns_to_checkpoint(self):
+        (self.repo / "mRemoteNG/App.cs").write_text("attempt one\n")
+        (self.repo / "mRemoteNG/Added.cs").write_text("a\n")
+        tree = orch.checkpoint_tree("impl_5", 1)
+        (self.repo / "mRemoteNG/App.cs").write_text("attempt two\n")
+        (self.repo / "mRemoteNG/Added.cs").unlink()
+        self.assertTrue(orch.restore_checkpoint(tree))
+        self.assertEqual((self.repo / "mRemoteNG/App.cs").read_text(), "attempt one\n")
+        self.assertEqual((self.repo / "mRemoteNG/Added.cs").read_text(), "a\n")
+        self.assertEqual(self._git("diff", "--cached", "--name-only"), "")
+
+    def test_restore_applies_deletions(self):
+        (self.repo / "mRemoteNG/App.cs").unlink()
+        tree = orch.checkpoint_tree()
+        self.assertTrue(orch.restore_checkpoint(tree))
+        self.assertFalse((self.repo / "mRemoteNG/App.cs").exists())
+
+    def test_orchestrator_state_is_never_rewound(self):
+        (self.repo / "state.json").write_text("at checkpoint\n")
+        (self.repo / "mRemoteNG/App.cs").write_text("attempt\n")
+        tree = orch.checkpoint_tree()
+        (self.repo / "state.json").write_text("updated since\n")
+        (self.repo / "index.json").write_text("untracked state\n")
+        self.assertTrue(orch.restore_checkpoint(tree))
+        self.assertEqual((self.repo / "state.json").read_text(), "updated since\n")
+        self.assertEqual((self.repo / "index.json").read_text(), "untracked state\n")
+        self.assertEqual((self.repo / "mRemoteNG/App.cs").read_text(), "attempt\n")
+        self.assertEqual(orch.checkpoint_files(tree), ["mRemoteNG/App.cs"])
+
+    def test_refs_pin_and_drop(self):
+        (self.repo / "mRemoteNG/App.cs").write_text("changed\n")
+        tree = orch.checkpoint_tree("impl_7", 1)
+        ref = "refs/iis-checkpoints/impl_7/1"
+        self.assertEqual(self._git("rev-parse", ref).strip(), tree)
+        orch.drop_checkpoints("impl_7")
+        self.assertEqual(self._git("for-each-ref", "refs/iis-checkpoints/"), "")
+
+    def test_best_checkpoint_prefers_latest_building_attempt(self):
+        ctx = orch.ChainContext("implement", "1")
+        ctx.add_attempt("codex", "t", False, build_result="OK", checkpoint="aaa")
+        ctx.add_attempt("gemini", "t", False, build_result="FAIL", checkpoint="bbb")
+        self.assertEqual(ctx.best_checkpoint(), "aaa")
+
+
+# ── CHAIN RESUME ────────────────────────────────────────────────────────────
+class TestChainResume(GitRepoMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.head = self._commit("init")
+
+    def test_progress_persisted_per_attempt_and_cleared_on_save(self):
+        ctx = orch.ChainContext("implement", "42")
+        ctx.save_progress(issue={"number": 42}, triage={"approach": "x"})
+        ctx.add_attempt("codex", "implement #42", False, build_result="FAIL")
+        self.assertEqual(orch.ChainContext.unfinished("implement"), ["42"])
+        loaded = orch.ChainContext.load_progress("implement", "42")
+        self.assertEqual(len(loaded.attempts), 1)
+        self.assertEqual(loaded.progress["step"], "attempted")
+        ctx.save()
+        self.assertEqual(orch.ChainContext.unfinished("implement"), [])
+
+    def test_resume_at_verify_step_skips_agent_run(self):
+        (self.repo / "mRemoteNG").mkdir()
+        (self.repo / "mRemoteNG/App.cs").write_text("agent fix\n")
+        tree = orch.checkpoint_tree("impl_42", "verify0")
+        (self.repo / "mRemoteNG/App.cs").unlink()      # crash lost the edit
+        ctx = orch.ChainContext("implement", "42")
+        ctx.progress = {"issue": {"number": 42, "title": "t", "body": ""},
+                        "triage": {"approach": "a"}, "head": self.head,
+                        "agent_index": 0, "step": "verify",
+                        "verify_checkpoint": tree}
+        seen = []
+
+        def fake_build(capture_output=True):
+            seen.append((self.repo / "mRemoteNG/App.cs").read_text())
+            return False, "error CS0001"
+
+        with patch.object(orch, "AGENT_CHAIN", ["codex"]), \
+             patch.object(orch, "_agent_dispatch") as dispatch, \
+             patch.object(orch, "run_build", side_effect=fake_build):
+            ok = orch.resume_chain_implement(ctx, orch.Status())
+        self.assertFalse(ok)
+        dispatch.assert_not_called()
+        self.assertEqual(seen, ["agent fix\n"])
+        self.assertEqual(orch.ChainContext.unfinished("implement"), [])
+
+    def test_moved_head_discards_progress(self):
+        (self.repo / "mRemoteNG").mkdir()
+        (self.repo / "mRemoteNG/App.cs").write_text("base\n")
+        self._git("add", "-A")
+        self._git("commit", "-q", "-m", "app")
+        (self.repo / "mRemoteNG/App.cs").write_text("half-done agent edit\n")
+        ctx = orch.ChainContext("implement", "43")
+        ctx.save_progress(issue={"number": 43}, triage={"approach": "a"}, head="0" * 40,
+                          agent_index=0, step="dispatch")
+        self.assertFalse(orch.resume_chain_implement(ctx, orch.Status()))
+        self.assertEqual(orch.ChainContext.unfinished("implement"), [])
+        self.assertEqual((self.repo / "mRemoteNG/App.cs").read_text(), "base\n")
+
+    def test_exhausted_chain_restores_tree(self):
+        (self.repo / "mRemoteNG").mkdir()
+        (self.repo / "mRemoteNG/New.cs").write_text("left behind\n")
+        ctx = orch.ChainContext("implement", "44")
+        ctx.save_progress(issue={"number": 44}, triage={"approach": "a"}, head=self.head,
+                          agent_index=0, step="attempted")
+        with patch.object(orch, "AGENT_CHAIN", ["codex"]):
+            self.assertFalse(orch.resume_chain_implement(ctx, orch.Status()))
+        self.assertFalse((self.repo / "mRemoteNG/New.cs").exists())
+
+    def test_resumed_issues_recorded_for_queue(self):
+        ctx = orch.ChainContext("implement", "45")
+        ctx.save_progress(issue={"number": 45}, triage={"approach": "a"}, head="0" * 40)
+        self.addCleanup(orch._resumed_issues.clear)
+        with patch.object(orch, "_is_issue_already_committed", return_value=False):
+            self.assertEqual(orch._resume_unfinished_chains(orch.Status()), {45})
+        self.assertEqual(orch._resumed_issues, {45})
+
+
+# ── CHAIN-CONTEXT ARCHIVE ───────────────────────────────────────────────────
+class TestChainArchive(TempFilesMixin, unittest.TestCase):
+
+    def _write_context(self, stamp, task_type, task_id, success, agent="codex"):
+        data = {"task_type": task_type, "task_id": task_id, "started_at": stamp,
+                "attempts": [{"agent": agent, "success": success}],
+                "final_success": success, "all_timed_out": False}
+        orch.CHAIN_CONTEXT_DIR.mkdir(parents=True, exist_ok=True)
+        path = orch.CHAIN_CONTEXT_DIR / f"{stamp}_{task_type}_{task_id}.json"
+        path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        return path
+
+    def test_save_indexes_context(self):
+        ctx = orch.ChainContext("implement", "77")
+        ctx.add_attempt("gemini", "implement #77", True, build_result="OK")
+        ctx.save()
+        hits = orch.query_chain_history(issue=77, load=False)
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0]["agents"], ["gemini"])
+        self.assertEqual(hits[0]["outcome"], "success")
+
+    def test_save_appends_to_journal_not_index(self):
+        for n in ("1", "2"):
+            ctx = orch.ChainContext("triage", n)
+            ctx.add_attempt("codex", "triage", True)
+            ctx.save()
+        self.assertFalse(orch._chain_index_path().exists())
+        self.assertEqual(len(orch._chain_journal_path().read_text().splitlines()), 2)
+        with open(orch._chain_journal_path(), "a") as f:
+            f.write('{"id": "torn')                # crash mid-append
+        orch._chain_index = None
+        self.assertEqual(len(orch.query_chain_history(task_type="triage", load=False)), 2)
+        orch.compact_chain_contexts()
+        self.assertFalse(orch._chain_journal_path().exists())
+        orch._chain_index = None
+        self.assertEqual(len(orch.query_chain_history(task_type="triage", load=False)), 2)
+
+    def test_journalled_context_survives_compaction_in_new_process(self):
+        ctx = orch.ChainContext("implement", "88")
+        ctx.add_attempt("codex", "implement #88", False, build_result="FAIL")
+        ctx.save()
+        orch._chain_index = None                        # next run
+        later = datetime.datetime.now() + datetime.timedelta(
+            days=orch.CHAIN_ARCHIVE_AFTER_DAYS + 1)
+        self.assertEqual(orch.compact_chain_contexts(now=later), 1)
+        self.assertEqual([c["task_id"] for c in orch.query_chain_history(issue=88)], ["88"])
+        orch._chain_index = None
+        self.assertEqual([c["task_id"] for c in orch.query_chain_history(issue=88)], ["88"])
+
+    def test_compaction_keeps_files_if_index_save_fails(self):
+        old = self._write_context("20260101_120000", "implement", "5", False)
+        with patch.object(orch, "_save_chain_index", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                orch.compact_chain_contexts(now=datetime.datetime(2026, 3, 2))
+        self.assertTrue(old.exists())
+        orch._chain_index = None
+        self.assertEqual(orch.compact_chain_contexts(now=datetime.datetime(2026, 3, 2)), 1)
+        self.assertEqual([c["task_id"] for c in orch.query_chain_history(issue=5)], ["5"])
+
+    def test_compaction_rolls_old_files_into_segments(self):
+        old = self._write_context("20260101_120000", "implement", "5", False)
+        self._write_context("20260101_130000", "triage", "5", True, agent="claude")
+        recent = self._write_context("20260301_090000", "implement", "6", True)
+        now = datetime.datetime(2026, 3, 2)
+        self.assertEqual(orch.compact_chain_contexts(now=now), 2)
+        self.assertFalse(old.exists())
+        self.assertTrue(recent.exists())
+        self.assertTrue((orch.CHAIN_ARCHIVE_DIR / "20260101.jsonl.gz").exists())
+
+        orch._chain_index = None          # reload from disk
+        failed = orch.query_chain_history(issue=5, task_type="implement", outcome="failed")
+        self.assertEqual([c["task_id"] for c in failed], ["5"])
+        self.assertEqual(len(orch.query_chain_history(agent="claude")), 1)
+        self.assertEqual(len(orch.query_chain_history(issue=6)), 1)
+        self.assertEqual(orch.chain_history_stats()["implement"],
+                         {"failed": 1, "success": 1})
+
+    def test_retention_drops_expired_segments(self):
+        self._write_context("20250101_120000", "implement", "1", False)
+        orch.compact_chain_contexts(now=datetime.datetime(2025, 1, 10))
+        self.assertEqual(len(orch.query_chain_history(issue=1)), 1)
+        orch.compact_chain_contexts(now=datetime.datetime(2026, 1, 10))
+        self.assertEqual(orch.query_chain_history(issue=1), [])
+        self.assertEqual(list(orch.CHAIN_ARCHIVE_DIR.glob("*.jsonl.gz")), [])
+
+
+# ── STATUS WRITER ───────────────────────────────────────────────────────────
+class TestStatusWriter(TempFilesMixin, unittest.TestCase):
+
+    def _read(self):
+        return json.loads(orch.STATUS_FILE.read_text(encoding="utf-8"))
+
+    def test_writes_are_coalesced_until_flush(self):
+        orch.STATUS_WRITE_DEBOUNCE_SECS = 60
+        status = orch.Status()
+        status.set_phase("issues")            # first write goes straight out
+        status.set_phase("warnings")          # coalesced
+        self.assertEqual(self._read()["current_phase"], "issues")
+        status.flush()
+        self.assertEqual(self._read()["current_phase"], "warnings")
+        status.finish()                        # forced write cancels the timer
+        self.assertFalse(self._read()["running"])
+        self.assertIsNone(status._timer)
+        self.assertEqual(list(self.tmpdir.glob("*.tmp")), [])
+
+    def test_histories_are_ring_buffers_with_side_log(self):
+        status = orch.Status()
+        for i in range(orch.STATUS_RING_SIZE + 5):
+            status.add_commit(f"{i:040d}", f"fix {i}", True)
+        status.add_file_processed("a.cs")
+        status.add_file_processed("a.cs")
+        status.save()
+        data = self._read()
+        self.assertEqual(len(data["commits"]), orch.STATUS_RING_SIZE)
+        self.assertEqual(data["commits"][-1]["message"], f"fix {orch.STATUS_RING_SIZE + 4}")
+        self.assertEqual(data["totals"]["commits"], orch.STATUS_RING_SIZE + 5)
+        self.assertEqual(data["totals"]["files_processed"], 1)
+        lines = orch.STATUS_HISTORY_FILE.read_text(encoding="utf-8").splitlines()
+        self.assertEqual(len(lines), orch.STATUS_RING_SIZE + 6)
+
+
+# ── EVENT STREAM ────────────────────────────────────────────────────────────
+class TestEventStream(TempFilesMixin, unittest.TestCase):
+
+    def _events(self):
+        orch.flush_events()
+        lines = orch.EVENTS_FILE.read_text(encoding="utf-8").splitlines()
+        return [json.loads(l) for l in lines]
+
+    def test_events_are_written_in_order(self):
+        orch.emit_event("build", ok=True, duration_s=1.5)
+        orch.emit_event("commit", hash="abc")
+        events = self._events()
+        self.assertEqual([e["type"] for e in events], ["build", "commit"])
+        self.assertLess(events[0]["seq"], events[1]["seq"])
+        self.assertTrue(events[0]["ok"])
+
+    def test_log_rotates_past_size_limit(self):
+        with patch.object(orch, "EVENTS_MAX_BYTES", 1):
+            orch.emit_event("a")
+            orch.flush_events()
+            orch.emit_event("b")
+            orch.flush_events()
+        self.assertEqual([e["type"] for e in self._events()], ["b"])
+        rotated = orch.EVENTS_FILE.with_name(orch.EVENTS_FILE.name + ".1")
+        self.assertIn('"a"', rotated.read_text(encoding="utf-8"))
+
+    def test_dispatch_emits_start_and_end(self):
+        with patch.object(orch, "_dispatch_to_agent", return_value="out"):
+            self.assertEqual(orch._agent_dispatch("codex", "p", task_type="triage"), "out")
+        events = [e for e in self._events() if e["type"].startswith("dispatch")]
+        self.assertEqual([e["type"] for e in events], ["dispatch_start", "dispatch_end"])
+        self.assertTrue(events[1]["ok"])
+        self.assertEqual(events[1]["task"], "triage")
+
+    def test_phase_events_carry_duration(self):
+        status = orch.Status()
+        status.set_phase("issues")
+        status.set_phase("warnings")
+        status.finish()
+        phases = [(e["type"], e["phase"]) for e in self._events() if "phase" in e]
+        self.assertEqual(phases, [("phase_start", "issues"), ("phase_end", "issues"),
+                                  ("phase_start", "warnings"), ("phase_end", "warnings")])
+
+
+# ── METRICS ─────────────────────────────────────────────────────────────────
+class TestMetrics(TempFilesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        orch.METRICS_TEXTFILE = self.tmpdir / "orchestrator.prom"
+
+    def tearDown(self):
+        orch.stop_metrics()
+        orch._metrics = None
+        super().tearDown()
+
+    def test_disabled_by_default_records_nothing(self):
+        self.assertIsNone(orch._metrics)
+        orch._metric_inc("iis_commits_total", kind="issue")
+        orch._metric_observe("iis_build_duration_seconds", 12)
+        self.assertIsNone(orch._metrics)
+
+    def test_render_counters_histograms_and_derived(self):
+        orch.start_metrics()
+        orch._track_tokens(5, "implement", "codex", "gpt", {
+            "input_tokens": 100, "output_tokens": 20, "cost_usd": 0.5})
+        orch._metric_inc("iis_issues_fixed_total")
+        orch._metric_observe("iis_build_duration_seconds", 42)
+        text = orch.render_metrics()
+        self.assertIn('iis_tokens_total{agent="codex",direction="input",model="gpt"} 100', text)
+        self.assertIn('iis_build_duration_seconds_bucket{le="30"} 0', text)
+        self.assertIn('iis_build_duration_seconds_bucket{le="60"} 1', text)
+        self.assertIn("iis_build_duration_seconds_count 1", text)
+        self.assertIn("iis_cost_per_fix_usd 0.5", text)
+
+    def test_http_endpoint_serves_metrics(self):
+        import urllib.request
+        orch.start_metrics(port=0)
+        orch._metric_inc("iis_commits_total", kind="other")
+        port = orch._metrics_server.server_address[1]
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+        self.assertIn('iis_commits_total{kind="other"} 1', body)
+
+    def test_textfile_written_on_stop(self):
+        orch.start_metrics(textfile=True)
+        orch._metric_inc("iis_builds_total", result="ok")
+        orch.stop_metrics(textfile=True)
+        self.assertIn('iis_builds_total{result="ok"} 1',
+                      orch.METRICS_TEXTFILE.read_text(encoding="utf-8"))
+
+
+# ── TRACING ─────────────────────────────────────────────────────────────────
+class TestTracing(TempFilesMixin, unittest.TestCase):
+
+    def tearDown(self):
+        orch.stop_trace()
+        super().tearDown()
+
+    def test_spans_are_noops_without_trace(self):
+        with orch.span("x"):
+            orch.trace_step("s")
+        self.assertFalse(orch.TRACES_DIR.exists())
+
+    def test_nested_spans_and_steps(self):
+        @orch.traced("outer", cat="flux")
+        def outer():
+            for n in (1, 2):
+                orch.trace_step("issue", cat="issue", issue=n)
+                with orch.span("build", cat="build"):
+                    pass
+
+        path = orch.start_trace()
+        outer()
+        orch.stop_trace()
+        events = orch.load_trace(path)
+        names = [(e["name"], (e.get("args") or {}).get("issue")) for e in events]
+        self.assertEqual(names, [("build", None), ("issue", 1), ("build", None),
+                                 ("issue", 2), ("outer", None)])
+        outer_evt = events[-1]
+        for e in events[:-1]:
+            self.assertGreaterEqual(e["ts"], outer_evt["ts"])
+
+    def test_unfinished_trace_still_loads(self):
+        path = orch.start_trace()
+        with orch.span("a"):
+            pass
+        orch._trace_file.flush()
+        self.assertEqual([e["name"] for e in orch.load_trace(path)], ["a"])
+
+    def test_profile_critical_path_and_self_time(self):
+        events = [
+            {"name": "flux", "ph": "X", "ts": 0, "dur": 100, "tid": 1},
+            {"name": "issue", "ph": "X", "ts": 0, "dur": 30, "tid": 1},
+            {"name": "issue", "ph": "X", "ts": 30, "dur": 60, "tid": 1},
+            {"name": "build", "ph": "X", "ts": 35, "dur": 50, "tid": 1},
+        ]
+        prof = orch.profile_trace(events)
+        self.assertEqual([e["name"] for e in prof["critical_path"]],
+                         ["flux", "issue", "build"])
+        self.assertEqual(prof["by_name"]["flux"]["self_us"], 10)
+        self.assertEqual(prof["by_name"]["issue"]["self_us"], 40)
+        self.assertEqual(prof["wall_us"], 100)
+
+
+# ── TOKEN LEDGER ──────────────────────────────────────────────────────────
+class TestTokenLedger(TempFilesMixin, unittest.TestCase):
+
+    def test_parse_codex_turn_usage(self):
+        stdout = "\n".join([
+            '{"type":"thread.started","thread_id":"t"}',
+            '{"type":"item.completed","item":{"type":"agent_message","text":"done"}}',
+            '{"type":"turn.completed","usage":{"input_tokens":1000,'
+            '"cached_input_tokens":400,"output_tokens":200}}',
+            '{"type":"turn.completed","usage":{"input_tokens":500,"output_tokens":50}}',
+        ])
+        usage = orch._parse_codex_usage(stdout, "gpt-4.1-mini")
+        self.assertEqual((usage["input_tokens"], usage["output_tokens"],
+                          usage["cache_read_tokens"]), (1500, 250, 400))
+        self.assertAlmostEqual(usage["cost_usd"], (1500 * 0.40 + 250 * 1.60) / 1e6)
+        self.assertEqual(orch._extract_codex_last_message(stdout), "done")
+        self.assertEqual(orch._parse_codex_usage("plain text"), {})
+
+    def test_parse_gemini_json(self):
+        raw = json.dumps({"response": "answer", "stats": {"models": {
+            "gemini-2.5-flash": {"tokens": {"prompt": 800, "candidates": 100,
+                                            "thoughts": 20, "cached": 300}}}}})
+        text, usage = orch._parse_gemini_json_output(raw, "gemini-2.5-flash")
+        self.assertEqual(text, "answer")
+        self.assertEqual((usage["input_tokens"], usage["output_tokens"]), (800, 120))
+        self.assertEqual(orch._parse_gemini_json_output("not json"), ("not json", {}))
+
+    def test_dispatch_appends_per_call_record(self):
+        def fake(agent, prompt, **kw):
+            orch._dispatch_local.model = "m1"
+            orch._track_tokens(7, "implement", agent, "m1",
+                               {"input_tokens": 10, "output_tokens": 5, "cost_usd": 0.5})
+            return "ok"
+        orch._set_token_context(7, "implement")
+        with patch.object(orch, "_dispatch_to_agent", side_effect=fake):
+            self.assertEqual(orch._agent_dispatch("codex", "p", task_type="implement"), "ok")
+        recs = list(orch.iter_ledger())
+        self.assertEqual(len(recs), 1)
+        self.assertEqual((recs[0]["issue"], recs[0]["agent"], recs[0]["outcome"],
+                          recs[0]["input_tokens"], recs[0]["cost_usd"]),
+                         (7, "codex", "ok", 10, 0.5))
+        self.assertIsInstance(orch._token_tracker["by_issue"]["7"]["ops"], int)
+
+    def test_aggregate_by_grouping(self):
+        for day, issue, agent, outcome, cost in [
+                ("2026-01-01", 1, "codex", "ok", 1.0),
+                ("2026-01-01", 1, "claude", "failed", 2.0),
+                ("2026-01-02", 2, "codex", "ok", 0.5)]:
+            orch._ledger_append({"ts": day + "T10:00:00", "issue": issue, "agent": agent,
+                                 "model": "m", "outcome": outcome, "cost_usd": cost,
+                                 "input_tokens": 1, "output_tokens": 1, "duration_s": 60})
+        by_issue = orch.aggregate_ledger(orch._COST_GROUPINGS["issue"])
+        self.assertEqual(by_issue["1"]["cost_usd"], 3.0)
+        self.assertEqual(by_issue["1"]["dispatches"], 2)
+        by_outcome = orch.aggregate_ledger(orch._COST_GROUPINGS["outcome"],
+                                           since="2026-01-02")
+        self.assertEqual(by_outcome, {"ok": {"dispatches": 1, "input_tokens": 1,
+                                             "output_tokens": 1, "cost_usd": 0.5,
+                                             "duration_s": 60}})
+
+
+# ── FORECAST ──────────────────────────────────────────────────────────────
+class TestForecast(TempFilesMixin, unittest.TestCase):
+
+    def _chain(self, issue, task_type, secs):
+        start = datetime.datetime(2026, 1, 1, 10, 0, 0)
+        data = {"task_type": task_type, "task_id": str(issue), "attempts": [],
+                "started_at": start.isoformat(),
+                "finished_at": (start + datetime.timedelta(seconds=secs)).isoformat()}
+        orch._index_chain_context(f"{issue}_{task_type}", data, file="x.json")
+
+    def test_samples_pair_chain_duration_with_ledger_cost(self):
+        for issue in range(1, 5):
+            self._chain(issue, "triage", 60)
+        self._chain(1, "implement", 1200)
+        self._chain(2, "implement", 1800)
+        orch._ledger_append({"issue": 1, "task": "implement", "cost_usd": 2.0})
+        orch._ledger_append({"issue": 2, "task": "implement", "cost_usd": 4.0})
+        orch._ledger_append({"issue": 2, "task": "test_fix", "cost_usd": 1.0})
+        samples = orch.forecast_samples()
+        self.assertEqual(sorted(samples["implement"]["*"]), [(1200, 2.0), (1800, 5.0)])
+        self.assertEqual(samples["implement_rate"]["*"], 0.5)
+        # triage costs unknown -> median of known (none) -> 0
+        self.assertEqual(samples["triage"]["*"][0], (60, 0.0))
+
+    def test_forecast_percentiles_and_budget_advice(self):
+        samples = {"triage": {"*": [(600, 0.5)]},
+                   "implement": {"*": [(3000, 2.0)]},
+                   "implement_rate": {"*": 1.0}}
+        issues = [{"number": i, "priority": "P2-bug"} for i in range(10)]
+        fc = orch.forecast_run(issues, samples=samples, simulations=50,
+                               budget_hours=5, budget_usd=100)
+        self.assertEqual(fc["p50_hours"], 10.0)      # 10 x (600 + 3000) s
+        self.assertEqual(fc["p95_usd"], 25.0)
+        self.assertEqual(fc["recommended_max_issues"], 5)
+
+    def test_timeout_history_fallback(self):
+        orch._save_timeout_history({"durations": {"codex": {"triage": [30, 40],
+                                                            "implement": [500]}},
+                                    "escalations": {}})
+        samples = orch.forecast_samples()
+        self.assertEqual(sorted(samples["triage"]["*"]), [(30, 0.0), (40, 0.0)])
+        fc = orch.forecast_run([{"number": 1}], samples=samples, simulations=20)
+        self.assertEqual(fc["recommended_max_issues"], 1)
+
+
+# ── BUDGET CONTROL ────────────────────────────────────────────────────────
+class TestBudget(TempFilesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._tracker = orch._token_tracker
+        orch._token_tracker = {"by_issue": {},
+                               "session_total": {"input_tokens": 0, "output_tokens": 0,
+                                                 "cost_usd": 0.0}}
+
+    def tearDown(self):
+        orch._token_tracker = self._tracker
+        orch.configure_budget()
+        super().tearDown()
+
+    def _spend(self, issue, usd):
+        orch._track_tokens(issue, "implement", "claude", "m", {"cost_usd": usd})
+
+    def test_states_for_session_and_issue_ceilings(self):
+        orch.configure_budget(max_cost=10, max_cost_per_issue=2)
+        self.assertEqual(orch.budget_state(), "ok")
+        self._spend(1, 1.7)
+        self.assertEqual(orch.budget_state(), "ok")
+        self.assertEqual(orch.budget_state(1), "downgrade")
+        self._spend(1, 0.3)
+        self.assertEqual(orch.budget_state(1), "exhausted")
+        self.assertEqual(orch.budget_state(2), "ok")
+        self._spend(2, 8.0)
+        self.assertEqual(orch.budget_state(), "exhausted")
+
+    def test_unlimited_by_default(self):
+        self._spend(1, 1000)
+        self.assertEqual(orch.budget_state(1), "ok")
+
+    def test_dispatch_downgrades_then_refuses(self):
+        orch.configure_budget(max_cost=10)
+        calls = []
+        fake = lambda prompt, **kw: calls.append((kw["model"], kw["reasoning"])) or "ok"
+        with patch.object(orch, "codex_run", side_effect=fake), \
+                patch.object(orch, "_is_agent_rate_limited", return_value=(False, None)):
+            orch._agent_dispatch("codex", "p", task_type="implement")
+            self._spend(None, 8.5)
+            orch._agent_dispatch("codex", "p", task_type="implement")
+            self._spend(None, 2.0)
+            self.assertIsNone(orch._agent_dispatch("codex", "p", task_type="implement"))
+        self.assertEqual(calls, [(orch.CODEX_MODEL, "xhigh"),
+                                 (orch.CODEX_MODEL_FAST, "medium")])
+
+
+# ── PROMPT COMPACTION ─────────────────────────────────────────────────────
+class TestPromptCompaction(unittest.TestCase):
+
+    @staticmethod
+    def _diff(*paths, body="+x\n"):
+        return "".join(f"diff --git a/{p} b/{p}\n--- a/{p}\n+++ b/{p}\n@@ -1 +1 @@\n{body}"
+                       for p in paths)
+
+    def _ctx(self, n, **attempt):
+        ctx = orch.ChainContext("implement", "1")
+        for i in range(n):
+            ctx.add_attempt(f"agent{i}", "implement", False, **attempt)
+        return ctx
+
+    def test_dedupes_failures_and_errors(self):
+        tests = [{"name": "T.A", "error": "boom"}, {"name": "T.B", "error": "bang"}]
+        text = self._ctx(3, errors="build failed", failed_tests=tests) \
+            .format_for_prompt(max_tokens=10000, live_files=[])
+        self.assertEqual(text.count("boom"), 1)
+        self.assertEqual(text.count("Errors: build failed"), 1)
+        self.assertEqual(text.count("Errors: same as attempt 1"), 2)
+        self.assertIn("(2 same as attempt 1)", text)
+
+    def test_keeps_only_newest_diff_of_live_files(self):
+        ctx = orch.ChainContext("implement", "1")
+        ctx.add_attempt("codex", "implement", False,
+                        diff_output=self._diff("a.cs", "b.cs", body="+old\n"))
+        ctx.add_attempt("gemini", "implement", False,
+                        diff_output=self._diff("a.cs", body="+new\n"))
+        text = ctx.format_for_prompt(max_tokens=10000, live_files=["a.cs"])
+        self.assertIn("+new", text)
+        self.assertNotIn("+old", text)
+        self.assertNotIn("b/b.cs", text)
+        self.assertIn("superseded", text)
+
+    def test_size_bounded_regardless_of_chain_length(self):
+        big = {"raw_output": "r" * 2000, "errors": None,
+               "diff_output": self._diff("a.cs", body="+" + "y" * 5000 + "\n")}
+        sizes = []
+        for n in (1, 5, 40):
+            ctx = orch.ChainContext("implement", "1")
+            for i in range(n):
+                big["errors"] = f"error {i}"
+                ctx.add_attempt(f"a{i}", "implement", False, **big)
+            text = ctx.format_for_prompt(max_tokens=1500, live_files=["a.cs"])
+            sizes.append(orch._estimate_tokens(text))
+            self.assertTrue(text.endswith("=== END PREVIOUS ATTEMPTS ==="))
+        self.assertTrue(all(s <= 1500 for s in sizes), sizes)
+
+    def test_hard_clip_keeps_newest_attempts(self):
+        ctx = orch.ChainContext("implement", "1")
+        for i in range(40):
+            ctx.add_attempt(f"a{i}", "implement", False, errors=f"error {i} " + "e" * 300)
+        text = ctx.format_for_prompt(max_tokens=500, live_files=[])
+        self.assertLessEqual(orch._estimate_tokens(text), 500)
+        self.assertTrue(text.startswith("=== PREVIOUS AGENT ATTEMPTS ===\n"
+                                        "... [older context dropped]\n--- Attempt "))
+        self.assertIn("error 39", text)
+        self.assertNotIn("error 0 ", text)
+
+
+# ── CODE INDEX ────────────────────────────────────────────────────────────
+class TestCodeIndex(GitRepoMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        src = self.repo / "mRemoteNG" / "Connection"
+        src.mkdir(parents=True)
+        (src / "PuttySessionImporter.cs").write_text(
+            "namespace mRemoteNG.Connection {\n"
+            "public class PuttySessionImporter {\n"
+            "    public void ImportSessions(string registryPath) { }\n"
+            "    private string Title => \"Import PuTTY sessions\";\n}}\n")
+        (src / "RdpProtocol.cs").write_text(
+            "public class RdpProtocol {\n    public bool Connect() { return true; }\n}\n")
+        (self.repo / "README.md").write_text("not indexed\n")
+        self._git("add", "-A")
+        self._git("commit", "-q", "-m", "init")
+
+    def test_search_and_signatures(self):
+        index = orch.update_code_index()
+        self.assertEqual(len(index.files), 2)
+        path = "mRemoteNG/Connection/PuttySessionImporter.cs"
+        self.assertEqual(index.search("Importing putty sessions fails")[0][0], path)
+        self.assertIn("class PuttySessionImporter", index.signatures(path))
+        self.assertIn("public void ImportSessions", index.signatures(path))
+
+    def test_incremental_update_by_blob(self):
+        orch.update_code_index()
+        orch._code_index = None                      # force reload from disk
+        (self.repo / "mRemoteNG/Connection/RdpProtocol.cs").write_text(
+            "public class RdpProtocol {\n    public void Reconnect() { }\n}\n")
+        self._git("add", "-A")
+        with patch.object(orch, "_extract_symbols",
+                          wraps=orch._extract_symbols) as extract:
+            index = orch.update_code_index()
+        self.assertEqual([c.args[0] for c in extract.call_args_list],
+                         ["mRemoteNG/Connection/RdpProtocol.cs"])
+        self.assertIn("reconnect", index.files["mRemoteNG/Connection/RdpProtocol.cs"]["tf"])
+
+    def test_relevant_files_validates_and_augments(self):
+        files, block = orch.relevant_files(
+            {"title": "RDP connect hangs", "body": ""},
+            {"estimated_files": ["PuttySessionImporter.cs", "Nope/Missing.cs"]})
+        self.assertEqual(files[0], "mRemoteNG/Connection/PuttySessionImporter.cs")
+        self.assertIn("mRemoteNG/Connection/RdpProtocol.cs", files)
+        self.assertNotIn("Nope/Missing.cs", files)
+        self.assertIn("LIKELY RELEVANT FILES", block)
+
+
+# ── REPO MAP ──────────────────────────────────────────────────────────────
+class TestRepoMap(GitRepoMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for rel, body in [("mRemoteNG/Connection/ConnectionInfo.cs", "public class ConnectionInfo\n"),
+                          ("mRemoteNG/Tools/Helper.cs", "internal static class Helper\n"),
+                          ("mRemoteNGTests/Connection/ConnectionInfoTests.cs",
+                           "public class ConnectionInfoTests\n")]:
+            path = self.repo / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(body)
+        self._git("add", "-A")
+        self._git("commit", "-q", "-m", "init")
+
+    def test_map_lists_dirs_types_and_commands(self):
+        text = orch.repo_map()
+        self.assertIn("mRemoteNG/Connection/ (1 .cs) — ConnectionInfo", text)
+        self.assertIn("Tests mRemoteNGTests/:", text)
+        self.assertIn("run-tests.ps1 -NoBuild", text)
+        prompt = orch._with_repo_map("TASK")
+        self.assertTrue(prompt.startswith("=== REPOSITORY MAP ==="))
+        self.assertTrue(prompt.endswith("TASK"))
+
+    def test_new_commit_resummarises_only_changed_dirs(self):
+        orch.repo_map()
+        (self.repo / "mRemoteNG/Tools/Other.cs").write_text("public class Other\n")
+        self._git("add", "-A")
+        self._git("commit", "-q", "-m", "tools")
+        with patch.object(orch, "_summarize_dir", wraps=orch._summarize_dir) as summ:
+            text = orch.repo_map()
+        self.assertEqual([c.args[0] for c in summ.call_args_list], ["mRemoteNG/Tools"])
+        self.assertIn("Helper, Other", text)
+        self.assertEqual(len(list(orch.REPO_MAP_DIR.glob("*.md"))), 2)
+
+    def test_cached_per_head(self):
+        first = orch.repo_map()
+        orch._repo_map_cache = None
+        with patch.object(orch, "_summarize_dir") as summ:
+            self.assertEqual(orch.repo_map(), first)
+        summ.assert_not_called()
+
+
+# ── NEAR-DUPLICATE DETECTION ──────────────────────────────────────────────
+class TestNearDuplicates(TempFilesMixin, unittest.TestCase):
+
+    TEXT = ("RDP connection drops after a few minutes when the session is idle and "
+            "reconnect does not restore the window, the tab stays grey")
+
+    def setUp(self):
+        super().setUp()
+        self._orig_db = (orch.ISSUES_DB_ROOT, orch.DUP_INDEX_FILE)
+        orch.ISSUES_DB_ROOT = self.tmpdir / "issues-db"
+        orch.DUP_INDEX_FILE = self.tmpdir / "_dup_index.json"
+        orch._dup_index = None
+        (orch.ISSUES_DB_ROOT / "upstream").mkdir(parents=True)
+
+    def tearDown(self):
+        orch.ISSUES_DB_ROOT, orch.DUP_INDEX_FILE = self._orig_db
+        orch._dup_index = None
+        super().tearDown()
+
+    def _issue(self, num, title, body, status="new"):
+        data = {"number": num, "title": title, "body_snippet": body,
+                "our_status": status, "comments": []}
+        orch.iis_write_json(orch.ISSUES_DB_ROOT / "upstream" / f"{num:04d}.json", data)
+        return data
+
+    def test_signature_similarity_tracks_jaccard(self):
+        a = orch.minhash_signature(self.TEXT)
+        b = orch.minhash_signature(self.TEXT + " again")
+        c = orch.minhash_signature("Add dark theme to the options dialog please")
+        self.assertGreater(orch._sig_similarity(a, b), 0.8)
+        self.assertLess(orch._sig_similarity(a, c), 0.2)
+        self.assertEqual(a, orch.minhash_signature(self.TEXT))      # deterministic
+
+    def test_candidates_and_pretriage(self):
+        self._issue(10, "RDP drops", self.TEXT, status="released")
+        self._issue(11, "Dark theme", "Add dark theme to the options dialog please")
+        new = self._issue(12, "RDP drops", self.TEXT)
+        dups = orch.find_near_duplicates(new)
+        self.assertEqual([d["number"] for d in dups], [10])
+        triage = orch.dedup_pretriage(new, dups)
+        self.assertEqual((triage["decision"], triage["duplicate_of"]), ("duplicate", 10))
+        self.assertTrue(orch.DUP_INDEX_FILE.exists())
+
+    def test_no_pretriage_against_open_issue(self):
+        self._issue(10, "RDP drops", self.TEXT, status="new")
+        new = self._issue(12, "RDP drops", self.TEXT)
+        dups = orch.find_near_duplicates(new)
+        self.assertEqual(dups[0]["number"], 10)
+        self.assertIsNone(orch.dedup_pretriage(new, dups))
+
+    def test_incremental_add_rebuckets_changed_text(self):
+        index = orch.DupIndex()
+        self.assertTrue(index.add("upstream/1", self.TEXT))
+        self.assertFalse(index.add("upstream/1", self.TEXT))
+        index.add("upstream/2", self.TEXT)
+        self.assertEqual(index.similar("upstream/2")[0][0], "upstream/1")
+        index.add("upstream/1", "completely different text about the installer msi")
+        self.assertEqual(index.similar("upstream/2"), [])
+
+
+# ── ISSUE SEARCH ──────────────────────────────────────────────────────────
+class TestIssueSearch(TempFilesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._orig_db = (orch.ISSUES_DB_ROOT, orch.ISSUE_SEARCH_INDEX_FILE)
+        orch.ISSUES_DB_ROOT = self.tmpdir / "issues-db"
+        orch.ISSUE_SEARCH_INDEX_FILE = self.tmpdir / "_issue_search_index.json"
+        orch._issue_search_index = None
+        (orch.ISSUES_DB_ROOT / "upstream").mkdir(parents=True)
+        self._issue(1, "Crash when importing PuTTY sessions", "NullReference in importer",
+                    labels=["Bug"], created="2020-01-05")
+        self._issue(2, "Dark theme request", "Please add a dark theme, putty style",
+                    labels=["Enhancement"], created="2024-03-01", status="roadmap")
+        self._issue(3, "RDP reconnect", "Reconnect loses the session",
+                    labels=["Bug", "RDP"], created="2023-07-10")
+
+    def tearDown(self):
+        orch.ISSUES_DB_ROOT, orch.ISSUE_SEARCH_INDEX_FILE = self._orig_db
+        orch._issue_search_index = None
+        super().tearDown()
+
+    def _issue(self, num, title, body, labels=(), created="2024-01-01", status="new"):
+        orch.iis_write_json(orch.ISSUES_DB_ROOT / "upstream" / f"{num:04d}.json", {
+            "number": num, "title": title, "body_snippet": body, "labels": list(labels),
+            "created_at": created + "T00:00:00Z", "our_status": status, "comments": []})
+
+    def test_ranked_title_match_first(self):
+        hits = orch.search_issues("putty import")
+        self.assertEqual([h["number"] for h in hits], [1, 2])
+
+    def test_filters(self):
+        self.assertEqual([h["number"] for h in orch.search_issues("", labels=["bug"])], [3, 1])
+        self.assertEqual([h["number"] for h in orch.search_issues("putty", status="roadmap")], [2])
+        self.assertEqual([h["number"] for h in orch.search_issues("", since="2023-01-01",
+                                                                   until="2023-12-31")], [3])
+
+    def test_refresh_reads_only_changed_files(self):
+        index = orch.get_search_index()
+        self.assertEqual(index.refresh(), 0)
+        self._issue(3, "RDP reconnect", "Reconnect loses the session", status="testing")
+        (orch.ISSUES_DB_ROOT / "upstream" / "0001.json").unlink()
+        os.utime(orch.ISSUES_DB_ROOT / "upstream" / "0003.json", ns=(1, 1))
+        with patch.object(orch, "iis_read_json", wraps=orch.iis_read_json) as read:
+            self.assertEqual(index.refresh(), 2)
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual(orch.search_issues("reconnect")[0]["status"], "testing")
+        self.assertEqual(orch.search_issues("putty import")[0]["number"], 2)
+        # persisted
+        self.assertEqual(len(orch.IssueSearchIndex.load().docs), 2)
+
+
+# ── PRE-TRIAGE RULES ──────────────────────────────────────────────────────
+class TestPretriage(unittest.TestCase):
+
+    NOW = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def _issue(self, **kw):
+        issue = {"number": 1, "title": "t", "labels": [], "created_at": "2025-06-01T00:00:00Z",
+                 "comments": [], "waiting_for_us": False, "iterations": []}
+        issue.update(kw)
+        return issue
+
+    def test_plain_issue_goes_to_agents(self):
+        self.assertEqual(orch.pretriage(self._issue(), now=self.NOW), (None, None))
+
+    def test_old_duplicate_label(self):
+        triage, rule = orch.pretriage(
+            self._issue(labels=["Duplicate"], created_at="2019-01-01T00:00:00Z"), now=self.NOW)
+        self.assertEqual((triage["decision"], triage["confidence"], rule),
+                         ("duplicate", 0.95, "rule:rule_duplicate_label"))
+        self.assertEqual(triage["priority"], "P4-debt")     # from _auto_classify
+
+    def test_fresh_duplicate_label_goes_to_agents(self):
+        self.assertEqual(orch.pretriage(self._issue(labels=["Duplicate"]), now=self.NOW),
+                         (None, None))
+
+    def test_need_2_check_only_when_stale_and_quiet(self):
+        old = "2020-01-01T00:00:00Z"
+        self.assertIsNone(orch.pretriage(self._issue(labels=["Need 2 check"]), now=self.NOW)[0])
+        self.assertIsNone(orch.pretriage(self._issue(labels=["Need 2 check"], created_at=old,
+                                                     waiting_for_us=True), now=self.NOW)[0])
+        followed_up = self._issue(labels=["Need 2 check"], created_at=old, author="rep",
+                                  comments=[{"author": "rep", "is_ours": False},
+                                            {"author": "dev", "is_ours": False}])
+        self.assertIsNone(orch.pretriage(followed_up, now=self.NOW)[0])
+        triage, _ = orch.pretriage(self._issue(labels=["Need 2 check"], created_at=old,
+                                               author="rep",
+                                               comments=[{"author": "dev", "is_ours": False}]),
+                                   now=self.NOW)
+        self.assertEqual(triage["decision"], "needs_info")
+
+    def test_answered_by_us_and_highest_confidence_wins(self):
+        issue = self._issue(comments=[{"is_ours": False}, {"is_ours": True}],
+                            iterations=[{"type": "released"}])
+        triage, rule = orch.pretriage(issue, now=self.NOW)
+        self.assertEqual((triage["decision"], rule), ("needs_info", "rule:rule_answered_by_us"))
+        dup = [{"number": 9, "repo": "upstream", "status": "released", "similarity": 0.97,
+                "title": "x"}]
+        triage, rule = orch.pretriage(issue, duplicates=dup, now=self.NOW)
+        self.assertEqual((triage["decision"], rule), ("duplicate", "rule:rule_near_duplicate"))
+
+    def test_rules_can_be_disabled(self):
+        issue = self._issue(labels=["Duplicate"], created_at="2019-01-01T00:00:00Z")
+        with patch.object(orch, "PRETRIAGE_DISABLED_RULES", {"rule_duplicate_label"}):
+            self.assertEqual(orch.pretriage(issue, now=self.NOW), (None, None))
+
+
+# ── WORK QUEUE ─────────────────────────────────────────────────────────────
+class TestWorkQueue(TempFilesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.q = orch.WorkQueue()
+
+    def tearDown(self):
+        self.q.close()
+        super().tearDown()
+
+    @staticmethod
+    def _issue(num, priority="P2-bug", **kw):
+        issue = {"number": num, "title": f"issue {num}", "priority": priority,
+                 "created_at": "2025-01-01T00:00:00Z", "comments": [],
+                 "github_updated_at": "v1"}
+        issue.update(kw)
+        return issue
+
+    def test_score_orders_by_priority_and_history(self):
+        hist_bad = [{"outcome": "failed"}] * 4
+        p1 = orch.score_issue(self._issue(1, "P1-security"), history=[])
+        p3 = orch.score_issue(self._issue(2, "P3-enhancement"), history=[])
+        waiting = orch.score_issue(self._issue(3, "P3-enhancement", waiting_for_us=True), history=[])
+        doomed = orch.score_issue(self._issue(4, "P1-security"), history=hist_bad)
+        self.assertGreater(p1, p3)
+        self.assertGreater(waiting, p3)
+        self.assertLess(doomed, p1)
+
+    def test_lease_is_exclusive_and_best_first(self):
+        self.q.sync([self._issue(1, "P3-enhancement"), self._issue(2, "P0-critical")],
+                    scorer=lambda i: orch._PRIORITY_SCORE[i["priority"]])
+        first = self.q.lease("w1")
+        second = self.q.lease("w2")
+        self.assertEqual((first["number"], second["number"]), (2, 1))
+        self.assertIsNone(self.q.lease("w3"))
+        self.assertFalse(self.q.settle(first["key"], "done", owner="w2"))
+        # expired leases are taken over
+        self.assertEqual(self.q.lease("w3", now=time.time() + orch.WORK_QUEUE_LEASE_SECS + 1)
+                         ["number"], 2)
+
+    def test_failure_backs_off_then_parks(self):
+        self.q.sync([self._issue(1)], scorer=lambda i: 1)
+        now = 1000.0
+        for attempt in range(1, orch.WORK_QUEUE_MAX_ATTEMPTS + 1):
+            item = self.q.lease("w", now=now)
+            self.assertIsNotNone(item, attempt)
+            self.q.settle(item["key"], "failed", owner="w", detail="boom", now=now)
+            self.assertIsNone(self.q.lease("w", now=now + 1))
+            now += orch.WORK_QUEUE_RETRY_MAX_SECS
+        self.assertEqual(self.q.counts(), {"failed": 1})
+        # an upstream change gives it a fresh start
+        self.q.sync([self._issue(1, github_updated_at="v2")], scorer=lambda i: 1)
+        self.assertEqual(self.q.lease("w", now=now)["attempts"], 0)
+
+    def test_restart_requeues_leases_first_and_drops_stale(self):
+        self.q.sync([self._issue(1, "P4-debt"), self._issue(2, "P0-critical"), self._issue(3)])
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        taken = self.q.lease(f"{socket.gethostname()}:{dead.pid}", exclude=["issue:2"])
+        self.assertEqual(taken["number"], 3)
+        self.q.lease(f"otherhost:{os.getpid()}")         # live elsewhere: left alone
+        self.q.close()
+        self.q = orch.WorkQueue()
+        self.assertEqual(self.q.requeue_leases(), 1)
+        self.q.sync([self._issue(2, "P0-critical"), self._issue(3)])   # #1 closed upstream
+        self.assertEqual(self.q.counts(), {"pending": 1, "leased": 1, "dropped": 1})
+        self.assertEqual(self.q.lease("w")["number"], 3)
+
+    def test_leased_issues_settles_by_loop_outcome(self):
+        self.q.sync([self._issue(n) for n in (1, 2, 3)], scorer=lambda i: -i["number"])
+        leases = orch.LeasedIssues(self.q, lambda n: self._issue(n))
+        seen = []
+        for issue in leases:
+            seen.append(issue["number"])
+            if issue["number"] == 1:
+                leases.done("implemented")
+            elif issue["number"] == 2:
+                continue                                    # released, not offered again
+            else:
+                break                                       # released by break
+        self.assertEqual(seen, [1, 2, 3])
+        self.assertEqual(self.q.counts(), {"done": 1, "pending": 2})
+
+
+# ── MULTI-WORKER QUEUE ─────────────────────────────────────────────────────
+class TestTriageWorkers(TempFilesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.q = orch.WorkQueue()
+        self.q.sync([TestWorkQueue._issue(n) for n in range(1, 21)], scorer=lambda i: i["number"])
+
+    def tearDown(self):
+        self.q.close()
+        orch._git_owner = True
+        super().tearDown()
+
+    def test_concurrent_leases_are_disjoint(self):
+        got, errors = [], []
+
+        def worker(name):
+            q = orch.WorkQueue()
+            try:
+                while (item := q.lease(name, states=("pending",))) is not None:
+                    got.append(item["number"])
+                    q.settle(item["key"], "triaged", owner=name, detail="{}")
+            except Exception as e:          # pragma: no cover - surfaced below
+                errors.append(e)
+            finally:
+                q.close()
+
+        threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(got), list(range(1, 21)))
+        self.assertEqual(self.q.counts(), {"triaged": 20})
+
+    def test_heartbeat_keeps_lease_alive(self):
+        leases = orch.LeasedIssues(self.q, max_items=1, heartbeat_secs=0.02)
+        with patch.object(orch, "WORK_QUEUE_LEASE_SECS", 600):
+            for _ in leases:
+                first = self.q.db.execute(
+                    "SELECT lease_expires FROM items WHERE state='leased'").fetchone()[0]
+                time.sleep(0.2)
+                later = self.q.db.execute(
+                    "SELECT lease_expires FROM items WHERE state='leased'").fetchone()[0]
+        self.assertGreater(later, first)
+        self.assertEqual(leases.lost, 0)
+
+    def test_worker_triages_and_owner_picks_up(self):
+        triage = {"decision": "wontfix", "priority": "P4-debt", "reason": "r"}
+        with patch.object(orch, "find_near_duplicates", return_value=[]), \
+             patch.object(orch, "pretriage", return_value=(None, None)), \
+             patch.object(orch, "chain_triage", return_value=(triage, "codex")) as chain:
+            self.assertEqual(orch.run_triage_worker(max_issues=3), 3)
+        self.assertEqual(chain.call_count, 3)
+        self.assertFalse(orch._git_owner)
+        self.assertEqual(self.q.counts(), {"triaged": 3, "pending": 17})
+        # workers never take an item already triaged
+        orch._git_owner = True
+        leases = orch.LeasedIssues(self.q, max_items=1)
+        for issue in leases:
+            self.assertEqual(issue["number"], 20)       # payload travels with the item
+            self.assertEqual(leases.stored_triage(), (triage, "worker:codex"))
+            leases.done("wontfix")
+        self.assertEqual(self.q.counts()["done"], 1)
+
+    def test_workers_cannot_touch_git(self):
+        orch._git_owner = False
+        with patch.object(orch, "_run") as run, \
+                patch("iis_orchestrator.subprocess.run") as sp_run:
+            self.assertIsNone(orch.git_commit("fix #1"))
+            orch.git_push()
+            orch.git_restore()
+            orch._restore_triage_contamination(["mRemoteNG/App.cs"])
+            orch.kill_stale_processes()
+        run.assert_not_called()
+        sp_run.assert_not_called()
+
+
+# ── PIPELINE ───────────────────────────────────────────────────────────────
+class TestPipeline(unittest.TestCase):
+
+    def test_items_stream_through_stages(self):
+        seen = []
+        pipe = orch.Pipeline("t", [
+            orch.Stage("double", lambda x: x * 2),
+            orch.Stage("odd_stop", lambda x: None if x % 4 == 0 else x, concurrency=3),
+            orch.Stage("sink", seen.append),
+        ])
+        stats = pipe.run(range(10))
+        self.assertEqual(sorted(seen), [2, 6, 10, 14, 18])
+        self.assertEqual((stats["double"]["in"], stats["double"]["passed"]), (10, 10))
+        self.assertEqual((stats["odd_stop"]["passed"], stats["odd_stop"]["finished"]), (5, 5))
+        self.assertEqual(stats["sink"]["finished"], 5)
+
+    def test_stages_overlap(self):
+        gate = threading.Event()
+
+        def first(x):
+            if x == 1:
+                self.assertTrue(gate.wait(2), "stage 2 never ran while stage 1 was busy")
+            return x
+
+        def second(x):
+            gate.set()
+
+        orch.Pipeline("t", [orch.Stage("a", first), orch.Stage("b", second)]).run([0, 1])
+
+    def test_retry_then_error(self):
+        calls, errors = [], []
+
+        def flaky(x):
+            calls.append(x)
+            if x == "bad" or len(calls) == 1:
+                raise RuntimeError("boom")
+
+        pipe = orch.Pipeline("t", [orch.Stage("s", flaky, retries=2, retry_backoff=0)],
+                             on_error=lambda stage, item, e: errors.append((stage, item)))
+        stats = pipe.run(["ok", "bad"])
+        self.assertEqual(calls, ["ok", "ok", "bad", "bad", "bad"])
+        self.assertEqual(errors, [("s", "bad")])
+        self.assertEqual((stats["s"]["retried"], stats["s"]["failed"]), (3, 1))
+
+    def test_stop_drops_queued_items(self):
+        dropped = []
+        pipe = orch.Pipeline("t", [orch.Stage("s", lambda x: pipe.stop("enough"),
+                                              queue_size=5)],
+                             on_drop=lambda stage, item: dropped.append(item))
+        stats = pipe.run(range(5))
+        self.assertEqual(pipe.stop_reason, "enough")
+        self.assertEqual(stats["s"]["in"], 1)
+        self.assertEqual(len(dropped), 4)
+
+
+class TestFluxIssuesPipeline(TempFilesMixin, unittest.TestCase):
+
+    def test_decisions_settle_queue_items(self):
+        issues = [TestWorkQueue._issue(n, p) for n, p in
+                  ((1, "P3-enhancement"), (2, "P1-security"), (3, "P2-bug"))]
+        triage = {1: {"decision": "wontfix", "reason": "r"},
+                  2: {"decision": "implement", "reason": "r"},
+                  3: None}
+        implemented = []
+        with patch.object(orch, "iis_sync"), \
+             patch.object(orch, "load_actionable_issues", return_value=issues), \
+             patch.object(orch, "_resume_unfinished_chains", return_value=set()), \
+             patch.object(orch, "find_near_duplicates", return_value=[]), \
+             patch.object(orch, "pretriage", return_value=(None, None)), \
+             patch.object(orch, "_sleep"), \
+             patch.object(orch, "chain_triage",
+                          side_effect=lambda iss, **kw: (triage[iss["number"]], "codex")
+                          if triage[iss["number"]] else (None, None)), \
+             patch.object(orch, "chain_implement",
+                          side_effect=lambda iss, t, st: implemented.append(iss["number"]) or True), \
+             patch.object(orch, "update_issue_json"), \
+             patch.object(orch, "_is_issue_already_committed", return_value=False):
+            status = orch.Status()
+            orch.flux_issues(status)
+        self.assertEqual(implemented, [2])
+        q = orch.WorkQueue()
+        try:
+            states = {r["number"]: r["state"] for r in q._query("SELECT number, state FROM items")}
+        finally:
+            q.close()
+        self.assertEqual(states, {1: "done", 2: "done", 3: "pending"})   # 3: retry later
+        self.assertEqual(status.data["pipeline"]["triage"]["in"], 3)
+        self.assertEqual(status.data["issues"]["skipped_wontfix"], 1)
+
+    def test_non_implement_decisions_skip_the_tree_lock(self):
+        issues = [TestWorkQueue._issue(1, "P3-enhancement")]
+        held, release = threading.Event(), threading.Event()
+
+        def implementer():                              # a long implement elsewhere
+            with orch._tree_lock:
+                held.set()
+                release.wait(10)
+        busy = threading.Thread(target=implementer)
+        busy.start()
+        self.addCleanup(busy.join)
+        self.addCleanup(release.set)
+        held.wait(5)
+        with patch.object(orch, "iis_sync"), \
+             patch.object(orch, "load_actionable_issues", return_value=issues), \
+             patch.object(orch, "_resume_unfinished_chains", return_value=set()), \
+             patch.object(orch, "find_near_duplicates", return_value=[]), \
+             patch.object(orch, "pretriage",
+                          return_value=({"decision": "needs_info", "reason": "r",
+                                         "confidence": 0.95}, "rule:x")), \
+             patch.object(orch, "update_issue_json") as update:
+            status = orch.Status()
+            run = threading.Thread(target=orch.flux_issues, args=(status,))
+            run.start()
+            run.join(5)
+            self.assertFalse(run.is_alive())
+        update.assert_called_once()
+        self.assertEqual(status.data["issues"]["skipped_needs_info"], 1)
+
+
+# ── TRIAGE WORKTREE ────────────────────────────────────────────────────────
+class TestTriageWorktree(GitRepoMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.head = self._commit("initial", "src.cs")
+        self.cwds = []
+
+    def _dispatch(self, outputs, scribble=True):
+        outputs = list(outputs)
+
+        def fake(agent, prompt, **kw):
+            cwd = orch._agent_cwd()
+            self.cwds.append(cwd)
+            if scribble:
+                (cwd / "src.cs").write_text("agent edit\n")
+                (cwd / "new.cs").write_text("agent file\n")
+            out = outputs.pop(0)
+            orch._dispatch_local.timed_out = out is None
+            return out
+        return fake
+
+    def test_triage_runs_in_worktree_and_leaves_repo_alone(self):
+        (self.repo / "src.cs").write_text("implementer in progress\n")
+        reply = '{"decision": "wontfix", "reason": "r", "priority": "P4-debt"}'
+        with patch.object(orch, "_agent_dispatch", side_effect=self._dispatch([None, reply])), \
+                patch.object(orch, "AGENT_CHAIN", ["codex", "claude"]), \
+                patch.object(orch, "AGENT_FALLBACK_ENABLED", True):
+            triage, agent = orch.chain_triage({"number": 7, "title": "t", "body": "b"})
+        self.assertEqual((triage["decision"], agent), ("wontfix", "claude"))
+        tree = self.cwds[0]
+        self.assertNotEqual(tree, self.repo)
+        self.assertEqual(self.cwds, [tree, tree])
+        # The implementer's edit survives; nothing the agent wrote reached the repo
+        self.assertEqual((self.repo / "src.cs").read_text(), "implementer in progress\n")
+        self.assertFalse((self.repo / "new.cs").exists())
+        self.assertIsNone(orch._dispatch_local.cwd)
+
+    def test_worktree_is_reset_and_reused(self):
+        with orch.triage_tree() as tree:
+            (tree / "src.cs").write_text("dirty\n")
+            (tree / "junk.txt").write_text("junk\n")
+        head2 = self._commit("second", "src.cs")
+        with orch.triage_tree() as again:
+            self.assertEqual(again, tree)
+            self.assertEqual((tree / "src.cs").read_text(), "x\nx\n")
+            self.assertFalse((tree / "junk.txt").exists())
+            rev = subprocess.run(["git", "rev-parse", "HEAD"], cwd=str(tree),
+                                 capture_output=True, text=True).stdout.strip()
+            self.assertEqual(rev, head2)
+
+    def test_worker_uses_own_trees_and_removes_them(self):
+        orch._git_owner = False
+        try:
+            with orch.triage_tree() as tree:
+                self.assertEqual(tree.name, f"repo-worker{os.getpid()}-1")
+                self.assertTrue((tree / "src.cs").exists())
+            orch.remove_triage_trees()
+            self.assertFalse(tree.exists())
+            with patch.object(orch, "_sync_triage_tree", return_value=False), \
+                    patch.object(orch, "_agent_dispatch") as dispatch:
+                self.assertEqual(orch.chain_triage({"number": 9, "title": "t"}), (None, None))
+            dispatch.assert_not_called()        # never falls back to the owner's checkout
+        finally:
+            orch._git_owner = True
+
+    def test_no_taskkill_from_triage_thread(self):
+        orch._dispatch_local.cwd = self.tmpdir
+        try:
+            with patch("iis_orchestrator.subprocess.run") as run:
+                orch.kill_stale_processes()
+            run.assert_not_called()
+        finally:
+            orch._dispatch_local.cwd = None
+
+    def test_without_worktree_triage_waits_for_implement(self):
+        order = []
+        orch._tree_lock.acquire()
+
+        def fake(agent, prompt, **kw):
+            order.append("triage")
+            return '{"decision": "needs_info", "reason": "r"}'
+
+        with patch.object(orch, "_sync_triage_tree", return_value=False), \
+                patch.object(orch, "_agent_dispatch", side_effect=fake):
+            t = threading.Thread(target=orch.chain_triage, args=({"number": 8, "title": "t"},))
+            t.start()
+            time.sleep(0.2)
+            order.append("implement done")
+            orch._tree_lock.release()
+            t.join(5)
+        self.assertEqual(order, ["implement done", "triage"])
+
+
+# ── OUTBOX ─────────────────────────────────────────────────────────────────
+class TestOutbox(TempFilesMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sent = []
+        self.push_ok = True
+        self.comment_ok = True
+        patchers = [
+            patch.object(orch, "git_push", side_effect=lambda: self.sent.append("push")
+                         or self.push_ok),
+            patch.object(orch, "_gh_comment_now",
+                         side_effect=lambda repo, num, body, state: self.sent.append(num)
+                         or self._comment(state)),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _comment(self, state):
+        if self.comment_ok:
+            state["last_post_ts"] = time.time()
+            state["daily_count"] += 1
+            orch._save_comment_rate(state)
+        return self.comment_ok
+
+    def _drain(self, box, now):
+        while box.process_once(now):
+            pass
+
+    def test_pushes_coalesce_and_comments_follow(self):
+        box = orch.Outbox()
+        box.push()
+        box.comment("o/r", 1, "fixed")
+        box.push()
+        box.comment("o/r", 2, "fixed")
+        self.assertEqual(self.sent, [])                 # queueing never touches the network
+        self._drain(box, time.time())
+        self.assertEqual(self.sent, ["push", 1])        # #2 waits for the comment interval
+        self._drain(box, time.time() + orch._COMMENT_RATE_MIN_INTERVAL + 1)
+        self.assertEqual(self.sent, ["push", 1, 2])
+        self.assertEqual(box.entries, [])
+
+    def test_failed_push_backs_off_and_blocks_comments(self):
+        box = orch.Outbox()
+        box.push()
+        box.comment("o/r", 1, "fixed")
+        self.push_ok = False
+        now = 1000.0
+        box.process_once(now)
+        self.assertFalse(box.process_once(now + 1))     # backing off, comment held
+        self.assertEqual(self.sent, ["push"])
+        self.push_ok = True
+        self._drain(box, now + orch.OUTBOX_RETRY_BASE_SECS)
+        self.assertEqual(self.sent, ["push", "push", 1])
+
+    def test_abandoned_push_holds_comments_until_next_push(self):
+        status = orch.Status()
+        with patch.object(orch.Outbox, "start"):        # drive it by hand
+            box = orch.start_outbox(status)
+        box.push()
+        box.comment("o/r", 1, "fix available in abc123")
+        self.push_ok = False
+        now = 1000.0
+        for _ in range(orch.OUTBOX_MAX_ATTEMPTS):
+            box.process_once(now)
+            now += orch.OUTBOX_RETRY_MAX_SECS
+        self.assertFalse(box.process_once(now))         # parked, comment still held
+        self.assertEqual(self.sent, ["push"] * orch.OUTBOX_MAX_ATTEMPTS)
+        self.assertEqual(len(box.entries), 2)
+        self.assertEqual(status.data["outbox_blocked"]["comments_held"], 1)
+        self.assertEqual(box._sendable(), [])           # drain has nothing to wait for
+        self.push_ok = True
+        box.push()                                      # next commit revives the push
+        self._drain(box, now)
+        self.assertEqual(self.sent[-2:], ["push", 1])
+        self.assertNotIn("outbox_blocked", status.data)
+
+    def test_parked_push_retried_next_run(self):
+        box = orch.Outbox()
+        box.push()
+        box.comment("o/r", 1, "fixed")
+        box.entries[0].update(abandoned=True, attempts=orch.OUTBOX_MAX_ATTEMPTS)
+        box._save()
+        again = orch.Outbox()
+        self._drain(again, time.time())
+        self.assertEqual(self.sent, ["push", 1])
+
+    def test_daily_limit_defers_instead_of_dropping(self):
+        orch._save_comment_rate({"last_post_ts": 0.0, "daily_count": orch._COMMENT_RATE_DAILY_LIMIT,
+                                 "daily_date": datetime.date.today().isoformat(), "log": []})
+        box = orch.Outbox()
+        box.comment("o/r", 1, "fixed")
+        self._drain(box, time.time())
+        self.assertEqual(self.sent, [])
+        self.assertEqual(len(box.entries), 1)
+        self.assertGreater(box.entries[0]["not_before"], time.time())
+
+    def test_survives_restart_mid_send(self):
+        box = orch.Outbox()
+        box.push()
+        box.entries[0]["sending"] = True
+        box._save()
+        again = orch.Outbox()
+        again.push()                                    # coalesces with the reloaded entry
+        self.assertEqual(len(again.entries), 1)
+        self._drain(again, time.time())
+        self.assertEqual(self.sent, ["push"])
+
+    def test_background_thread_drains(self):
+        box = orch.start_outbox()
+        box.push()
+        box.comment("o/r", 5, "fixed")
+        self.assertEqual(box.drain(timeout=5), 0)
+        self.assertEqual(self.sent, ["push", 5])
+
+
+# ── HEARTBEAT ──────────────────────────────────────────────────────────────
+class TestHeartbeat(TempFilesMixin, unittest.TestCase):
+
+    def _read(self):
+        return json.loads(orch.HEARTBEAT_FILE.read_text(encoding="utf-8"))
+
+    def test_beat_lists_children_with_deadlines(self):
+        status = orch.Status()
+        status.set_phase("issues")
+        hb = orch.Heartbeat(status=status)
+        with hb.child(4242, ["C:/tools/claude.cmd", "-p"], timeout=600):
+            hb.beat()
+            data = self._read()
+        self.assertEqual(data["pid"], os.getpid())
+        self.assertEqual(data["phase"], "issues")
+        child = data["children"][0]
+        self.assertEqual((child["pid"], child["cmd"]), (4242, "claude.cmd"))
+        self.assertAlmostEqual(child["deadline"] - child["started"], 600, delta=0.2)
+        hb.beat()
+        self.assertEqual(self._read()["children"], [])
+        self.assertEqual(self._read()["seq"], 2)
+
+    def test_subprocesses_are_announced_while_running(self):
+        seen = []
+        hb = orch.start_heartbeat()
+        real_run = subprocess.run
+
+        def fake_run(cmd, **kw):
+            seen.append(hb.snapshot()["children"])
+            return real_run([sys.executable, "-c", "pass"], **kw)
+
+        try:
+            with patch("iis_orchestrator.subprocess.run", side_effect=fake_run):
+                orch._run(["dotnet", "build"], timeout=30, cwd=str(self.tmpdir))
+            self.assertEqual(seen[0][0]["cmd"], "dotnet")
+            self.assertEqual(hb.snapshot()["children"], [])
+            self.assertTrue(orch.HEARTBEAT_FILE.exists())
+        finally:
+            orch.stop_heartbeat()
+        self.assertFalse(orch.HEARTBEAT_FILE.exists())
+
+    def test_no_heartbeat_is_a_noop(self):
+        with orch.heartbeat_child(1, ["git"], 10):
+            pass
+        self.assertFalse(orch.HEARTBEAT_FILE.exists())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
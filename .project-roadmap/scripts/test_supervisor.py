@@ -15,6 +15,7 @@ import datetime
 import json
 import os
 import tempfile
+import time
 import unittest
 from pathlib import Path
 from unittest.mock import MagicMock, patch
@@ -33,17 +34,28 @@ class TempFilesMixin:
         self._orig_status = sup.STATUS_FILE
         self._orig_rate = sup.RATE_LIMIT_FILE
         self._orig_log = sup.LOG_FILE
+        self._orig_events = sup.EVENTS_FILE
+        self._orig_heartbeat = sup.HEARTBEAT_FILE
+        self._orig_history = sup.HISTORY_FILE
 
         sup.LOCK_FILE = Path(self.tmpdir) / "orchestrator.lock"
         sup.STATUS_FILE = Path(self.tmpdir) / "orchestrator-status.json"
         sup.RATE_LIMIT_FILE = Path(self.tmpdir) / "_agent_rate_limits.json"
         sup.LOG_FILE = Path(self.tmpdir) / "orchestrator.log"
+        sup.EVENTS_FILE = Path(self.tmpdir) / "orchestrator-events.jsonl"
+        sup.HEARTBEAT_FILE = Path(self.tmpdir) / "orchestrator-heartbeat.json"
+        sup.HISTORY_FILE = Path(self.tmpdir) / "supervisor-history.json"
+        sup._json_cache.clear()
+        sup._snapshot = None
 
     def tearDown(self):
         sup.LOCK_FILE = self._orig_lock
         sup.STATUS_FILE = self._orig_status
         sup.RATE_LIMIT_FILE = self._orig_rate
         sup.LOG_FILE = self._orig_log
+        sup.EVENTS_FILE = self._orig_events
+        sup.HEARTBEAT_FILE = self._orig_heartbeat
+        sup.HISTORY_FILE = self._orig_history
 
         import shutil
         shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -352,6 +364,105 @@ class TestFM6HungProcess(TempFilesMixin, unittest.TestCase):
         self.assertEqual(status.failures[0]["mode"], "hung_process")
 
 
+    def test_recent_event_counts_as_progress(self):
+        old = (datetime.datetime.now()
+               - datetime.timedelta(minutes=20)).isoformat()
+        self._write_json(sup.STATUS_FILE, {"running": True, "last_updated": old})
+        self._write_text(sup.EVENTS_FILE, json.dumps(
+            {"ts": datetime.datetime.now().isoformat(), "type": "build"}) + "\n")
+        checker = sup.HealthChecker()
+        status = checker.check_all()
+        self.assertNotIn("hung_process", [f["mode"] for f in status.failures])
+
+    def _heartbeat(self, age=1, children=()):
+        now = time.time()
+        self._write_json(sup.LOCK_FILE, {"pid": os.getpid(), "started": "2026-01-01"})
+        self._write_json(sup.HEARTBEAT_FILE, {
+            "pid": os.getpid(), "ts": now - age, "seq": 7, "children": list(children)})
+
+    def _stale_status(self):
+        old = (datetime.datetime.now() - datetime.timedelta(minutes=40)).isoformat()
+        self._write_json(sup.STATUS_FILE, {"running": True, "last_updated": old})
+
+    def _hung(self):
+        status = sup.HealthStatus(healthy=True)
+        sup.HealthChecker()._check_hung_process(status)
+        return status
+
+    def test_long_agent_call_within_timeout_is_ok(self):
+        self._stale_status()
+        now = time.time()
+        self._heartbeat(children=[{"pid": 4242, "cmd": "claude", "started": now - 2400,
+                                   "deadline": now + 1200}])
+        status = self._hung()
+        self.assertTrue(status.healthy)
+        self.assertEqual(status.details["subprocess"]["cmd"], "claude")
+
+    def test_stopped_heartbeat_detected(self):
+        self._write_json(sup.STATUS_FILE, {
+            "running": True, "last_updated": datetime.datetime.now().isoformat()})
+        self._heartbeat(age=sup.HEARTBEAT_STALE_SECONDS + 10)
+        status = self._hung()
+        self.assertFalse(status.healthy)
+        self.assertIn("No heartbeat", status.failures[0]["detail"])
+
+    def test_subprocess_past_timeout_detected(self):
+        now = time.time()
+        self._heartbeat(children=[{"pid": 4242, "cmd": "codex", "started": now - 4000,
+                                   "deadline": now - sup.CHILD_OVERRUN_GRACE_SECONDS - 5}])
+        status = self._hung()
+        self.assertFalse(status.healthy)
+        self.assertIn("past its timeout", status.failures[0]["detail"])
+
+    def test_idle_heartbeat_falls_back_to_status_age(self):
+        self._stale_status()
+        self._heartbeat()
+        self.assertFalse(self._hung().healthy)
+
+    def test_heartbeat_of_other_pid_ignored(self):
+        self._stale_status()
+        self._heartbeat(children=[{"pid": 1, "cmd": "claude", "started": time.time(),
+                                   "deadline": time.time() + 600}])
+        self._write_json(sup.LOCK_FILE, {"pid": os.getpid() + 1, "started": "2026-01-01"})
+        self.assertFalse(self._hung().healthy)
+
+
+# ── EVENT STREAM ────────────────────────────────────────────────────────────
+class TestEventTail(TempFilesMixin, unittest.TestCase):
+
+    def _append(self, *events, partial=""):
+        with open(sup.EVENTS_FILE, "a", encoding="utf-8") as f:
+            for e in events:
+                f.write(json.dumps(e) + "\n")
+            f.write(partial)
+
+    def test_reads_only_new_complete_lines(self):
+        tail = sup.EventTail()
+        self.assertEqual(tail.read_new(), [])
+        self._append({"type": "a"}, partial='{"type": "b"')
+        self.assertEqual([e["type"] for e in tail.read_new()], ["a"])
+        self._append(partial='}\n')
+        self.assertEqual([e["type"] for e in tail.read_new()], ["b"])
+        self.assertEqual(tail.read_new(), [])
+
+    def test_restarts_after_rotation(self):
+        tail = sup.EventTail()
+        self._append({"type": "a"}, {"type": "b"})
+        tail.read_new()
+        sup.EVENTS_FILE.unlink()
+        self._append({"type": "c"})
+        self.assertEqual([e["type"] for e in tail.read_new()], ["c"])
+
+    def test_test_events_drive_actively_testing(self):
+        checker = sup.HealthChecker()
+        self._append({"ts": datetime.datetime.now().isoformat(), "type": "test_start"})
+        checker._poll_events()
+        self.assertTrue(checker._is_actively_testing())
+        self._append({"ts": datetime.datetime.now().isoformat(), "type": "test_end"})
+        checker._poll_events()
+        self.assertFalse(checker._is_actively_testing())
+
+
 # ── FM7: CRASHED PROCESS ───────────────────────────────────────────────────
 class TestFM7CrashedProcess(TempFilesMixin, unittest.TestCase):
 
@@ -437,6 +548,153 @@ class TestSupervisor(TempFilesMixin, unittest.TestCase):
         self.assertFalse(sup.LOCK_FILE.exists())
 
 
+# ── PROCESS SNAPSHOT / FILE WATCH ──────────────────────────────────────────
+class TestProcessSnapshot(TempFilesMixin, unittest.TestCase):
+
+    PROCS = [
+        sup.ProcInfo(10, "python.exe", "python iis_orchestrator.py issues"),
+        sup.ProcInfo(11, "python.exe", 'python "iis_orchestrator.py" worker --max-issues 5'),
+        sup.ProcInfo(12, "python3", "python3 orchestrator_supervisor.py --orchestrator-args iis_orchestrator.py"),
+        sup.ProcInfo(13, "testhost.exe", "testhost.exe"),
+        sup.ProcInfo(14, "testhost", "testhost"),
+        sup.ProcInfo(15, "python.exe", r"python iis_orchestrator.py --queue-db \\share\q.db worker"),
+        sup.ProcInfo(16, "python3", "python3 /opt/iis/iis_orchestrator.py --max-issues 5 worker"),
+    ]
+
+    def test_orchestrator_pids_exclude_workers_and_supervisor(self):
+        self.assertEqual(sup.ProcessSnapshot(self.PROCS).orchestrator_pids(), [10])
+
+    def test_count_matches_with_and_without_exe(self):
+        snap = sup.ProcessSnapshot(self.PROCS)
+        self.assertEqual(snap.count("testhost.exe"), 2)
+        self.assertEqual(snap.count("notepad.exe"), 0)
+
+    def test_check_all_enumerates_processes_once(self):
+        with patch.object(sup.ProcessSnapshot, "_capture", return_value=list(self.PROCS)) as cap, \
+                patch.object(sup.HealthChecker, "_is_actively_testing", return_value=False):
+            health = sup.HealthChecker().check_all()
+        self.assertEqual(cap.call_count, 1)
+        modes = {f["mode"] for f in health.failures}
+        self.assertIn(sup.FailureMode.FM3_PHANTOM_TESTS.value, modes)
+        self.assertNotIn(sup.FailureMode.FM2_MULTIPLE_INSTANCES.value, modes)
+
+    def test_read_json_cached_reparses_only_on_change(self):
+        self._write_json(sup.STATUS_FILE, {"running": True})
+        with patch("orchestrator_supervisor.json.loads", wraps=json.loads) as loads:
+            self.assertEqual(sup.read_json_cached(sup.STATUS_FILE), ({"running": True}, None))
+            sup.read_json_cached(sup.STATUS_FILE)
+            self.assertEqual(loads.call_count, 1)
+            self._write_json(sup.STATUS_FILE, {"running": False, "x": 1})
+            data, error = sup.read_json_cached(sup.STATUS_FILE)
+        self.assertEqual(loads.call_count, 2)
+        self.assertFalse(data["running"])
+        self.assertIsNone(error)
+
+    def test_read_json_cached_reports_corruption(self):
+        self._write_text(sup.STATUS_FILE, '{"running": tr')
+        data, error = sup.read_json_cached(sup.STATUS_FILE)
+        self.assertIsNone(data)
+        self.assertIsInstance(error, json.JSONDecodeError)
+        self.assertEqual(sup.read_json_cached(sup.LOCK_FILE), (None, None))
+
+    def test_file_watch_reports_changes_once(self):
+        watch = sup.FileWatch([sup.LOCK_FILE, sup.STATUS_FILE])
+        self.assertEqual(watch.changed(), [])
+        self._write_json(sup.LOCK_FILE, {"pid": 1})
+        self.assertEqual(watch.changed(), [sup.LOCK_FILE])
+        self.assertEqual(watch.changed(), [])
+        sup.LOCK_FILE.unlink()
+        self.assertEqual(watch.changed(), [sup.LOCK_FILE])
+
+    def test_wait_for_change_wakes_on_status_stop(self):
+        self._write_json(sup.STATUS_FILE, {"running": True})
+        supervisor = sup.Supervisor()
+        self._write_json(sup.STATUS_FILE, {"running": False, "phase": "done"})
+        with patch("orchestrator_supervisor.time.sleep"), \
+                patch("orchestrator_supervisor.MIN_CHECK_INTERVAL", 0):
+            self.assertEqual(supervisor._wait_for_change(60), "status")
+
+
+# ── SUPERVISOR HISTORY ─────────────────────────────────────────────────────
+class TestSupervisorHistory(TempFilesMixin, unittest.TestCase):
+
+    def _failure(self, hist, mode, at, success=True):
+        hist.record_failure({"mode": mode.value, "detail": "x"},
+                            sup.RecoveryResult(mode=mode, success=success,
+                                               action_taken="t", verified=success), 1.5)
+        hist.data["incidents"][-1]["at"] = at
+
+    def test_counters_runs_and_outages_persist(self):
+        hist = sup.SupervisorHistory()
+        self._failure(hist, sup.FailureMode.FM7_CRASHED_PROCESS, time.time())
+        self._failure(hist, sup.FailureMode.FM7_CRASHED_PROCESS, time.time(), success=False)
+        hist.record_start(111)
+        hist.data["runs"][-1]["started"] -= 600
+        run = hist.record_exit(111, 3)
+        hist.record_outage(time.time() - 42, ["crashed_process", "crashed_process"])
+        hist.save()
+
+        again = sup.SupervisorHistory()
+        agg = again.data["failures"]["crashed_process"]
+        self.assertEqual((agg["count"], agg["recovered"], agg["action_s"]), (2, 1, 3.0))
+        self.assertEqual(run["exit_code"], 3)
+        self.assertAlmostEqual(again.data["runs"][0]["uptime_s"], 600, delta=1)
+        self.assertEqual(again.data["outages"][0]["modes"], ["crashed_process"])
+        report = again.report()
+        self.assertIn("crashed_process", report)
+        self.assertIn("3×1", report)
+        self.assertIn("Time to recover: 1 outages", report)
+
+    def test_crash_loop_needs_repeats_within_window(self):
+        hist = sup.SupervisorHistory()
+        now = time.time()
+        old = now - (sup.CRASH_LOOP_WINDOW_MINUTES + 1) * 60
+        self._failure(hist, sup.FailureMode.FM6_HUNG_PROCESS, old)
+        self._failure(hist, sup.FailureMode.FM6_HUNG_PROCESS, now - 60)
+        self._failure(hist, sup.FailureMode.FM8_STALE_PROCESSES, now - 50)
+        self._failure(hist, sup.FailureMode.FM8_STALE_PROCESSES, now - 40)
+        self._failure(hist, sup.FailureMode.FM8_STALE_PROCESSES, now - 30)
+        self.assertIsNone(hist.detect_crash_loop(now))     # FM8 never loops
+        self._failure(hist, sup.FailureMode.FM6_HUNG_PROCESS, now - 10)
+        self.assertIsNone(hist.detect_crash_loop(now))
+        self._failure(hist, sup.FailureMode.FM6_HUNG_PROCESS, now - 5)
+        self.assertEqual(hist.detect_crash_loop(now), "hung_process")
+
+    def test_repeated_exit_code_pauses_restarts(self):
+        hist = sup.SupervisorHistory()
+        for pid in (1, 2, 3):
+            hist.record_start(pid)
+            hist.record_exit(pid, 2)
+        now = time.time()
+        self.assertEqual(hist.detect_crash_loop(now), "exit:2")
+        until = hist.pause("exit:2", now)
+        self.assertTrue(hist.paused(now))
+        self.assertFalse(hist.paused(until + 1))
+        # Failures before the pause ended don't count again
+        self.assertIsNone(hist.detect_crash_loop(until + 1))
+        self.assertIn("Crash loops: 1", hist.report())
+
+    def test_supervisor_records_exit_and_pauses(self):
+        supervisor = sup.Supervisor()
+        for pid in (101, 102, 103):
+            proc = MagicMock(pid=pid, returncode=1)
+            proc.poll.return_value = 1
+            supervisor._orchestrator_proc = proc
+            supervisor.history.record_start(pid)
+            supervisor._note_exit()
+            supervisor._note_exit()                 # recorded once
+        runs = sup.SupervisorHistory().data["runs"]
+        self.assertEqual([r["exit_code"] for r in runs], [1, 1, 1])
+        self.assertTrue(supervisor.history.paused())
+        self.assertIsNotNone(supervisor._down_since)
+
+    def test_stats_cli_prints_report(self):
+        with patch.object(sys, "argv", ["orchestrator_supervisor.py", "--stats"]), \
+                patch("builtins.print") as out:
+            sup.main()
+        self.assertIn("Supervisor stats", out.call_args[0][0])
+
+
 # ── UTILITY FUNCTIONS ───────────────────────────────────────────────────────
 class TestUtilities(unittest.TestCase):
 